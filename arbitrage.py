@@ -0,0 +1,120 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from database import CEDEAR_QUOTE_SUFFIX
+from snapshot import Snapshot, snapshots
+
+
+class ArbitrageInputs(NamedTuple):
+    cedear_symbols: List[str]
+    foreign_symbols: List[str]
+    foreign_price: np.ndarray
+    local_price: np.ndarray
+    cedear_ratio: np.ndarray
+    foreign_ratio: np.ndarray
+
+
+_cached: Optional[Tuple[Snapshot, ArbitrageInputs]] = None
+
+
+def build_inputs(snapshot: Snapshot) -> ArbitrageInputs:
+    # Precio del subyacente (foreign_symbol) y del CEDEAR en pesos (cedear_symbol + sufijo), del snapshot.
+    records = list(snapshot.instruments.values())
+    cedear_symbols = [record.cedear_symbol for record in records]
+    foreign_symbols = [record.foreign_symbol for record in records]
+    local_symbols = [symbol + CEDEAR_QUOTE_SUFFIX if symbol else None for symbol in cedear_symbols]
+    return ArbitrageInputs(
+        cedear_symbols=cedear_symbols,
+        foreign_symbols=foreign_symbols,
+        foreign_price=snapshot.prices.lookup("price", foreign_symbols),
+        local_price=snapshot.prices.lookup("price", local_symbols),
+        cedear_ratio=np.array([np.nan if record.cedear_ratio is None else record.cedear_ratio for record in records],
+                              dtype=np.float64),
+        foreign_ratio=np.array([np.nan if record.foreign_ratio is None else record.foreign_ratio
+                                for record in records], dtype=np.float64),
+    )
+
+
+def get_inputs() -> ArbitrageInputs:
+    # Se arma una vez por snapshot: el snapshot es inmutable y cada refresh o cambio de instrumentos publica otro,
+    # asi que nunca queda un resultado viejo cacheado ni hace falta ir a la base.
+    global _cached
+    snapshot = snapshots.current
+    if _cached is None or _cached[0] is not snapshot:
+        _cached = (snapshot, build_inputs(snapshot))
+    return _cached[1]
+
+
+def compute(inputs: ArbitrageInputs, reference_ccl: Optional[float] = None) -> Dict[str, np.ndarray]:
+    # cedear_ratio CEDEARs equivalen a foreign_ratio acciones del subyacente.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        usd_equivalent = inputs.foreign_price * inputs.foreign_ratio / inputs.cedear_ratio
+        implied_ccl = inputs.local_price / usd_equivalent
+        implied_ccl[~np.isfinite(implied_ccl)] = np.nan
+
+        if reference_ccl is None:
+            reference_ccl = float(np.nanmedian(implied_ccl)) if np.isfinite(implied_ccl).any() else np.nan
+
+        return {
+            "usd_equivalent": usd_equivalent,
+            "implied_local_price": usd_equivalent * reference_ccl,
+            "implied_ccl": implied_ccl,
+            "premium": implied_ccl / reference_ccl - 1,
+            "reference_ccl": np.float64(reference_ccl),
+        }
+
+
+def compute_naive(inputs: ArbitrageInputs, reference_ccl: Optional[float] = None) -> Dict[str, list]:
+    # Version fila por fila, solo como referencia para el benchmark.
+    usd_equivalent, implied_ccl = [], []
+    for foreign_price, local_price, cedear_ratio, foreign_ratio in zip(
+            inputs.foreign_price.tolist(), inputs.local_price.tolist(),
+            inputs.cedear_ratio.tolist(), inputs.foreign_ratio.tolist()):
+        usd = foreign_price * foreign_ratio / cedear_ratio if cedear_ratio else float("nan")
+        usd_equivalent.append(usd)
+        ccl = local_price / usd if usd else float("nan")
+        implied_ccl.append(ccl if ccl == ccl and abs(ccl) != float("inf") else float("nan"))
+
+    if reference_ccl is None:
+        finite = sorted(ccl for ccl in implied_ccl if ccl == ccl)
+        middle = len(finite) // 2
+        reference_ccl = (finite[middle] if len(finite) % 2 else (finite[middle - 1] + finite[middle]) / 2) \
+            if finite else float("nan")
+
+    return {
+        "usd_equivalent": usd_equivalent,
+        "implied_local_price": [usd * reference_ccl for usd in usd_equivalent],
+        "implied_ccl": implied_ccl,
+        "premium": [ccl / reference_ccl - 1 for ccl in implied_ccl],
+        "reference_ccl": reference_ccl,
+    }
+
+
+def to_json_values(values: np.ndarray) -> list:
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+
+
+if __name__ == '__main__':
+    import timeit
+
+    size = 10_000
+    rng = np.random.default_rng(0)
+    foreign_price = rng.uniform(5, 500, size)
+    cedear_ratio = rng.choice([1.0, 2.0, 5.0, 10.0, 20.0], size)
+    local_price = foreign_price / cedear_ratio * rng.normal(1000, 20, size)
+    local_price[rng.random(size) < 0.1] = np.nan
+    inputs = ArbitrageInputs([f"C{i}" for i in range(size)], [f"F{i}" for i in range(size)],
+                             foreign_price, local_price, cedear_ratio, np.ones(size))
+
+    vectorized = compute(inputs)
+    naive = compute_naive(inputs)
+    assert np.allclose(vectorized["premium"], naive["premium"], equal_nan=True)
+
+    runs = 20
+    vectorized_time = timeit.timeit(lambda: compute(inputs), number=runs) / runs
+    naive_time = timeit.timeit(lambda: compute_naive(inputs), number=runs) / runs
+    print(f"{size} instrumentos: vectorizado {vectorized_time * 1e3:.2f} ms, "
+          f"loop {naive_time * 1e3:.2f} ms ({naive_time / vectorized_time:.0f}x)")
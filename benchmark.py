@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end de refresh y lecturas contra un FMP falso.")
+    parser.add_argument("--sizes", default="100,1000,10000", help="cantidades de instrumentos, separadas por coma")
+    parser.add_argument("--database-url", default=None,
+                        help="por defecto un SQLite temporal; para Postgres pasar postgresql://... "
+                             "(se borran y recrean todas las tablas de esa base)")
+    parser.add_argument("--fmp-latency", type=float, default=20.0, help="latencia del FMP falso, en ms")
+    parser.add_argument("--concurrency", type=int, default=32, help="clientes concurrentes para las lecturas")
+    parser.add_argument("--requests", type=int, default=500, help="requests por endpoint de lectura")
+    parser.add_argument("--output", default="bench_output.json")
+    return parser.parse_args(argv)
+
+
+args = _parse_args() if __name__ == '__main__' else None
+
+# La configuracion se lee al importar database.py, por eso se fija antes de importar la app. La base es
+# siempre la de --database-url o un SQLite temporal, nunca la del entorno: el benchmark hace drop_all.
+FAKE_FMP_PORT = _free_port()
+BENCH_DATABASE_URL = (args and args.database_url) or f"sqlite:///{tempfile.gettempdir()}/screener_bench_{os.getpid()}.db"
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+for variable in ("ASYNC_DATABASE_URL", "DATABASE_REPLICA_URL"):
+    os.environ.pop(variable, None)
+os.environ["FMP_BASE_URL"] = f"http://127.0.0.1:{FAKE_FMP_PORT}"
+os.environ.setdefault("API_KEY", "benchmark")
+os.environ.setdefault("FMP_RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("FMP_MAX_CONCURRENCY", "20")
+os.environ["SCHEDULER_ENABLED"] = "false"
+
+import httpx
+import uvicorn
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models
+from cache import caches
+from conditional import load_versions
+from database import ASYNC_DATABASE_URL, engine, to_async_url
+from fake_fmp import FakeFMPConfig, create_app
+from indicators import indicators
+from main import app
+from registry import registry
+from snapshot import snapshots
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *_):
+        self.count += 1
+
+
+def _start_server(asgi_app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+
+    def pick(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "mean_ms": statistics.fmean(ordered) * 1000}
+
+
+async def _reset_database(size: int):
+    if ASYNC_DATABASE_URL != to_async_url(BENCH_DATABASE_URL):
+        raise SystemExit(f"El benchmark no borra {ASYNC_DATABASE_URL}: pasar la base con --database-url.")
+    # Engine propio: el de la app vive en el event loop del thread de uvicorn.
+    seed_engine = create_async_engine(ASYNC_DATABASE_URL)
+    async with seed_engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with async_sessionmaker(seed_engine)() as db:
+        rows = [{"cedear_symbol": f"C{i:05d}", "foreign_market": "NASDAQ", "foreign_symbol": f"B{i:05d}",
+                 "cedear_ratio": 10.0, "foreign_ratio": 1.0} for i in range(size)]
+        for start in range(0, len(rows), 1000):
+            await db.execute(insert(models.Instruments), rows[start:start + 1000])
+        await db.commit()
+        # El estado en memoria de la app se carga al arrancar: sin recargarlo los PUT masivos toman los
+        # instrumentos (y el write-skip compara contra los precios) del tamano anterior.
+        await registry.load(db)
+        await indicators.load(db)
+        await snapshots.load(db)
+        await load_versions(db)
+    await seed_engine.dispose()
+    for cache in caches.values():
+        cache.clear()
+
+
+async def _timed_put(client: httpx.AsyncClient, counter: QueryCounter, path: str, size: int) -> dict:
+    queries = counter.count
+    started = time.perf_counter()
+    response = await client.put(path, timeout=None)
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    return {"seconds": elapsed, "symbols_per_sec": size / elapsed, "db_queries": counter.count - queries}
+
+
+async def _load(client: httpx.AsyncClient, counter: QueryCounter, paths: List[str], concurrency: int,
+                total: int) -> dict:
+    queries = counter.count
+    await client.get(paths[0])
+    cold_queries = counter.count - queries
+
+    latencies: List[float] = []
+    pending = iter(range(total))
+
+    async def worker():
+        for index in pending:
+            started = time.perf_counter()
+            response = await client.get(paths[index % len(paths)])
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    queries = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {**_percentiles(latencies), "requests_per_sec": total / elapsed,
+            "db_queries_first_request": cold_queries, "db_queries_per_request": (counter.count - queries) / total}
+
+
+async def run_size(base_url: str, counter: QueryCounter, size: int, concurrency: int, total: int) -> dict:
+    await _reset_database(size)
+    symbols = [f"B{i:05d}" for i in range(0, size, max(1, size // 50))]
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        result = {
+            "instruments": size,
+            "put_stock_prices": await _timed_put(client, counter, "/stock_prices", size),
+            "put_company_rating": await _timed_put(client, counter, "/company_rating", size),
+            "get": {
+                "/stock_prices": await _load(client, counter, ["/stock_prices"], concurrency, total),
+                "/stock_prices/{symbol}": await _load(client, counter, [f"/stock_prices/{s}" for s in symbols],
+                                                      concurrency, total),
+                "/company_rating": await _load(client, counter, ["/company_rating"], concurrency, total),
+                "/company_rating/{symbol}": await _load(client, counter, [f"/company_rating/{s}" for s in symbols],
+                                                        concurrency, total),
+            },
+        }
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    _start_server(create_app(FakeFMPConfig(latency=args.fmp_latency, seed=0)), FAKE_FMP_PORT)
+    app_port = _free_port()
+    _start_server(app, app_port)
+    counter = QueryCounter()
+
+    loop = asyncio.new_event_loop()
+    results = []
+    for size in sizes:
+        result = loop.run_until_complete(run_size(f"http://127.0.0.1:{app_port}", counter, size,
+                                                  args.concurrency, args.requests))
+        results.append(result)
+        print(f"{size:>6} instrumentos: PUT /stock_prices {result['put_stock_prices']['seconds']:.2f}s "
+              f"({result['put_stock_prices']['symbols_per_sec']:.0f}/s), "
+              f"PUT /company_rating {result['put_company_rating']['seconds']:.2f}s "
+              f"({result['put_company_rating']['symbols_per_sec']:.0f}/s)")
+        for path, stats in result["get"].items():
+            print(f"        GET {path:<26} p50 {stats['p50_ms']:.1f}ms p95 {stats['p95_ms']:.1f}ms "
+                  f"p99 {stats['p99_ms']:.1f}ms, {stats['db_queries_per_request']:.2f} queries/request")
+    loop.close()
+
+    output = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "fmp_latency_ms": args.fmp_latency,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import csv
+import io
+from typing import Dict, List, NamedTuple, Tuple, Type
+
+import orjson
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy import column, literal_column, or_, select, table, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import UpsertResult, bulk_upsert
+from models import Instruments
+
+
+CSV = "csv"
+NDJSON = "ndjson"
+INSTRUMENT_FIELDS = ("cedear_symbol", "foreign_market", "foreign_symbol", "cedear_ratio", "foreign_ratio")
+MAX_REPORTED_ERRORS = 100
+
+STAGING_TABLE = "instruments_staging"
+# Sin id: la secuencia solo se usa en el INSERT final, no al copiar a la tabla temporal.
+CREATE_STAGING = text(f"CREATE TEMP TABLE {STAGING_TABLE} (cedear_symbol varchar, foreign_market varchar, "
+                      "foreign_symbol varchar, cedear_ratio double precision, foreign_ratio double precision) "
+                      "ON COMMIT DROP")
+
+
+class ImportResult(NamedTuple):
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: List[dict]
+
+
+def parse_csv(body: bytes) -> Tuple[List[Tuple[int, object]], List[dict]]:
+    # La primera linea es el encabezado con los nombres de campo de InstrumentsRequest.
+    reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+    return [(reader.line_num, row) for row in reader], []
+
+
+def parse_ndjson(body: bytes) -> Tuple[List[Tuple[int, object]], List[dict]]:
+    records, errors = [], []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            records.append((line_number, orjson.loads(line)))
+        except orjson.JSONDecodeError:
+            errors.append({"line": line_number, "error": "JSON invalido"})
+    return records, errors
+
+
+def validate(records: List[Tuple[int, object]], model: Type[BaseModel]) -> Tuple[List[dict], List[dict]]:
+    # Se valida el lote entero de una vez; si hay errores se descartan esas filas y se revalida el resto.
+    adapter = TypeAdapter(List[model])
+    rejected: Dict[int, dict] = {}
+    try:
+        validated = adapter.validate_python([data for _, data in records])
+    except ValidationError as e:
+        for error in e.errors():
+            index = error["loc"][0]
+            field = ".".join(str(part) for part in error["loc"][1:])
+            rejected.setdefault(index, {"line": records[index][0],
+                                        "error": f"{field}: {error['msg']}" if field else error["msg"]})
+        records = [record for index, record in enumerate(records) if index not in rejected]
+        validated = adapter.validate_python([data for _, data in records])
+
+    # Un foreign_symbol repetido en el archivo: gana la ultima aparicion, las anteriores se rechazan.
+    rows: Dict[str, Tuple[int, dict]] = {}
+    errors = list(rejected.values())
+    for (line_number, _), item in zip(records, validated):
+        row = item.model_dump()
+        if row["foreign_symbol"] in rows:
+            errors.append({"line": rows[row["foreign_symbol"]][0],
+                           "error": f"foreign_symbol duplicado en el archivo (ver linea {line_number})"})
+        rows[row["foreign_symbol"]] = (line_number, row)
+    return [row for _, row in rows.values()], errors
+
+
+async def copy_upsert_instruments(db: AsyncSession, rows: List[dict]) -> UpsertResult:
+    # COPY a una tabla temporal y un unico INSERT ... SELECT ... ON CONFLICT (foreign_symbol) contra instruments.
+    await db.execute(CREATE_STAGING)
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        STAGING_TABLE, columns=INSTRUMENT_FIELDS,
+        records=[tuple(row[field] for field in INSTRUMENT_FIELDS) for row in rows])
+
+    target = Instruments.__table__
+    staging = table(STAGING_TABLE, *(column(field) for field in INSTRUMENT_FIELDS))
+    update_columns = [field for field in INSTRUMENT_FIELDS if field != "foreign_symbol"]
+    stmt = postgresql.insert(target).from_select(INSTRUMENT_FIELDS, select(*staging.c))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[target.c.foreign_symbol],
+        set_={field: stmt.excluded[field] for field in update_columns},
+        where=or_(*[target.c[field].is_distinct_from(stmt.excluded[field]) for field in update_columns]),
+    ).returning(target.c.foreign_symbol, literal_column("xmax = 0"))
+    # xmax = 0 solo en las filas recien insertadas; las actualizadas traen el xid de esta transaccion.
+    written = (await db.execute(stmt)).all()
+
+    inserted = sum(1 for _, is_insert in written if is_insert)
+    return UpsertResult(inserted=inserted, updated=len(written) - inserted, unchanged=len(rows) - len(written))
+
+
+async def import_instruments(db: AsyncSession, body: bytes, format: str, model: Type[BaseModel]) -> ImportResult:
+    records, errors = parse_csv(body) if format == CSV else parse_ndjson(body)
+    rows, rejected = validate(records, model)
+    errors = sorted(errors + rejected, key=lambda error: error["line"])
+
+    result = UpsertResult()
+    if rows and db.bind.dialect.name == "postgresql":
+        result = await copy_upsert_instruments(db, rows)
+    elif rows:
+        result = await bulk_upsert(db, Instruments, rows, key="foreign_symbol")
+
+    return ImportResult(inserted=result.inserted, updated=result.updated, unchanged=result.unchanged,
+                        rejected=len(errors), errors=errors[:MAX_REPORTED_ERRORS])
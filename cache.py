@@ -0,0 +1,148 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Union
+
+from database import CACHE_URL, RESPONSE_CACHE_MAXSIZE, RESPONSE_CACHE_TTL
+
+
+logger = logging.getLogger(__name__)
+
+caches: Dict[str, Union["TTLCache", "RedisCache"]] = {}
+
+
+class TTLCache:
+    # Propio de cada proceso: las claves no necesitan identificar el contenido, clear() lo vacia en cada cambio.
+    # get/set/invalidate son async solo para compartir la interfaz con RedisCache.
+    shared = False
+
+    def __init__(self, name: str, maxsize: int = RESPONSE_CACHE_MAXSIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        caches[name] = self
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def invalidate(self, *keys: Hashable):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def measure(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RedisCache:
+    # Backend compartido entre workers (CACHE_URL=redis://...), misma interfaz que TTLCache. Guarda bytes.
+    # Cliente asyncio: mientras Redis responde el event loop sigue atendiendo. Si no responde se sigue sin cache.
+    shared = True
+
+    def __init__(self, name: str, url: str, ttl: float = RESPONSE_CACHE_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL requiere el paquete redis (pip install redis).")
+        self.name = name
+        self.maxsize = 0
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+        self._prefix = f"screener:{name}:"
+        caches[name] = self
+
+    def _key(self, key: Hashable) -> str:
+        return self._prefix + repr(key)
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = await self._client.get(self._key(key))
+        except self._errors:
+            logger.warning("Cache %s: Redis no disponible", self.name, exc_info=True)
+            value = None
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    async def set(self, key: Hashable, value: bytes):
+        try:
+            await self._client.set(self._key(key), value, px=int(self.ttl * 1000))
+        except self._errors:
+            logger.warning("Cache %s: Redis no disponible", self.name, exc_info=True)
+
+    async def invalidate(self, *keys: Hashable):
+        if keys:
+            try:
+                await self._client.delete(*map(self._key, keys))
+            except self._errors:
+                logger.warning("Cache %s: Redis no disponible", self.name, exc_info=True)
+
+    def clear(self):
+        # No se borra nada: las claves llevan la huella del snapshot (ver serialization.table_response), asi
+        # un cambio en un worker no tira lo que otro ya codifico. Lo viejo vence por ttl.
+        pass
+
+    async def measure(self):
+        # Cuenta las claves en Redis para stats(), que no puede esperar: la llama el collector de Prometheus.
+        try:
+            self._size = len([key async for key in self._client.scan_iter(match=self._prefix + "*", count=1000)])
+        except self._errors:
+            logger.warning("Cache %s: Redis no disponible", self.name, exc_info=True)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def response_cache(name: str) -> Union[TTLCache, RedisCache]:
+    return RedisCache(name, CACHE_URL) if CACHE_URL else TTLCache(name)
+
+
+prices_cache = response_cache("stock_prices")
+ratings_cache = response_cache("company_rating")
@@ -0,0 +1,78 @@
+import time
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from models import StockPrice
+
+
+# Distingue los contadores de este proceso de los de un arranque anterior (o de otro worker).
+_BOOT_ID = format(time.time_ns(), "x")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+class TableVersion:
+    # Validador de los endpoints de lista: se incrementa en cada escritura de la tabla, asi un GET
+    # condicional se contesta con 304 sin tocar la base.
+    def __init__(self, name: str):
+        self.name = name
+        self.version = 0
+        self.last_modified = _now()
+
+    def bump(self):
+        self.version += 1
+        self.last_modified = _now()
+
+    def etag(self, variant: str = "") -> str:
+        # Cada combinacion de query params (pagina, formato) es una representacion distinta.
+        return f'"{self.name}-{_BOOT_ID}-{self.version}-{zlib.crc32(variant.encode()):x}"'
+
+
+stock_prices_version = TableVersion("stock_prices")
+company_rating_version = TableVersion("company_rating")
+instruments_version = TableVersion("instruments")
+
+
+async def load_versions(db: AsyncSession):
+    # Last-Modified de stock_prices arranca en el quote mas reciente guardado.
+    latest = (await db.execute(select(func.max(StockPrice.timestamp)))).scalar()
+    if latest:
+        stock_prices_version.last_modified = datetime.fromtimestamp(latest, timezone.utc)
+
+
+def symbol_etag(symbol: str, digest: str) -> str:
+    return f'"{symbol}-{digest}"'
+
+
+def not_modified(request: Request, etag: str, last_modified: datetime) -> Optional[Response]:
+    # If-None-Match tiene prioridad; If-Modified-Since solo se evalua si no vino un ETag.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        matches = "*" in tags or etag in tags
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        try:
+            matches = if_modified_since is not None and last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            matches = False
+
+    if not matches:
+        return None
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response: Response, etag: str, last_modified: datetime):
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from conditional import company_rating_version, instruments_version, stock_prices_version
+from database import AsyncSessionLocal, LEADER_RETRY_INTERVAL, engine
+from indicators import indicators
+from price_stream import broker
+from registry import registry
+from snapshot import snapshots
+
+
+logger = logging.getLogger(__name__)
+
+QUOTES = "quotes"
+RATINGS = "ratings"
+INSTRUMENTS = "instruments"
+
+CHANNEL = "screener_changes"
+# NOTIFY acepta hasta 8000 bytes de payload: las listas de simbolos largas se parten en varios avisos.
+MAX_SYMBOLS_BYTES = 7000
+# Identifica a este proceso en los avisos, para ignorar los propios.
+WORKER_ID = uuid.uuid4().hex
+
+# Callbacks (kind, symbols) cuando otro worker guardo un refresh, p.ej. el scheduler del lider.
+change_listeners: List[Callable[[str, List[str]], None]] = []
+
+
+class RefreshInProgress(Exception):
+    pass
+
+
+def _postgres() -> bool:
+    # La coordinacion entre workers necesita Postgres; con SQLite se asume un solo proceso.
+    return engine.dialect.name == "postgresql"
+
+
+def _lock_key(name: str) -> int:
+    return zlib.crc32(f"screener:{name}".encode())
+
+
+def _payloads(kind: str, symbols: Optional[Sequence[str]], written: bool) -> Iterator[str]:
+    def payload(symbols: Optional[List[str]]) -> str:
+        return orjson.dumps({"origin": WORKER_ID, "kind": kind, "symbols": symbols, "written": written}).decode()
+
+    if symbols is None:
+        yield payload(None)
+        return
+    chunk, size = [], 0
+    for symbol in symbols:
+        length = len(symbol.encode()) + 3
+        if chunk and size + length > MAX_SYMBOLS_BYTES:
+            yield payload(chunk)
+            chunk, size = [], 0
+        chunk.append(symbol)
+        size += length
+    if chunk:
+        yield payload(chunk)
+
+
+async def notify(db: AsyncSession, kind: str, symbols: Optional[Sequence[str]] = None, written: bool = True):
+    # Se llama antes del commit: Postgres entrega el aviso recien al confirmar, y nunca si hay rollback.
+    # Sin simbolos los demas workers releen la tabla entera. written=False avisa un batch sin cambios (todo
+    # igual a lo guardado): los demas solo lo dan por refrescado, sin releer.
+    if db.bind.dialect.name != "postgresql":
+        return
+    for payload in _payloads(kind, symbols, written):
+        await db.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+async def apply_change(db: AsyncSession, kind: str, symbols: Optional[List[str]], written: bool = True):
+    # Lo que otro worker ya guardo se trae de la base, sin volver a pedirlo a FMP. Si el batch se salteo
+    # entero no hay nada que traer; y si lo escrito resulta igual a lo que ya tenia este worker, tampoco hay
+    # swap ni version nueva: los caches y los ETag de este worker siguen valiendo.
+    if kind == QUOTES and written:
+        changed = await snapshots.reload_prices(db, symbols)
+        if changed is not None:
+            if symbols is None:
+                await indicators.load(db)
+            else:
+                await indicators.reload(db, symbols)
+            broker.publish(changed)
+            stock_prices_version.bump()
+    elif kind == RATINGS and written:
+        if await snapshots.reload_ratings(db, symbols):
+            company_rating_version.bump()
+    elif kind == INSTRUMENTS:
+        await registry.load(db)
+        instruments_version.bump()
+    if symbols is not None:
+        for listener in change_listeners:
+            listener(kind, symbols)
+
+
+class ChangeListener:
+    # LISTEN en una conexion dedicada del primario; los avisos se aplican de a uno en otra tarea. Si la
+    # conexion se corta, al reconectar se relee todo porque los avisos de mientras tanto se perdieron.
+    def __init__(self, retry_interval: float = LEADER_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def _received(self, connection, pid: int, channel: str, payload: str):
+        message = orjson.loads(payload)
+        if message.get("origin") != WORKER_ID:
+            self._queue.put_nowait(message)
+
+    async def _listen(self):
+        reconnected = False
+        while True:
+            closed = asyncio.Event()
+            try:
+                async with engine.connect() as connection:
+                    try:
+                        raw = (await connection.get_raw_connection()).driver_connection
+                        await raw.add_listener(CHANNEL, self._received)
+                        raw.add_termination_listener(lambda _: closed.set())
+                        if reconnected:
+                            for kind in (INSTRUMENTS, QUOTES, RATINGS):
+                                self._queue.put_nowait({"kind": kind, "symbols": None})
+                        await closed.wait()
+                    finally:
+                        # No vuelve al pool con el LISTEN activo.
+                        await connection.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Fallo la conexion de LISTEN %s", CHANNEL)
+            logger.warning("Se corto el LISTEN %s, se reconecta en %ss", CHANNEL, self.retry_interval)
+            reconnected = True
+            await asyncio.sleep(self.retry_interval)
+
+    async def _apply(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await apply_change(db, message["kind"], message["symbols"], message.get("written", True))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("No se pudo aplicar el aviso %s", message)
+
+    async def start(self):
+        if _postgres():
+            self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._apply())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class Leadership:
+    # Solo el worker que tiene el advisory lock de sesion `name` corre lo que se arranca en elected(). La
+    # conexion que lo sostiene queda abierta mientras dure el liderazgo: si se corta, Postgres suelta el lock
+    # y otro worker lo toma en su proximo intento.
+    def __init__(self, name: str, retry_interval: float = LEADER_RETRY_INTERVAL):
+        self.name = name
+        self.retry_interval = retry_interval
+        self.leader = False
+
+    async def run(self, elected: Callable[[], Awaitable[None]], deposed: Callable[[], Awaitable[None]]):
+        if not _postgres():
+            self.leader = True
+            await elected()
+            return
+        key = _lock_key(self.name)
+        while True:
+            try:
+                async with engine.connect() as connection:
+                    acquired = await connection.scalar(select(func.pg_try_advisory_lock(key)))
+                    await connection.commit()
+                    if acquired:
+                        try:
+                            self.leader = True
+                            logger.info("Worker %s toma el liderazgo de %s", WORKER_ID, self.name)
+                            await elected()
+                            while True:
+                                await asyncio.sleep(self.retry_interval)
+                                await connection.scalar(select(1))
+                                await connection.commit()
+                        finally:
+                            self.leader = False
+                            await deposed()
+                            # Cerrar la sesion suelta el lock aunque no se pueda ejecutar el unlock.
+                            await connection.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Se perdio la conexion del liderazgo de %s", self.name)
+            await asyncio.sleep(self.retry_interval)
+
+
+# Sin Postgres: cuantos refreshes programados tienen el lock de cada tipo, o -1 si lo tiene un refresh masivo.
+_local_holders: Dict[str, int] = {}
+
+
+@asynccontextmanager
+async def _refresh_lock(name: str, shared: bool):
+    if not _postgres():
+        holders = _local_holders.get(name, 0)
+        if holders < 0 or (holders and not shared):
+            raise RefreshInProgress(name)
+        _local_holders[name] = holders + 1 if shared else -1
+        try:
+            yield
+        finally:
+            _local_holders[name] = _local_holders[name] - 1 if shared else 0
+        return
+
+    key = _lock_key(name)
+    try_lock, unlock = ((func.pg_try_advisory_lock_shared, func.pg_advisory_unlock_shared) if shared
+                        else (func.pg_try_advisory_lock, func.pg_advisory_unlock))
+    async with engine.connect() as connection:
+        acquired = await connection.scalar(select(try_lock(key)))
+        await connection.commit()
+        if not acquired:
+            raise RefreshInProgress(name)
+        try:
+            yield
+        finally:
+            await connection.scalar(select(unlock(key)))
+            await connection.commit()
+
+
+def exclusive(name: str):
+    # Un solo refresh masivo por tipo entre todos los workers, y nunca junto con un batch del scheduler: el
+    # que llega segundo no espera, recibe RefreshInProgress.
+    return _refresh_lock(name, shared=False)
+
+
+def shared(name: str):
+    # Para los batches del scheduler: conviven entre si, pero no con un refresh masivo del mismo tipo.
+    return _refresh_lock(name, shared=True)
+
+
+changes = ChangeListener()
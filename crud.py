@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import Float, Integer, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import CompanyRating, StockPrice
+
+
+UPSERT_CHUNK_SIZE = 500
+
+# columna de StockPrice -> campo del quote de FMP
+STOCK_PRICE_FIELDS = {
+    "symbol": "symbol",
+    "name": "name",
+    "price": "price",
+    "changes_percentage": "changesPercentage",
+    "change": "change",
+    "day_low": "dayLow",
+    "day_high": "dayHigh",
+    "year_high": "yearHigh",
+    "year_low": "yearLow",
+    "market_cap": "marketCap",
+    "price_avg50": "priceAvg50",
+    "price_avg200": "priceAvg200",
+    "exchange": "exchange",
+    "volume": "volume",
+    "avg_volume": "avgVolume",
+    "open": "open",
+    "previous_close": "previousClose",
+    "eps": "eps",
+    "pe": "pe",
+    "earnings_announcement": "earningsAnnouncement",
+    "shares_outstanding": "sharesOutstanding",
+    "timestamp": "timestamp",
+}
+
+
+# Columnas de StockPrice cuyo cambio se publica a los suscriptores del stream de precios.
+STOCK_PRICE_TRACKED = ("price", "timestamp")
+
+
+class UpsertResult(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # Filas escritas en las que cambio alguna de las columnas de `track` (ver bulk_upsert).
+    changed: Tuple[dict, ...] = ()
+    # Filas descartadas antes de llegar a la base porque eran iguales a lo guardado (ver refresh.py).
+    skipped: int = 0
+    skipped_symbols: Tuple[str, ...] = ()
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+
+def _parse_datetime(value: Optional[Union[str, datetime]]) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _numeric_columns(model) -> Tuple[str, ...]:
+    return tuple(column.name for column in model.__table__.columns
+                 if isinstance(column.type, (Float, Integer)) and column.name != "id")
+
+
+STOCK_PRICE_NUMERIC = _numeric_columns(StockPrice)
+COMPANY_RATING_NUMERIC = _numeric_columns(CompanyRating)
+
+
+def _check_numeric(values: dict, columns: Sequence[str]):
+    # Un valor no numerico de FMP no puede llegar al snapshot ni a la base: falla solo ese simbolo.
+    for column in columns:
+        value = values.get(column)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{column} no es numerico: {value!r}")
+
+
+def stock_price_from_quote(stock_data: dict) -> dict:
+    values = {column: stock_data.get(field) for column, field in STOCK_PRICE_FIELDS.items()}
+    values["earnings_announcement"] = _parse_datetime(values["earnings_announcement"])
+    _check_numeric(values, STOCK_PRICE_NUMERIC)
+    return values
+
+
+def company_rating_from_data(symbol: str, rating_data) -> dict:
+    if isinstance(rating_data, list):
+        rating_data = rating_data[0] if rating_data else None
+    if not isinstance(rating_data, dict):
+        rating_data = {}
+
+    values = {
+        "symbol": symbol,
+        "rating_score": rating_data.get("ratingScore", 0),
+        "rating_rating": rating_data.get("rating", ""),
+        "rating_recommendation": rating_data.get("ratingRecommendation", ""),
+    }
+    _check_numeric(values, COMPANY_RATING_NUMERIC)
+    return values
+
+
+def dialect_insert(db: AsyncSession):
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upsert no soportado para el dialecto {dialect}")
+
+
+def chunks(rows: List[dict], chunk_size: int) -> Iterable[List[dict]]:
+    for start in range(0, len(rows), chunk_size):
+        yield rows[start:start + chunk_size]
+
+
+async def bulk_upsert(db: AsyncSession, model, rows: List[dict], chunk_size: int = UPSERT_CHUNK_SIZE,
+                      track: Sequence[str] = (), key: str = "symbol") -> UpsertResult:
+    # Un INSERT ... ON CONFLICT (key) DO UPDATE por chunk. Las filas cuyo contenido no cambio
+    # no se reescriben (WHERE ... IS DISTINCT FROM) y se cuentan como unchanged.
+    # No hace commit: todos los chunks quedan en la transaccion del caller.
+    table = model.__table__
+    insert = dialect_insert(db)
+    rows = list({row[key]: row for row in rows}.values())
+    inserted = updated = unchanged = 0
+    changed = []
+
+    for chunk in chunks(rows, chunk_size):
+        keys = [row[key] for row in chunk]
+        # El SELECT previo trae tambien los valores de `track`, para saber que cambio sin otra query.
+        previous = {row[0]: tuple(row[1:]) for row in (await db.execute(
+            select(table.c[key], *[table.c[column] for column in track]).where(table.c[key].in_(keys))))}
+        existing = set(previous)
+
+        stmt = insert(table).values(chunk)
+        update_columns = [column for column in chunk[0] if column != key]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[key]],
+            set_={column: stmt.excluded[column] for column in update_columns},
+            where=or_(*[table.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns]),
+        ).returning(table.c[key])
+        written = set((await db.execute(stmt)).scalars())
+
+        inserted += len(written - existing)
+        updated += len(written & existing)
+        unchanged += len(existing - written)
+        if track:
+            changed.extend(row for row in chunk if row[key] in written
+                           and previous.get(row[key]) != tuple(row.get(column) for column in track))
+
+    return UpsertResult(inserted=inserted, updated=updated, unchanged=unchanged, changed=tuple(changed))
+
+
+async def upsert_stock_prices(db: AsyncSession, quotes: Iterable[dict]) -> UpsertResult:
+    return await bulk_upsert(db, StockPrice, [stock_price_from_quote(quote) for quote in quotes],
+                             track=STOCK_PRICE_TRACKED)
+
+
+async def upsert_company_ratings(db: AsyncSession, ratings: Dict[str, object]) -> UpsertResult:
+    return await bulk_upsert(db, CompanyRating,
+                             [company_rating_from_data(symbol, rating_data) for symbol, rating_data in ratings.items()])
+
+
+async def touch_company_ratings(db: AsyncSession, symbols: Sequence[str], refreshed_at: int):
+    # Un solo UPDATE de updated_at por batch, tambien para los ratings que no cambiaron y no se reescribieron.
+    await db.execute(update(CompanyRating).where(CompanyRating.symbol.in_(symbols)).values(updated_at=refreshed_at))
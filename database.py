@@ -1,19 +1,135 @@
-from sqlalchemy import create_engine
+import time
+from typing import Annotated
+
+from fastapi import Depends, Request
+from sqlalchemy import event, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import os
 
+from metrics import DB_POOL_CHECKOUT_WAIT, DB_QUERY_DURATION, register_pool, sql_operation
+
 
 load_dotenv()
 
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Replica opcional para las lecturas (GET). Vacio: todo va al primario.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
 API_KEY = os.getenv("API_KEY")
+FMP_BASE_URL = os.getenv("FMP_BASE_URL", "https://financialmodelingprep.com")
+FMP_QUOTE_BATCH_SIZE = int(os.getenv("FMP_QUOTE_BATCH_SIZE", "50"))
+FMP_MAX_CONCURRENCY = int(os.getenv("FMP_MAX_CONCURRENCY", "10"))
+FMP_TIMEOUT = float(os.getenv("FMP_TIMEOUT", "10"))
+FMP_MAX_RETRIES = int(os.getenv("FMP_MAX_RETRIES", "3"))
+FMP_RETRY_BACKOFF = float(os.getenv("FMP_RETRY_BACKOFF", "0.5"))
+FMP_RATE_LIMIT_PER_MINUTE = int(os.getenv("FMP_RATE_LIMIT_PER_MINUTE", "300"))
+FMP_RATE_LIMIT_BURST = int(os.getenv("FMP_RATE_LIMIT_BURST", "10"))
+# Llamadas seguidas que fallan (con reintentos) antes de dejar de llamar a FMP por FMP_BREAKER_COOLDOWN segundos.
+FMP_BREAKER_THRESHOLD = int(os.getenv("FMP_BREAKER_THRESHOLD", "5"))
+FMP_BREAKER_COOLDOWN = float(os.getenv("FMP_BREAKER_COOLDOWN", "30"))
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+SCHEDULER_QUOTE_INTERVAL = float(os.getenv("SCHEDULER_QUOTE_INTERVAL", "60"))
+SCHEDULER_RATING_INTERVAL = float(os.getenv("SCHEDULER_RATING_INTERVAL", "86400"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAXSIZE = int(os.getenv("RESPONSE_CACHE_MAXSIZE", "4096"))
+CEDEAR_QUOTE_SUFFIX = os.getenv("CEDEAR_QUOTE_SUFFIX", ".BA")
+PRICE_HISTORY_PARTITIONED = os.getenv("PRICE_HISTORY_PARTITIONED", "false").lower() == "true"
+INDICATOR_INTERVAL = os.getenv("INDICATOR_INTERVAL", "1d")
+# Cache de respuestas compartido entre workers (redis://...). Vacio: cada proceso usa su TTLCache en memoria.
+CACHE_URL = os.getenv("CACHE_URL")
+# Cada cuanto un worker que no es lider reintenta tomar el lock del scheduler (y el lider verifica su conexion).
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "10"))
+
+
+def to_async_url(url: str) -> str:
+    # Permite seguir usando el DATABASE_URL sincronico (postgresql://, sqlite://) con drivers async.
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+ASYNC_DATABASE_REPLICA_URL = to_async_url(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Mide cuanto espera cada checkout por una conexion libre: si crece, el pool es chico para la carga.
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.logging_name).observe(time.perf_counter() - started)
+
 
+def _instrument(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
 
-engine = create_engine(DATABASE_URL)
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(sql_operation(statement)).observe(time.perf_counter() - started)
 
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        # Una query que falla no pasa por after_cursor_execute; se descarta su inicio para no desbalancear la pila.
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def build_engine(url: str, name: str) -> AsyncEngine:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # SQLite en memoria usa StaticPool (una sola conexion): no admite opciones de pool.
+        engine = create_async_engine(url)
+    else:
+        # pre_ping descarta conexiones muertas (p.ej. despues de un failover) y recycle las renueva antes
+        # de que las corte un proxy o el servidor.
+        engine = create_async_engine(url,
+                                     poolclass=TimedQueuePool,
+                                     pool_logging_name=name,
+                                     pool_size=DB_POOL_SIZE,
+                                     max_overflow=DB_MAX_OVERFLOW,
+                                     pool_timeout=DB_POOL_TIMEOUT,
+                                     pool_recycle=DB_POOL_RECYCLE,
+                                     pool_pre_ping=DB_POOL_PRE_PING)
+        register_pool(name, engine.pool)
+    _instrument(engine)
+    return engine
+
+
+engine = build_engine(ASYNC_DATABASE_URL, "primary")
+# Sin replica, las lecturas comparten engine (y pool) con el primario.
+read_engine = build_engine(ASYNC_DATABASE_REPLICA_URL, "replica") if ASYNC_DATABASE_REPLICA_URL else engine
+
+
+AsyncSessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=read_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
+
+
+
+async def get_db(request: Request):
+    # Los GET van a la replica (si hay); los PUT/POST/DELETE y los refresh siempre al primario.
+    # Con replica, lo cacheado justo despues de un refresh puede reflejar el lag de replicacion.
+    session_factory = ReadSessionLocal if request.method in READ_METHODS else AsyncSessionLocal
+    async with session_factory() as db:
+        yield db
+
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
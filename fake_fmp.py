@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse
+
+
+DEFAULT_FIXTURES_DIR = Path(__file__).parent / "fixtures" / "fmp"
+
+
+class FakeFMPConfig:
+    def __init__(self,
+                 fixtures_dir: Path = DEFAULT_FIXTURES_DIR,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0,
+                 synthesize: bool = True,
+                 record_from: Optional[str] = None,
+                 seed: Optional[int] = None):
+        self.fixtures_dir = Path(fixtures_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.synthesize = synthesize
+        self.record_from = record_from
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> "FakeFMPConfig":
+        return cls(
+            fixtures_dir=Path(os.getenv("FAKE_FMP_FIXTURES", str(DEFAULT_FIXTURES_DIR))),
+            latency=float(os.getenv("FAKE_FMP_LATENCY", "0")),
+            jitter=float(os.getenv("FAKE_FMP_JITTER", "0")),
+            error_rate=float(os.getenv("FAKE_FMP_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_FMP_RATE_LIMIT_RATE", "0")),
+            synthesize=os.getenv("FAKE_FMP_SYNTHESIZE", "true").lower() == "true",
+            record_from=os.getenv("FAKE_FMP_RECORD_FROM") or None,
+            seed=int(os.environ["FAKE_FMP_SEED"]) if os.getenv("FAKE_FMP_SEED") else None,
+        )
+
+
+def synthetic_quote(symbol: str, now: Optional[float] = None) -> dict:
+    # Deterministico por simbolo y minuto: el mismo minuto devuelve el mismo quote.
+    minute = int((now or time.time()) // 60)
+    base = random.Random(zlib.crc32(symbol.encode()))
+    price_base = base.uniform(5, 500)
+    tick = random.Random(zlib.crc32(f"{symbol}:{minute}".encode()))
+    price = round(price_base * (1 + tick.uniform(-0.02, 0.02)), 2)
+    previous_close = round(price_base, 2)
+    shares = base.randint(10_000_000, 5_000_000_000)
+    eps = round(base.uniform(-2, 20), 2) or 0.01
+    return {
+        "symbol": symbol,
+        "name": f"{symbol} Inc.",
+        "price": price,
+        "changesPercentage": round((price / previous_close - 1) * 100, 4),
+        "change": round(price - previous_close, 2),
+        "dayLow": round(min(price, previous_close) * 0.99, 2),
+        "dayHigh": round(max(price, previous_close) * 1.01, 2),
+        "yearHigh": round(price_base * 1.4, 2),
+        "yearLow": round(price_base * 0.7, 2),
+        "marketCap": round(price * shares),
+        "priceAvg50": round(price_base * 1.01, 2),
+        "priceAvg200": round(price_base * 0.97, 2),
+        "exchange": base.choice(["NASDAQ", "NYSE"]),
+        "volume": tick.randint(100_000, 50_000_000),
+        "avgVolume": base.randint(100_000, 50_000_000),
+        "open": previous_close,
+        "previousClose": previous_close,
+        "eps": eps,
+        "pe": round(price / eps, 2),
+        "earningsAnnouncement": "2024-04-25T20:00:00.000+0000",
+        "sharesOutstanding": shares,
+        "timestamp": minute * 60,
+    }
+
+
+def synthetic_rating(symbol: str) -> list:
+    rng = random.Random(zlib.crc32(f"rating:{symbol}".encode()))
+    score = rng.randint(1, 5)
+    rating, recommendation = {
+        1: ("D", "Strong Sell"), 2: ("C", "Sell"), 3: ("B", "Neutral"), 4: ("A-", "Buy"), 5: ("S", "Strong Buy"),
+    }[score]
+    return [{"symbol": symbol, "date": "2024-03-01", "rating": rating, "ratingScore": score,
+             "ratingRecommendation": recommendation}]
+
+
+def create_app(config: FakeFMPConfig) -> FastAPI:
+    app = FastAPI(title="Fake FMP")
+    rng = random.Random(config.seed)
+    stats = Counter()
+    upstream = httpx.AsyncClient(base_url=config.record_from, timeout=30) if config.record_from else None
+
+    def fixture_path(kind: str, symbol: str) -> Path:
+        return config.fixtures_dir / kind / f"{symbol}.json"
+
+    def read_fixture(kind: str, symbol: str):
+        path = fixture_path(kind, symbol)
+        if path.exists():
+            return json.loads(path.read_text())
+        return None
+
+    def write_fixture(kind: str, symbol: str, data):
+        path = fixture_path(kind, symbol)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, indent=2))
+
+    async def record(path: str, apikey: Optional[str]):
+        response = await upstream.get(path, params={"apikey": apikey or os.getenv("API_KEY", "")})
+        response.raise_for_status()
+        stats["recorded"] += 1
+        return response.json()
+
+    async def inject_faults() -> Optional[JSONResponse]:
+        delay = config.latency + (rng.uniform(-config.jitter, config.jitter) if config.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if config.rate_limit_rate and rng.random() < config.rate_limit_rate:
+            stats["429"] += 1
+            return JSONResponse({"Error Message": "Limit Reach"}, status_code=429, headers={"Retry-After": "1"})
+        if config.error_rate and rng.random() < config.error_rate:
+            stats["500"] += 1
+            return JSONResponse({"Error Message": "Internal error"}, status_code=500)
+        return None
+
+    @app.get("/api/v3/quote/{symbols}")
+    async def quote(symbols: str, request: Request):
+        stats["quote"] += 1
+        fault = await inject_faults()
+        if fault is not None:
+            return fault
+
+        requested: List[str] = [symbol for symbol in symbols.split(",") if symbol]
+        quotes = {symbol: read_fixture("quote", symbol) for symbol in requested}
+        missing = [symbol for symbol, data in quotes.items() if data is None]
+        if missing and upstream is not None:
+            for data in await record(f"/api/v3/quote/{','.join(missing)}", request.query_params.get("apikey")):
+                write_fixture("quote", data["symbol"], data)
+                quotes[data["symbol"]] = data
+        elif missing and config.synthesize:
+            quotes.update({symbol: synthetic_quote(symbol) for symbol in missing})
+
+        return [data for data in quotes.values() if data is not None]
+
+    @app.get("/api/v3/rating/{symbol}")
+    async def rating(symbol: str, request: Request):
+        stats["rating"] += 1
+        fault = await inject_faults()
+        if fault is not None:
+            return fault
+
+        data = read_fixture("rating", symbol)
+        if data is None and upstream is not None:
+            data = await record(f"/api/v3/rating/{symbol}", request.query_params.get("apikey"))
+            write_fixture("rating", symbol, data)
+        elif data is None and config.synthesize:
+            data = synthetic_rating(symbol)
+        return data if data is not None else []
+
+    @app.get("/_stats")
+    async def get_stats():
+        return dict(stats)
+
+    @app.delete("/_stats")
+    async def reset_stats():
+        stats.clear()
+        return dict(stats)
+
+    return app
+
+
+app = create_app(FakeFMPConfig.from_env())
+
+
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor FMP local basado en fixtures para pruebas y benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument("--latency", type=float, default=0.0, help="latencia agregada por request, en ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="variacion +/- de la latencia, en ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probabilidad de responder 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="probabilidad de responder 429")
+    parser.add_argument("--no-synthesize", action="store_true",
+                        help="no generar datos para simbolos sin fixture (responde vacio)")
+    parser.add_argument("--record-from", default=None,
+                        help="URL real de FMP; los simbolos sin fixture se piden ahi y se guardan en disco")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeFMPConfig(args.fixtures, args.latency, args.jitter, args.error_rate, args.rate_limit_rate,
+                           not args.no_synthesize, args.record_from, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port)
@@ -1,53 +1,112 @@
-import json
-import urllib.request
-import urllib.request
-from typing import Optional, Union, Dict
+import asyncio
+import time
+import urllib.parse
+from typing import AsyncIterator, Awaitable, Dict, List, NamedTuple, Union
 
-import certifi
-from fastapi import HTTPException
-from starlette.exceptions import HTTPException
+import httpx
 
-from database import API_KEY
+from database import FMP_QUOTE_BATCH_SIZE
+from fmp_client import client
 
 
-def get_stock_prices(symbol: str) -> dict:
-    base_url = f"https://financialmodelingprep.com/api/v3/quote/{symbol}?apikey={API_KEY}"
+# Un 4xx de /quote/ con varios simbolos puede deberse a uno solo: se parte el batch para aislarlo.
+ISOLATE_STATUS_CODES = {400, 404, 422}
+
+
+class FetchResult(NamedTuple):
+    # Por simbolo: el dato de FMP o el motivo del error, y la latencia de la request que lo trajo.
+    data: Dict[str, Union[dict, list]]
+    errors: Dict[str, str]
+    latency: Dict[str, float]
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"Error al obtener datos de la API: HTTP {e.response.status_code}"
+    return f"Error al obtener datos de la API: {str(e) or e.__class__.__name__}"
+
+
+def _failed(symbols: List[str], error: str, started: float) -> FetchResult:
+    elapsed = time.perf_counter() - started
+    return FetchResult({}, dict.fromkeys(symbols, error), dict.fromkeys(symbols, elapsed))
+
+
+async def _get_quote_chunk(chunk: List[str]) -> FetchResult:
+    # El endpoint /quote/ acepta varios simbolos separados por coma: una request por chunk.
+    joined = urllib.parse.quote(",".join(chunk), safe=",")
+    started = time.perf_counter()
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                                 'Chrome/91.0.4472.124 Safari/537.36'}
-        request = urllib.request.Request(base_url, headers=headers)
-        with urllib.request.urlopen(request, cafile=certifi.where()) as response:
-            data = response.read().decode("utf-8")
-        return json.loads(data)[0]
-    except urllib.error.HTTPError as e:
-        raise HTTPException(status_code=e.code, detail=f"Error al obtener datos de la API: {str(e)}")
+        data = await client.get_json(f"/api/v3/quote/{joined}")
+        if not isinstance(data, list):
+            raise ValueError(f"respuesta inesperada ({type(data).__name__})")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener datos de la API: {str(e)}")
+        if len(chunk) > 1 and isinstance(e, httpx.HTTPStatusError) and e.response.status_code in ISOLATE_STATUS_CODES:
+            half = len(chunk) // 2
+            left, right = await asyncio.gather(_get_quote_chunk(chunk[:half]), _get_quote_chunk(chunk[half:]))
+            return FetchResult({**left.data, **right.data}, {**left.errors, **right.errors},
+                               {**left.latency, **right.latency})
+        return _failed(chunk, _error_message(e), started)
 
+    elapsed = time.perf_counter() - started
+    wanted = set(chunk)
+    quotes = {quote["symbol"]: quote for quote in data if isinstance(quote, dict) and quote.get("symbol") in wanted}
+    errors = {symbol: "FMP no devolvio datos para el simbolo." for symbol in chunk if symbol not in quotes}
+    return FetchResult(quotes, errors, dict.fromkeys(chunk, elapsed))
 
 
-def get_company_rating(symbol: str) -> Optional[Dict[str, Union[str, int, float]]]:
-    base_url = f"https://financialmodelingprep.com/api/v3/rating/{symbol}?apikey={API_KEY}"
+def _rating(data) -> dict:
+    # /rating/ devuelve una lista con un elemento; cualquier otra forma es un error de ese simbolo.
+    if isinstance(data, list) and data and isinstance(data[0], dict):
+        return data[0]
+    if isinstance(data, dict) and data:
+        return data
+    if not data:
+        raise ValueError("FMP no devolvio datos para el simbolo.")
+    raise ValueError(f"Respuesta inesperada de FMP ({type(data).__name__}).")
+
+
+async def _get_company_rating(symbol: str) -> FetchResult:
+    started = time.perf_counter()
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                                 'Chrome/91.0.4472.124 Safari/537.36'}
-        request = urllib.request.Request(base_url, headers=headers)
-        with urllib.request.urlopen(request, cafile=certifi.where()) as response:
-            data = response.read().decode("utf-8")
-        return json.loads(data)
-    except urllib.error.HTTPError as e:
-        raise HTTPException(status_code=e.code, detail=f"Error al obtener datos de la API: {str(e)}")
+        rating = _rating(await client.get_json(f"/api/v3/rating/{symbol}"))
+    except ValueError as e:
+        return _failed([symbol], str(e), started)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al obtener datos de la API: {str(e)}")
+        return _failed([symbol], _error_message(e), started)
+    return FetchResult({symbol: rating}, {}, {symbol: time.perf_counter() - started})
+
+
+async def _as_completed(requests: List[Awaitable[FetchResult]]) -> AsyncIterator[FetchResult]:
+    # Cada resultado se entrega apenas llega, asi el refresh guarda lo que ya tiene sin esperar al resto.
+    tasks = [asyncio.ensure_future(request) for request in requests]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
+def get_stock_prices_batch(symbols: List[str], chunk_size: int = FMP_QUOTE_BATCH_SIZE) -> AsyncIterator[FetchResult]:
+    chunks = [symbols[start:start + chunk_size] for start in range(0, len(symbols), chunk_size)]
+    return _as_completed([_get_quote_chunk(chunk) for chunk in chunks])
 
 
+def get_company_ratings(symbols: List[str]) -> AsyncIterator[FetchResult]:
+    # /rating/ no tiene version batch: se hace fan-out concurrente acotado por el semaforo del cliente.
+    return _as_completed([_get_company_rating(symbol) for symbol in symbols])
+
 
 if __name__ == '__main__':
     from pprint import pprint
 
-    rating = get_company_rating("NIO")
+    async def main():
+        async for result in get_company_ratings(["NIO"]):
+            pprint(result)
+
+        async for result in get_stock_prices_batch(["AAPL", "MSFT", "NIO"]):
+            pprint(result)
 
-    prices = get_stock_prices("AAPL")
+        await client.aclose()
 
-    pprint(rating)
+    asyncio.run(main())
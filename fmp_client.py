@@ -0,0 +1,202 @@
+import asyncio
+import random
+import time
+from typing import Any, Optional
+
+import certifi
+import httpx
+
+from database import (API_KEY, FMP_BASE_URL, FMP_MAX_CONCURRENCY, FMP_TIMEOUT, FMP_MAX_RETRIES, FMP_RETRY_BACKOFF,
+                      FMP_RATE_LIMIT_PER_MINUTE, FMP_RATE_LIMIT_BURST, FMP_BREAKER_THRESHOLD, FMP_BREAKER_COOLDOWN)
+from metrics import FMP_CIRCUIT_OPEN, FMP_REQUEST_DURATION, FMP_RESPONSES, FMP_RETRIES
+
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                         'Chrome/91.0.4472.124 Safari/537.36'}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # Con capacidad C y reposicion (limit - C)/min, ninguna ventana de 60s supera `limit` requests.
+    def __init__(self, limit_per_minute: int, burst: int):
+        self.capacity = max(1, min(burst, limit_per_minute - 1))
+        self.rate = max(limit_per_minute - self.capacity, 1) / 60
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Despues de `threshold` llamadas seguidas que fallan aun con reintentos (5xx, 429 o transporte), FMP se da
+    # por degradado: durante `cooldown` segundos se falla sin llamar ni gastar cuota. Despues pasa una sola
+    # llamada de prueba; si anda se cierra, si no se vuelve a abrir.
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        FMP_CIRCUIT_OPEN.set(0)
+
+    def failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            self._probing = False
+            FMP_CIRCUIT_OPEN.set(1)
+
+    def release(self):
+        # Llamada cancelada: no dice nada de FMP, pero si era la de prueba otra tiene que poder probar.
+        self._probing = False
+
+
+class FMPClient:
+    def __init__(self,
+                 base_url: str = FMP_BASE_URL,
+                 api_key: Optional[str] = API_KEY,
+                 max_concurrency: int = FMP_MAX_CONCURRENCY,
+                 timeout: float = FMP_TIMEOUT,
+                 max_retries: int = FMP_MAX_RETRIES,
+                 backoff: float = FMP_RETRY_BACKOFF,
+                 rate_limit_per_minute: int = FMP_RATE_LIMIT_PER_MINUTE,
+                 rate_limit_burst: int = FMP_RATE_LIMIT_BURST,
+                 breaker_threshold: int = FMP_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = FMP_BREAKER_COOLDOWN):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenBucket(rate_limit_per_minute, rate_limit_burst) if rate_limit_per_minute > 0 else None
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown) if breaker_threshold > 0 else None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Un unico AsyncClient reutiliza las conexiones TLS (keep-alive) entre requests.
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=HEADERS,
+                timeout=self.timeout,
+                verify=certifi.where(),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+        return self._client
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        # Jitter: las llamadas que fallaron juntas no reintentan todas en el mismo instante.
+        delay = self.backoff * (2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _can_retry(self, attempt: int) -> bool:
+        # Si otra llamada ya abrio el circuito no tiene sentido seguir gastando cuota en reintentos.
+        return attempt < self.max_retries and not (self.breaker is not None and self.breaker.open)
+
+    async def _request(self, client: httpx.AsyncClient, endpoint: str, path: str, params: dict) -> httpx.Response:
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                except httpx.TransportError:
+                    FMP_REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+                    FMP_RESPONSES.labels(endpoint, "error").inc()
+                    if not self._can_retry(attempt):
+                        raise
+                    FMP_RETRIES.labels(endpoint, "transport").inc()
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                FMP_REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+                FMP_RESPONSES.labels(endpoint, str(response.status_code)).inc()
+
+                if response.status_code in RETRY_STATUS_CODES and self._can_retry(attempt):
+                    FMP_RETRIES.labels(endpoint, str(response.status_code)).inc()
+                    await asyncio.sleep(self._retry_delay(attempt, response))
+                    continue
+                return response
+
+    async def get_json(self, path: str, **params: Any) -> Any:
+        client = self._get_client()
+        params["apikey"] = self.api_key
+        # "/api/v3/quote/AAPL,MSFT" -> "quote": el simbolo no va en la etiqueta.
+        endpoint = path.strip("/").split("/")[2] if path.count("/") > 2 else path
+
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            FMP_RESPONSES.labels(endpoint, "circuit_open").inc()
+            raise CircuitOpenError("FMP no disponible (circuit breaker abierto), se reintenta mas tarde.")
+        try:
+            response = await self._request(client, endpoint, path, params)
+        except httpx.TransportError:
+            if breaker is not None:
+                breaker.failure()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            if response.status_code in RETRY_STATUS_CODES:
+                breaker.failure()
+            else:
+                breaker.success()
+
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+client = FMPClient()
@@ -0,0 +1,139 @@
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List
+
+from sqlalchemy import BigInteger, and_, event, func, literal_column, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from crud import UPSERT_CHUNK_SIZE, chunks, dialect_insert
+from database import PRICE_HISTORY_PARTITIONED
+from models import StockPriceHistory
+
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+MAX_BUCKETS = 10000
+PARTITIONS_AHEAD = 3
+
+# Particiones que ya existen con seguridad. Las que crea una transaccion recien se suman cuando hace commit:
+# si hace rollback el CREATE TABLE se deshace y la proxima vez hay que volver a crearlas.
+_created_partitions = set()
+_PENDING_PARTITIONS = "pending_partitions"
+
+
+@event.listens_for(Session, "after_commit")
+def _partitions_committed(session: Session):
+    _created_partitions.update(session.info.pop(_PENDING_PARTITIONS, ()))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _partitions_discarded(session: Session, transaction):
+    # Rollback o close sin commit (after_commit ya se llevo las suyas).
+    if transaction.parent is None:
+        session.info.pop(_PENDING_PARTITIONS, None)
+
+
+def parse_interval(value: str) -> int:
+    match = re.fullmatch(r"(\d+)([smhdw]?)", value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Intervalo invalido: {value}")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2) or "s"]
+
+
+def _month_bounds(timestamp: int):
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    start = datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+    end = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return f"stock_price_history_{start:%Y_%m}", int(start.timestamp()), int(end.timestamp())
+
+
+async def ensure_partitions(db: AsyncSession, timestamps: Iterable[int]):
+    # Particiones mensuales sobre timestamp; solo aplica en Postgres con PRICE_HISTORY_PARTITIONED.
+    if not PRICE_HISTORY_PARTITIONED or db.bind.dialect.name != "postgresql":
+        return
+
+    for name, start, end in {_month_bounds(timestamp) for timestamp in timestamps}:
+        if name in _created_partitions:
+            continue
+        await db.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF stock_price_history "
+                              f"FOR VALUES FROM ({start}) TO ({end})"))
+        db.sync_session.info.setdefault(_PENDING_PARTITIONS, set()).add(name)
+
+
+async def ensure_upcoming_partitions(db: AsyncSession):
+    _, start, _ = _month_bounds(int(datetime.now(timezone.utc).timestamp()))
+    timestamps = [start]
+    for _ in range(PARTITIONS_AHEAD):
+        timestamps.append(_month_bounds(timestamps[-1])[2])
+    await ensure_partitions(db, timestamps)
+
+
+async def append_price_history(db: AsyncSession, quotes: Iterable[dict]):
+    # Append-only: un mismo (symbol, timestamp) se escribe una sola vez.
+    rows = [{"symbol": quote["symbol"], "timestamp": quote["timestamp"],
+             "price": quote.get("price"), "volume": quote.get("volume")}
+            for quote in quotes if quote.get("timestamp") is not None]
+    if not rows:
+        return
+
+    await ensure_partitions(db, [row["timestamp"] for row in rows])
+
+    insert = dialect_insert(db)
+    table = StockPriceHistory.__table__
+    for chunk in chunks(rows, UPSERT_CHUNK_SIZE):
+        await db.execute(insert(table).values(chunk).on_conflict_do_nothing(
+            index_elements=[table.c.symbol, table.c.timestamp]))
+
+
+async def get_ohlc(db: AsyncSession, symbol: str, start: int, end: int, interval: int) -> List:
+    # El bucketing y el OHLC se resuelven en SQL: solo viaja una fila por bucket.
+    history = StockPriceHistory
+    step = literal_column(str(int(interval)), BigInteger)
+    bucket = (history.timestamp // step) * step
+
+    buckets = (
+        select(bucket.label("bucket"),
+               func.min(history.timestamp).label("open_ts"),
+               func.max(history.timestamp).label("close_ts"),
+               func.max(history.price).label("high"),
+               func.min(history.price).label("low"),
+               func.count().label("count"))
+        .where(history.symbol == symbol, history.timestamp >= start, history.timestamp < end)
+        .group_by(bucket)
+        .subquery()
+    )
+    open_row = aliased(history)
+    close_row = aliased(history)
+
+    query = (
+        select(buckets.c.bucket, open_row.price.label("open"), buckets.c.high, buckets.c.low,
+               close_row.price.label("close"), buckets.c.count)
+        .join(open_row, and_(open_row.symbol == symbol, open_row.timestamp == buckets.c.open_ts))
+        .join(close_row, and_(close_row.symbol == symbol, close_row.timestamp == buckets.c.close_ts))
+        .order_by(buckets.c.bucket)
+    )
+
+    return (await db.execute(query)).all()
+
+
+async def get_bar_closes(db: AsyncSession, symbols: Iterable[str], interval: int) -> List:
+    # Ultimo precio de cada bucket para varios simbolos a la vez, ordenado por simbolo y bucket.
+    history = StockPriceHistory
+    step = literal_column(str(int(interval)), BigInteger)
+    bucket = (history.timestamp // step) * step
+
+    buckets = (
+        select(history.symbol, bucket.label("bucket"), func.max(history.timestamp).label("close_ts"))
+        .where(history.symbol.in_(list(symbols)))
+        .group_by(history.symbol, bucket)
+        .subquery()
+    )
+    close_row = aliased(history)
+
+    query = (
+        select(buckets.c.symbol, buckets.c.bucket, buckets.c.close_ts, close_row.price.label("close"))
+        .join(close_row, and_(close_row.symbol == buckets.c.symbol, close_row.timestamp == buckets.c.close_ts))
+        .order_by(buckets.c.symbol, buckets.c.bucket)
+    )
+
+    return (await db.execute(query)).all()
@@ -0,0 +1,319 @@
+import math
+from collections import deque
+from itertools import groupby
+from typing import Deque, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import bulk_upsert
+from database import INDICATOR_INTERVAL
+from history import get_bar_closes, parse_interval
+from models import TechnicalIndicators
+
+
+SMA_PERIOD = 20
+EMA_PERIOD = 20
+VOLATILITY_PERIOD = 20
+RSI_PERIOD = 14
+INDICATOR_FIELDS = ("sma_20", "ema_20", "volatility_20", "rsi_14")
+
+BAR_SECONDS = parse_interval(INDICATOR_INTERVAL)
+EMA_ALPHA = 2 / (EMA_PERIOD + 1)
+# Barras cerradas que se guardan: alcanza para sacar de cada ventana el valor que sale.
+WINDOW = max(SMA_PERIOD - 1, VOLATILITY_PERIOD)
+
+# Definiciones, sobre la serie de cierres de cada barra (la ultima, en curso, con el ultimo precio):
+#   sma_20        promedio de los ultimos 20 cierres.
+#   ema_20        media exponencial, alpha = 2 / 21, arrancando en el primer cierre; se informa desde la barra 20.
+#   volatility_20 desvio estandar (muestral) de los ultimos 20 log-retornos, sin anualizar.
+#   rsi_14        RSI de Wilder: promedio simple de las primeras 14 variaciones y despues suavizado.
+
+
+def _log_return(previous: float, close: float) -> float:
+    return math.log(close / previous) if previous > 0 and close > 0 else 0.0
+
+
+def _wilder(previous: float, value: float, count: int) -> float:
+    # count: variaciones contando esta. Hasta RSI_PERIOD se acumula la suma; en RSI_PERIOD pasa a ser
+    # el promedio simple y despues se suaviza.
+    if count < RSI_PERIOD:
+        return previous + value
+    if count == RSI_PERIOD:
+        return (previous + value) / RSI_PERIOD
+    return (previous * (RSI_PERIOD - 1) + value) / RSI_PERIOD
+
+
+def _rsi(gain: float, loss: float) -> float:
+    return 100.0 if loss == 0 else 100.0 - 100.0 / (1.0 + gain / loss)
+
+
+class IndicatorState:
+    # Estado O(1) por simbolo: las barras cerradas resumidas en sumas y promedios corridos mas las ultimas
+    # WINDOW, y la barra en curso (bucket, close). Un quote de la misma barra solo cambia close; uno de
+    # una barra nueva cierra la anterior.
+    __slots__ = ("timestamp", "bucket", "close", "bars", "closes", "ema", "gain", "loss",
+                 "sma_sum", "return_sum", "return_sq")
+
+    def __init__(self):
+        self.timestamp: Optional[int] = None
+        self.bucket: Optional[int] = None
+        self.close: Optional[float] = None
+        self.bars = 0
+        self.closes: Deque[float] = deque(maxlen=WINDOW)
+        self.ema: Optional[float] = None
+        self.gain = 0.0
+        self.loss = 0.0
+        self._resum()
+
+    def _resum(self):
+        # Sumas de las ventanas a partir de closes: al cargar o hacer backfill, sin arrastrar error de redondeo.
+        closes = list(self.closes)
+        self.sma_sum = sum(closes[-(SMA_PERIOD - 1):])
+        returns = [_log_return(a, b) for a, b in zip(closes, closes[1:])][-(VOLATILITY_PERIOD - 1):]
+        self.return_sum = sum(returns)
+        self.return_sq = sum(r * r for r in returns)
+
+    def copy(self) -> "IndicatorState":
+        state = IndicatorState.__new__(IndicatorState)
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        state.closes = self.closes.copy()
+        return state
+
+    def update(self, timestamp: Optional[int], price: Optional[float]) -> bool:
+        if timestamp is None or price is None or (self.timestamp is not None and timestamp <= self.timestamp):
+            return False
+        bucket = timestamp - timestamp % BAR_SECONDS
+        if self.bucket is not None and bucket > self.bucket:
+            self._close_bar(self.close)
+        if self.bucket is None or bucket > self.bucket:
+            self.bucket = bucket
+        self.close = price
+        self.timestamp = timestamp
+        return True
+
+    def _close_bar(self, close: float):
+        closes = self.closes
+        if self.bars >= SMA_PERIOD - 1:
+            self.sma_sum -= closes[-(SMA_PERIOD - 1)]
+        self.sma_sum += close
+        if closes:
+            if self.bars >= VOLATILITY_PERIOD:
+                leaving = _log_return(closes[-VOLATILITY_PERIOD], closes[-(VOLATILITY_PERIOD - 1)])
+                self.return_sum -= leaving
+                self.return_sq -= leaving * leaving
+            change = _log_return(closes[-1], close)
+            self.return_sum += change
+            self.return_sq += change * change
+            self.gain = _wilder(self.gain, max(close - closes[-1], 0.0), self.bars)
+            self.loss = _wilder(self.loss, max(closes[-1] - close, 0.0), self.bars)
+        self.ema = close if self.ema is None else self.ema + EMA_ALPHA * (close - self.ema)
+        self.bars += 1
+        closes.append(close)
+
+    def values(self) -> Dict[str, Optional[float]]:
+        # Lo mismo que _close_bar pero con la barra en curso y sin modificar el estado.
+        values = dict.fromkeys(INDICATOR_FIELDS)
+        close = self.close
+        if close is None:
+            return values
+        length = self.bars + 1
+        if length >= SMA_PERIOD:
+            values["sma_20"] = (self.sma_sum + close) / SMA_PERIOD
+        if length >= EMA_PERIOD:
+            values["ema_20"] = close if self.ema is None else self.ema + EMA_ALPHA * (close - self.ema)
+        if self.closes:
+            previous = self.closes[-1]
+            if self.bars >= VOLATILITY_PERIOD:
+                change = _log_return(previous, close)
+                total = self.return_sum + change
+                squares = self.return_sq + change * change
+                variance = (squares - total * total / VOLATILITY_PERIOD) / (VOLATILITY_PERIOD - 1)
+                values["volatility_20"] = math.sqrt(max(variance, 0.0))
+            if self.bars >= RSI_PERIOD:
+                values["rsi_14"] = _rsi(_wilder(self.gain, max(close - previous, 0.0), self.bars),
+                                        _wilder(self.loss, max(previous - close, 0.0), self.bars))
+        return values
+
+    def to_row(self, symbol: str) -> dict:
+        return {"symbol": symbol, "timestamp": self.timestamp, "bucket": self.bucket, "close": self.close,
+                "bars": self.bars, "closes": orjson.dumps(list(self.closes)).decode(), "ema": self.ema,
+                "avg_gain": self.gain, "avg_loss": self.loss, **self.values()}
+
+    @classmethod
+    def from_model(cls, row: TechnicalIndicators) -> "IndicatorState":
+        state = cls()
+        state.timestamp, state.bucket, state.close, state.bars = row.timestamp, row.bucket, row.close, row.bars or 0
+        state.closes.extend(orjson.loads(row.closes or "[]"))
+        state.ema, state.gain, state.loss = row.ema, row.avg_gain or 0.0, row.avg_loss or 0.0
+        state._resum()
+        return state
+
+    @classmethod
+    def from_bars(cls, buckets: np.ndarray, closes: np.ndarray, timestamp: int) -> "IndicatorState":
+        # Backfill: el mismo estado que dejaria aplicar los quotes uno por uno, calculado de una vez con numpy.
+        state = cls()
+        committed = closes[:-1]
+        state.timestamp, state.bucket, state.close = int(timestamp), int(buckets[-1]), float(closes[-1])
+        state.bars = len(committed)
+        state.closes.extend(committed[-WINDOW:].tolist())
+        if len(committed):
+            state.ema = _ema(committed)
+            changes = np.diff(committed)
+            state.gain = _wilder_series(np.maximum(changes, 0.0))
+            state.loss = _wilder_series(np.maximum(-changes, 0.0))
+        state._resum()
+        return state
+
+
+def _ema(closes: np.ndarray) -> float:
+    # ema_k = (1 - a) * ema_k-1 + a * x_k con ema_0 = x_0, como producto escalar con los pesos (1 - a)^i.
+    weights = (1 - EMA_ALPHA) ** np.arange(len(closes) - 1, -1, -1, dtype=np.float64)
+    weights[1:] *= EMA_ALPHA
+    return float(weights @ closes)
+
+
+def _wilder_series(values: np.ndarray) -> float:
+    # Resultado de aplicar _wilder a toda la serie: suma, o promedio simple suavizado con b = (n - 1) / n.
+    if len(values) < RSI_PERIOD:
+        return float(values.sum())
+    rest = values[RSI_PERIOD:]
+    smoothing = (RSI_PERIOD - 1) / RSI_PERIOD
+    weights = smoothing ** np.arange(len(rest) - 1, -1, -1, dtype=np.float64) / RSI_PERIOD
+    return float(smoothing ** len(rest) * values[:RSI_PERIOD].mean() + weights @ rest)
+
+
+def recompute(closes: np.ndarray) -> Dict[str, Optional[float]]:
+    # Calculo completo sobre todos los cierres (incluida la barra en curso); referencia para el benchmark.
+    values = dict.fromkeys(INDICATOR_FIELDS)
+    length = len(closes)
+    if length >= SMA_PERIOD:
+        values["sma_20"] = float(closes[-SMA_PERIOD:].mean())
+    if length >= EMA_PERIOD:
+        values["ema_20"] = _ema(closes)
+    if length > VOLATILITY_PERIOD:
+        values["volatility_20"] = float(np.diff(np.log(closes[-(VOLATILITY_PERIOD + 1):])).std(ddof=1))
+    if length > RSI_PERIOD:
+        changes = np.diff(closes)
+        values["rsi_14"] = _rsi(_wilder_series(np.maximum(changes, 0.0)), _wilder_series(np.maximum(-changes, 0.0)))
+    return values
+
+
+class IndicatorEngine:
+    def __init__(self):
+        self._states: Dict[str, IndicatorState] = {}
+
+    async def load(self, db: AsyncSession):
+        rows = (await db.execute(select(TechnicalIndicators))).scalars().all()
+        self._states = {row.symbol: IndicatorState.from_model(row) for row in rows}
+
+    async def reload(self, db: AsyncSession, symbols: Sequence[str]):
+        # Estado que guardo otro worker (ver coordination.py): este sigue desde ahi si le toca refrescar.
+        query = select(TechnicalIndicators).where(TechnicalIndicators.symbol.in_(symbols))
+        self.apply({row.symbol: IndicatorState.from_model(row) for row in (await db.execute(query)).scalars()})
+
+    def advance(self, rows: Iterable[dict]) -> Dict[str, IndicatorState]:
+        # Devuelve copias actualizadas; el estado en memoria se reemplaza con apply() recien despues del
+        # commit, asi un rollback no lo deja adelantado respecto de la tabla.
+        advanced: Dict[str, IndicatorState] = {}
+        for row in rows:
+            symbol = row["symbol"]
+            state = (advanced.get(symbol) or self._states.get(symbol) or IndicatorState()).copy()
+            if state.update(row.get("timestamp"), row.get("price")):
+                advanced[symbol] = state
+        return advanced
+
+    def apply(self, advanced: Dict[str, IndicatorState]):
+        self._states.update(advanced)
+
+    def get(self, symbol: str) -> Optional[IndicatorState]:
+        return self._states.get(symbol)
+
+    async def backfill(self, db: AsyncSession, symbols: Iterable[str]) -> int:
+        # Reconstruye el estado desde stock_price_history. No hace commit.
+        states = {}
+        for symbol, bars in groupby(await get_bar_closes(db, symbols, BAR_SECONDS), key=lambda bar: bar.symbol):
+            bars = list(bars)
+            states[symbol] = IndicatorState.from_bars(np.array([bar.bucket for bar in bars], dtype=np.int64),
+                                                      np.array([bar.close for bar in bars], dtype=np.float64),
+                                                      bars[-1].close_ts)
+        await store_states(db, states)
+        self.apply(states)
+        return len(states)
+
+
+async def store_states(db: AsyncSession, states: Dict[str, IndicatorState]):
+    if states:
+        await bulk_upsert(db, TechnicalIndicators, [state.to_row(symbol) for symbol, state in states.items()])
+
+
+indicators = IndicatorEngine()
+
+
+if __name__ == '__main__':
+    import argparse
+    import asyncio
+    import time
+
+    parser = argparse.ArgumentParser(description="Indicadores tecnicos: benchmark o backfill desde el historial.")
+    parser.add_argument("--backfill", action="store_true",
+                        help="recalcular el estado de todos los instrumentos desde stock_price_history")
+    args = parser.parse_args()
+
+    if args.backfill:
+        from database import AsyncSessionLocal
+        from registry import registry
+
+        async def run_backfill():
+            async with AsyncSessionLocal() as db:
+                await registry.load(db)
+                count = await indicators.backfill(db, registry.quote_symbols())
+                await db.commit()
+            print(f"Indicadores recalculados para {count} simbolos.")
+
+        asyncio.run(run_backfill())
+    else:
+        # Un simbolo, 500 barras de 4 quotes cada una: incremental contra recalcular todo en cada quote.
+        rng = np.random.default_rng(7)
+        quotes = 2_000
+        per_bar = 4
+        timestamps = 1_700_000_000 + np.arange(quotes) * (BAR_SECONDS // per_bar)
+        prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, quotes)))
+
+        started = time.perf_counter()
+        state = IndicatorState()
+        incremental = []
+        for timestamp, price in zip(timestamps.tolist(), prices.tolist()):
+            state.update(timestamp, price)
+            incremental.append(state.values())
+        incremental_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        closes: List[float] = []
+        full = []
+        last_bucket = None
+        for timestamp, price in zip(timestamps.tolist(), prices.tolist()):
+            bucket = timestamp - timestamp % BAR_SECONDS
+            if bucket != last_bucket:
+                closes.append(price)
+                last_bucket = bucket
+            else:
+                closes[-1] = price
+            full.append(recompute(np.array(closes)))
+        full_elapsed = time.perf_counter() - started
+
+        worst = max(abs(a[field] - b[field]) / max(abs(b[field]), 1e-12)
+                    for a, b in zip(incremental, full) for field in INDICATOR_FIELDS if b[field] is not None)
+        mismatched = sum(1 for a, b in zip(incremental, full) for field in INDICATOR_FIELDS
+                         if (a[field] is None) != (b[field] is None))
+        backfilled = IndicatorState.from_bars(np.unique(timestamps - timestamps % BAR_SECONDS),
+                                              np.array(closes), int(timestamps[-1])).values()
+        backfill_error = max(abs(backfilled[field] - state.values()[field]) for field in INDICATOR_FIELDS)
+
+        print(f"{quotes} quotes, {len(closes)} barras de {INDICATOR_INTERVAL}:")
+        print(f"{'incremental':<22} {incremental_elapsed / quotes * 1e6:>10.2f} us/quote")
+        print(f"{'recalculo completo':<22} {full_elapsed / quotes * 1e6:>10.2f} us/quote")
+        print(f"error relativo maximo {worst:.2e}, nulos distintos: {mismatched}, backfill vs incremental {backfill_error:.2e}")
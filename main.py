@@ -1,13 +1,56 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 import models
-from database import engine
-from routers import instruments, company_rating, stock_prices
+from cache import caches
+from conditional import load_versions
+from coordination import changes
+from database import AsyncSessionLocal, SCHEDULER_ENABLED, engine, read_engine
+from fmp_client import client
+from history import ensure_upcoming_partitions
+from indicators import indicators
+from metrics import MetricsMiddleware
+from migrations import migrate
+from registry import registry
+from scheduler import scheduler
+from snapshot import snapshots
+from routers import instruments, company_rating, stock_prices, cache, screener, arbitrage, metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        await migrate(conn)
+    async with AsyncSessionLocal() as db:
+        await ensure_upcoming_partitions(db)
+        await db.commit()
+        await load_versions(db)
+        await registry.load(db)
+        await indicators.load(db)
+        await snapshots.load(db)
+    await changes.start()
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+    yield
+    await scheduler.stop()
+    await changes.stop()
+    await client.aclose()
+    for response_cache in caches.values():
+        await response_cache.aclose()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
-app = FastAPI()
 
-models.Base.metadata.create_all(bind=engine)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(instruments.router)
 app.include_router(company_rating.router)
-app.include_router(stock_prices.router)
\ No newline at end of file
+app.include_router(stock_prices.router)
+app.include_router(screener.router)
+app.include_router(arbitrage.router)
+app.include_router(cache.router)
+app.include_router(metrics.router)
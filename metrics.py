@@ -0,0 +1,152 @@
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+# Las metricas se actualizan en memoria (un lock y una suma); el costo de armar el texto lo paga solo /metrics.
+HTTP_REQUEST_DURATION = Histogram(
+    "screener_http_request_duration_seconds", "Latencia de las requests HTTP por ruta.",
+    ["method", "route", "status"],
+)
+FMP_REQUEST_DURATION = Histogram(
+    "screener_fmp_request_duration_seconds", "Latencia de cada llamada a FMP (cada intento cuenta aparte).",
+    ["endpoint"],
+)
+FMP_RESPONSES = Counter(
+    "screener_fmp_responses_total", "Respuestas de FMP por codigo HTTP ('error' si fallo el transporte).",
+    ["endpoint", "status"],
+)
+FMP_RETRIES = Counter(
+    "screener_fmp_retries_total", "Reintentos de llamadas a FMP por motivo.",
+    ["endpoint", "reason"],
+)
+FMP_CIRCUIT_OPEN = Gauge(
+    "screener_fmp_circuit_open", "1 mientras el circuit breaker del cliente FMP esta abierto.",
+)
+DB_QUERY_DURATION = Histogram(
+    "screener_db_query_duration_seconds", "Duracion de las queries SQL por tipo de sentencia.",
+    ["operation"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "screener_db_pool_checkout_wait_seconds", "Espera para obtener una conexion del pool.",
+    ["pool"],
+    buckets=(.0001, .0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+REFRESH_SYMBOLS = Gauge(
+    "screener_refresh_last_symbols", "Simbolos procesados en el ultimo refresh.", ["kind"],
+)
+REFRESH_DURATION = Gauge(
+    "screener_refresh_last_duration_seconds", "Duracion del ultimo refresh.", ["kind"],
+)
+REFRESH_LAST_SUCCESS = Gauge(
+    "screener_refresh_last_success_timestamp_seconds", "Epoch del ultimo refresh exitoso.", ["kind"],
+)
+REFRESH_SYMBOLS_TOTAL = Counter(
+    "screener_refresh_symbols_total", "Simbolos refrescados desde el arranque.", ["kind"],
+)
+REFRESH_ROWS_TOTAL = Counter(
+    "screener_refresh_rows_total",
+    "Filas de cada refresh por resultado: inserted, updated, unchanged (la base no las reescribio), "
+    "skipped (iguales al snapshot, no se mandaron a la base) o failed (no se pudieron traer o guardar).",
+    ["kind", "outcome"],
+)
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "CREATE", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def sql_operation(statement: str) -> str:
+    words = statement.lstrip()[:10].split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in SQL_OPERATIONS else "OTHER"
+
+
+class CacheCollector:
+    # Lee los contadores que ya llevan los TTLCache, asi el camino del cache no suma trabajo.
+    def _families(self):
+        return (CounterMetricFamily("screener_cache_hits", "Aciertos del cache de respuestas.", labels=["cache"]),
+                CounterMetricFamily("screener_cache_misses", "Fallos del cache de respuestas.", labels=["cache"]),
+                GaugeMetricFamily("screener_cache_entries", "Entradas en el cache de respuestas.", labels=["cache"]))
+
+    def describe(self):
+        return self._families()
+
+    def collect(self):
+        from cache import caches
+
+        hits, misses, size = self._families()
+        for name, cache in caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            size.add_metric([name], stats["size"])
+        yield hits
+        yield misses
+        yield size
+
+
+REGISTRY.register(CacheCollector())
+
+_pools = {}
+
+
+def register_pool(name: str, pool):
+    _pools[name] = pool
+
+
+class PoolCollector:
+    def _families(self):
+        return (GaugeMetricFamily("screener_db_pool_size", "Conexiones fijas del pool.", labels=["pool"]),
+                GaugeMetricFamily("screener_db_pool_checked_out", "Conexiones en uso.", labels=["pool"]),
+                GaugeMetricFamily("screener_db_pool_overflow", "Conexiones abiertas por encima de pool_size.",
+                                  labels=["pool"]))
+
+    def describe(self):
+        return self._families()
+
+    def collect(self):
+        size, checked_out, overflow = self._families()
+        for name, pool in _pools.items():
+            size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield size
+        yield checked_out
+        yield overflow
+
+
+REGISTRY.register(PoolCollector())
+
+
+class MetricsMiddleware:
+    # Middleware ASGI puro: no envuelve el body como BaseHTTPMiddleware, asi el streaming no se ve afectado.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Se etiqueta con el template de la ruta (/stock_prices/{symbol}) para no explotar la cardinalidad.
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
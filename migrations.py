@@ -0,0 +1,93 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+logger = logging.getLogger(__name__)
+
+# Cuantas filas duplicadas se nombran en el error de arranque.
+MAX_REPORTED_DUPLICATES = 20
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+# create_all solo crea lo que falta; lo que cambio en tablas que ya existen se ajusta aca, en cada arranque.
+# Cada paso tiene que poder repetirse sin efecto.
+
+# Indices del screener que dejaron de usarse cuando paso a filtrar sobre el snapshot en memoria: solo
+# encarecian cada upsert de un refresh.
+UNUSED_INDEXES = (
+    "ix_stock_prices_market_cap",
+    "ix_stock_prices_changes_percentage",
+    "ix_stock_prices_volume",
+    "ix_stock_prices_pe_positive",
+    "ix_company_rating_recommendation_score",
+    "ix_company_rating_score",
+)
+
+
+async def drop_unused_indexes(connection: AsyncConnection):
+    for name in UNUSED_INDEXES:
+        await connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+async def _has_unique(connection: AsyncConnection, table: str, column: str) -> bool:
+    def check(sync_connection) -> bool:
+        inspector = inspect(sync_connection)
+        return (any(index["unique"] and index["column_names"] == [column] for index in inspector.get_indexes(table))
+                or any(constraint["column_names"] == [column]
+                       for constraint in inspector.get_unique_constraints(table)))
+    return await connection.run_sync(check)
+
+
+async def ensure_unique_index(connection: AsyncConnection, table: str, column: str, keep: Optional[str]):
+    # Los upserts hacen ON CONFLICT (column), que necesita un indice unico; create_all no lo agrega a una tabla
+    # que ya existia con el indice comun del mismo nombre. Antes de crearlo se borran los duplicados, dejando
+    # la primera fila segun `keep`, y se loguean los ids borrados. Sin `keep` no se borra nada: si hay
+    # duplicados el arranque falla con la lista, para que alguien decida cual queda.
+    if await _has_unique(connection, table, column):
+        return
+    if keep is None:
+        duplicates = (await connection.execute(text(
+            f"SELECT {column}, id FROM {table} WHERE {column} IN ("
+            f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL GROUP BY {column} HAVING COUNT(*) > 1) "
+            f"ORDER BY {column}, id"))).all()
+        if duplicates:
+            listed = ", ".join(f"{value} (id {id})" for value, id in duplicates[:MAX_REPORTED_DUPLICATES])
+            extra = len(duplicates) - MAX_REPORTED_DUPLICATES
+            more = f" y {extra} mas" if extra > 0 else ""
+            raise MigrationError(f"No se puede crear el indice unico sobre {table}({column}): hay filas con el "
+                                 f"mismo {column}: {listed}{more}. Hay que borrar o corregir las que sobran.")
+    else:
+        removed = (await connection.execute(text(
+            f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY {keep}) AS position "
+            f"FROM {table} WHERE {column} IS NOT NULL) ranked WHERE position > 1 ORDER BY id"))).scalars().all()
+        if removed:
+            logger.warning("Se borran %s filas duplicadas de %s por %s antes de crear el indice unico: ids %s",
+                           len(removed), table, column, removed)
+            await connection.execute(text(f"DELETE FROM {table} WHERE id IN ({', '.join(map(str, removed))})"))
+    await connection.execute(text(f"DROP INDEX IF EXISTS ix_{table}_{column}"))
+    await connection.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+
+
+async def ensure_column(connection: AsyncConnection, table: str, column: str, definition: str):
+    # create_all no agrega columnas nuevas a una tabla existente. Se revisa antes porque SQLite no tiene
+    # ADD COLUMN IF NOT EXISTS.
+    def exists(sync_connection) -> bool:
+        return any(existing["name"] == column for existing in inspect(sync_connection).get_columns(table))
+    if not await connection.run_sync(exists):
+        await connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+async def migrate(connection: AsyncConnection):
+    await drop_unused_indexes(connection)
+    await ensure_column(connection, "company_rating", "updated_at", "BIGINT")
+    # Del quote mas nuevo de cada simbolo: antes cada refresh podia agregar una fila.
+    await ensure_unique_index(connection, "stock_prices", "symbol", "timestamp IS NULL, timestamp DESC, id DESC")
+    await ensure_unique_index(connection, "company_rating", "symbol", "id DESC")
+    # Un instrumento repetido no es un dato viejo: cualquiera de las filas puede ser la correcta.
+    await ensure_unique_index(connection, "instruments", "foreign_symbol", None)
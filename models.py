@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, Float, DateTime, BigInteger, UniqueConstraint
-from database import Base
+from database import Base, PRICE_HISTORY_PARTITIONED
 
 
 class Instruments(Base):
@@ -8,7 +8,8 @@ class Instruments(Base):
     id = Column(Integer, primary_key=True, index=True)
     cedear_symbol = Column(String)
     foreign_market = Column(String)
-    foreign_symbol = Column(String)
+    # Unico: es la clave del upsert de POST /instruments/bulk.
+    foreign_symbol = Column(String, index=True, unique=True)
     cedear_ratio = Column(Float)
     foreign_ratio = Column(Float)
 
@@ -17,7 +18,7 @@ class StockPrice(Base):
     __tablename__ = 'stock_prices'
 
     id = Column(Integer, primary_key=True, index=True)
-    symbol = Column(String, index=True)
+    symbol = Column(String, index=True, unique=True)
     name = Column(String)
     price = Column(Float)
     changes_percentage = Column(Float)
@@ -52,3 +53,39 @@ class CompanyRating(Base):
     rating_score = Column(Float)
     rating_rating = Column(String)
     rating_recommendation = Column(String)
+    # Epoch del ultimo refresh que trajo el rating de FMP, haya cambiado o no: el scheduler arranca desde aca.
+    updated_at = Column(BigInteger)
+
+
+class StockPriceHistory(Base):
+    __tablename__ = 'stock_price_history'
+
+    # La PK (symbol, timestamp) es el indice de las consultas por rango.
+    symbol = Column(String, primary_key=True)
+    timestamp = Column(BigInteger, primary_key=True)
+    price = Column(Float)
+    volume = Column(BigInteger)
+
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (timestamp)'} if PRICE_HISTORY_PARTITIONED else {}
+    )
+
+
+class TechnicalIndicators(Base):
+    __tablename__ = 'technical_indicators'
+
+    # Estado incremental de indicators.py por simbolo y los valores vigentes, que se sirven y filtran
+    # sin recalcular. Las barras son de INDICATOR_INTERVAL; la ultima (en curso) no esta en closes.
+    symbol = Column(String, primary_key=True)
+    timestamp = Column(BigInteger)
+    bucket = Column(BigInteger)
+    close = Column(Float)
+    bars = Column(Integer)
+    closes = Column(String)
+    ema = Column(Float)
+    avg_gain = Column(Float)
+    avg_loss = Column(Float)
+    sma_20 = Column(Float)
+    ema_20 = Column(Float)
+    volatility_20 = Column(Float)
+    rsi_14 = Column(Float)
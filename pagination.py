@@ -0,0 +1,49 @@
+import base64
+import json
+from typing import Callable, Optional, Sequence
+
+from fastapi import HTTPException, Response
+from sqlalchemy import Select
+from starlette.responses import StreamingResponse
+
+from database import ReadSessionLocal
+
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor invalido.")
+
+
+def paginate(query: Select, id_column, limit: Optional[int], cursor: Optional[str]) -> Select:
+    # Keyset: WHERE id > ultimo_id ORDER BY id LIMIT n, sin OFFSET.
+    if cursor:
+        query = query.where(id_column > decode_cursor(cursor))
+    return query.order_by(id_column).limit(limit)
+
+
+def set_next_cursor(response: Response, rows: Sequence, limit: Optional[int]):
+    if limit is not None and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].id)
+
+
+def ndjson_response(query: Select, serialize: Callable[[object], str]) -> StreamingResponse:
+    # Sesion propia: el stream sigue leyendo del cursor del servidor despues de que el handler retorna.
+    async def lines():
+        async with ReadSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for row in result.scalars():
+                yield serialize(row) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
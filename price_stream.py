@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional, Set
+
+from crud import STOCK_PRICE_TRACKED
+
+
+# Campos que viajan en cada delta: lo minimo para actualizar una grilla de precios.
+DELTA_FIELDS = ("symbol",) + STOCK_PRICE_TRACKED + ("change", "changes_percentage", "volume")
+HEARTBEAT_INTERVAL = 15
+
+
+def price_delta(row: dict) -> dict:
+    return {field: row.get(field) for field in DELTA_FIELDS}
+
+
+class Subscriber:
+    # Los deltas pendientes se guardan por simbolo y uno nuevo pisa al anterior: un consumidor lento recibe
+    # el ultimo precio de cada simbolo en vez de acumular una cola. La memoria queda acotada por la
+    # cantidad de simbolos suscriptos.
+    def __init__(self, symbols: Optional[Set[str]]):
+        self.symbols = symbols
+        self._pending: Dict[str, dict] = {}
+        self._ready = asyncio.Event()
+
+    def offer(self, delta: dict):
+        self._pending[delta["symbol"]] = delta
+        self._ready.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[dict]:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        batch, self._pending = self._pending, {}
+        return list(batch.values())
+
+
+class PriceBroker:
+    def __init__(self):
+        self._by_symbol: Dict[str, Set[Subscriber]] = {}
+        self._all: Set[Subscriber] = set()
+
+    def subscribe(self, symbols: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(set(symbols) if symbols else None)
+        if subscriber.symbols is None:
+            self._all.add(subscriber)
+        for symbol in subscriber.symbols or ():
+            self._by_symbol.setdefault(symbol, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._all.discard(subscriber)
+        for symbol in subscriber.symbols or ():
+            subscribers = self._by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_symbol[symbol]
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._all) + len({s for subscribers in self._by_symbol.values() for s in subscribers})
+
+    def publish(self, rows: Iterable[dict]):
+        # Sincronico y sin await: solo deja el delta en cada suscriptor, el refresh nunca espera a un cliente.
+        if not self._all and not self._by_symbol:
+            return
+        for row in rows:
+            delta = price_delta(row)
+            for subscriber in self._all:
+                subscriber.offer(delta)
+            for subscriber in self._by_symbol.get(row["symbol"], ()):
+                subscriber.offer(delta)
+
+
+broker = PriceBroker()
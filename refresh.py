@@ -0,0 +1,235 @@
+import logging
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional
+
+from pydantic import BaseModel
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from conditional import company_rating_version, stock_prices_version
+from coordination import QUOTES, RATINGS, notify
+from crud import (UpsertResult, company_rating_from_data, stock_price_from_quote, touch_company_ratings,
+                  upsert_company_ratings, upsert_stock_prices)
+from database import FMP_QUOTE_BATCH_SIZE
+from fmp import FetchResult, get_company_ratings, get_stock_prices_batch
+from history import append_price_history
+from indicators import indicators, store_states
+from price_stream import broker
+from snapshot import snapshots
+from metrics import (REFRESH_DURATION, REFRESH_LAST_SUCCESS, REFRESH_ROWS_TOTAL, REFRESH_SYMBOLS,
+                     REFRESH_SYMBOLS_TOTAL)
+
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Callbacks (kind, symbols) que se ejecutan despues de cada commit de un refresh, p.ej. el scheduler.
+refresh_listeners: List[Callable[[str, List[str]], None]] = []
+
+
+class SymbolRefresh(BaseModel):
+    symbol: str
+    status: Literal["ok", "skipped", "failed"]
+    # Segundos de la request a FMP que trajo el simbolo (en un batch de quotes, la del batch entero).
+    latency: Optional[float] = None
+    error: Optional[str] = None
+
+
+class RefreshResponse(BaseModel):
+    # written = inserted + updated; unchanged los descarto la base (IS DISTINCT FROM), skipped ni se enviaron.
+    # failed no se pudieron traer o guardar: se reintentan con ?symbols= sin repetir el resto.
+    written: int
+    skipped: int
+    inserted: int
+    updated: int
+    unchanged: int
+    failed: int
+    symbols: List[SymbolRefresh]
+
+
+class RefreshReport:
+    # Resultado por simbolo de un refresh, que se va armando batch por batch.
+    def __init__(self):
+        self.totals = UpsertResult()
+        self.symbols: Dict[str, SymbolRefresh] = {}
+
+    def stored(self, result: UpsertResult, latency: Dict[str, float]):
+        self.totals = self.totals._replace(inserted=self.totals.inserted + result.inserted,
+                                           updated=self.totals.updated + result.updated,
+                                           unchanged=self.totals.unchanged + result.unchanged,
+                                           skipped=self.totals.skipped + result.skipped)
+        skipped = set(result.skipped_symbols)
+        for symbol, seconds in latency.items():
+            self.symbols[symbol] = SymbolRefresh(symbol=symbol, status=SKIPPED if symbol in skipped else OK,
+                                                 latency=seconds)
+
+    def failed(self, errors: Dict[str, str], latency: Dict[str, float]):
+        for symbol, error in errors.items():
+            self.symbols[symbol] = SymbolRefresh(symbol=symbol, status=FAILED, latency=latency.get(symbol),
+                                                 error=error)
+
+    @property
+    def failed_symbols(self) -> List[str]:
+        return [symbol for symbol, result in self.symbols.items() if result.status == FAILED]
+
+    def response(self) -> RefreshResponse:
+        totals = self.totals
+        return RefreshResponse(written=totals.written, skipped=totals.skipped, inserted=totals.inserted,
+                               updated=totals.updated, unchanged=totals.unchanged,
+                               failed=len(self.failed_symbols), symbols=list(self.symbols.values()))
+
+
+def _notify(kind: str, symbols: List[str]):
+    for listener in refresh_listeners:
+        listener(kind, symbols)
+
+
+def _record_refresh(kind: str, symbols: int, started: float):
+    REFRESH_SYMBOLS.labels(kind).set(symbols)
+    REFRESH_SYMBOLS_TOTAL.labels(kind).inc(symbols)
+    REFRESH_DURATION.labels(kind).set(time.perf_counter() - started)
+    if symbols:
+        REFRESH_LAST_SUCCESS.labels(kind).set_to_current_time()
+
+
+def _record_rows(kind: str, result: UpsertResult):
+    for outcome in ("inserted", "updated", "unchanged", "skipped"):
+        REFRESH_ROWS_TOTAL.labels(kind, outcome).inc(getattr(result, outcome))
+
+
+async def store_quotes(db: AsyncSession, quotes: List[dict]) -> UpsertResult:
+    # Fuera de horario FMP devuelve el mismo quote una y otra vez: los que son iguales a lo guardado
+    # (el snapshot columnar) no llegan a la base, ni al historial, ni generan un commit.
+    symbols = [quote["symbol"] for quote in quotes]
+    rows = [stock_price_from_quote(quote) for quote in quotes]
+    unchanged = snapshots.current.prices.unchanged(rows)
+    quotes = [quote for quote, same in zip(quotes, unchanged) if not same]
+    rows = [row for row, same in zip(rows, unchanged) if not same]
+    if not rows:
+        # Igual se avisa a los demas workers: el lider no vuelve a pedir estos simbolos antes de tiempo.
+        await notify(db, QUOTES, symbols, written=False)
+        await db.commit()
+        result = UpsertResult(skipped=len(unchanged), skipped_symbols=tuple(symbols))
+        _record_rows(QUOTES, result)
+        _notify(QUOTES, symbols)
+        return result
+
+    # Indicadores: un paso O(1) por quote nuevo, guardado en la misma transaccion que el precio.
+    advanced = indicators.advance(rows)
+    skipped = tuple(symbol for symbol, same in zip(symbols, unchanged) if same)
+    result = (await upsert_stock_prices(db, quotes))._replace(skipped=len(skipped), skipped_symbols=skipped)
+    await append_price_history(db, quotes)
+    await store_states(db, advanced)
+    await notify(db, QUOTES, symbols)
+    await db.commit()
+    indicators.apply(advanced)
+    _record_rows(QUOTES, result)
+
+    for row in rows:
+        if row["symbol"] in advanced:
+            row.update(advanced[row["symbol"]].values())
+    await snapshots.apply_prices(db, rows)
+    broker.publish(result.changed)
+    if result.inserted or result.updated:
+        stock_prices_version.bump()
+    _notify(QUOTES, symbols)
+    return result
+
+
+async def _refresh(db: AsyncSession, kind: str, fetched: AsyncIterator[FetchResult],
+                   convert: Callable[[str, object], dict],
+                   store: Callable[[AsyncSession, Dict[str, object]], Awaitable[UpsertResult]],
+                   batch_size: int = FMP_QUOTE_BATCH_SIZE) -> RefreshReport:
+    # Lo que llega de FMP se guarda de a batches, cada uno en su propia transaccion: un simbolo que falla
+    # (en FMP, al convertirlo o en la base) no frena al resto, y lo que ya se guardo queda guardado.
+    started = time.perf_counter()
+    report = RefreshReport()
+    batch: Dict[str, object] = {}
+    latency: Dict[str, float] = {}
+
+    async def flush(batch: Dict[str, object]):
+        try:
+            result = await store(db, batch)
+        except Exception as e:
+            await db.rollback()
+            if len(batch) > 1 and isinstance(e, (IntegrityError, DataError)):
+                # Una fila que la base rechaza: como con los batches de FMP, se parte en dos hasta que solo quede
+                # marcado el simbolo que falla. Si se cayo la conexion (o cualquier otro error) reintentar por
+                # mitades solo multiplica las transacciones que van a fallar: falla el batch entero.
+                symbols = list(batch)
+                for part in (symbols[:len(symbols) // 2], symbols[len(symbols) // 2:]):
+                    await flush({symbol: batch[symbol] for symbol in part})
+                return
+            logger.exception("No se pudo guardar el refresh de %s para %s", kind, list(batch))
+            report.failed(dict.fromkeys(batch, f"Error al guardar: {e.__class__.__name__}"), latency)
+        else:
+            report.stored(result, {symbol: latency[symbol] for symbol in batch})
+
+    async with aclosing(fetched):
+        async for result in fetched:
+            report.failed(result.errors, result.latency)
+            for symbol, data in result.data.items():
+                try:
+                    convert(symbol, data)
+                except Exception as e:
+                    report.failed({symbol: f"Datos invalidos de FMP: {e}"}, result.latency)
+                    continue
+                batch[symbol] = data
+                latency[symbol] = result.latency[symbol]
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = {}
+    if batch:
+        await flush(batch)
+
+    failed = report.failed_symbols
+    if failed:
+        REFRESH_ROWS_TOTAL.labels(kind, FAILED).inc(len(failed))
+        logger.warning("Refresh de %s: %s simbolos con error (%s...)", kind, len(failed), failed[:5])
+    _record_refresh(kind, len(report.symbols) - len(failed), started)
+    return report
+
+
+async def refresh_quotes(db: AsyncSession, symbols: List[str]) -> RefreshReport:
+    return await _refresh(db, QUOTES, get_stock_prices_batch(symbols),
+                          lambda symbol, quote: stock_price_from_quote(quote),
+                          lambda db, quotes: store_quotes(db, list(quotes.values())))
+
+
+async def store_ratings(db: AsyncSession, ratings: Dict[str, object]) -> UpsertResult:
+    symbols = list(ratings)
+    rows = [company_rating_from_data(symbol, data) for symbol, data in ratings.items()]
+    unchanged = snapshots.current.ratings.unchanged(rows)
+    ratings = {symbol: data for (symbol, data), same in zip(ratings.items(), unchanged) if not same}
+    rows = [row for row, same in zip(rows, unchanged) if not same]
+    refreshed_at = int(time.time())
+    if not rows:
+        # Solo se marca cuando se refresco, para que el scheduler lo sepa aunque se reinicie.
+        await touch_company_ratings(db, symbols, refreshed_at)
+        await notify(db, RATINGS, symbols, written=False)
+        await db.commit()
+        result = UpsertResult(skipped=len(unchanged), skipped_symbols=tuple(symbols))
+        _record_rows(RATINGS, result)
+        _notify(RATINGS, symbols)
+        return result
+
+    skipped = tuple(symbol for symbol, same in zip(symbols, unchanged) if same)
+    result = (await upsert_company_ratings(db, ratings))._replace(skipped=len(skipped), skipped_symbols=skipped)
+    await touch_company_ratings(db, symbols, refreshed_at)
+    await notify(db, RATINGS, symbols)
+    await db.commit()
+    _record_rows(RATINGS, result)
+
+    await snapshots.apply_ratings(db, rows)
+    if result.inserted or result.updated:
+        company_rating_version.bump()
+    _notify(RATINGS, symbols)
+    return result
+
+
+async def refresh_ratings(db: AsyncSession, symbols: List[str]) -> RefreshReport:
+    return await _refresh(db, RATINGS, get_company_ratings(symbols), company_rating_from_data, store_ratings)
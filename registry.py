@@ -0,0 +1,99 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import CEDEAR_QUOTE_SUFFIX
+from models import Instruments
+
+
+class InstrumentRecord:
+    __slots__ = ("id", "cedear_symbol", "foreign_market", "foreign_symbol", "cedear_ratio", "foreign_ratio")
+
+    def __init__(self, id: int, cedear_symbol: Optional[str], foreign_market: Optional[str],
+                 foreign_symbol: Optional[str], cedear_ratio: Optional[float], foreign_ratio: Optional[float]):
+        self.id = id
+        self.cedear_symbol = cedear_symbol
+        self.foreign_market = foreign_market
+        self.foreign_symbol = foreign_symbol
+        self.cedear_ratio = cedear_ratio
+        self.foreign_ratio = foreign_ratio
+
+    @classmethod
+    def from_model(cls, instrument: Instruments) -> "InstrumentRecord":
+        return cls(instrument.id, instrument.cedear_symbol, instrument.foreign_market, instrument.foreign_symbol,
+                   instrument.cedear_ratio, instrument.foreign_ratio)
+
+
+class _Snapshot:
+    # Inmutable una vez construido: los lectores siempre ven un estado completo y consistente.
+    __slots__ = ("by_id", "by_foreign", "by_cedear", "foreign_symbols", "quote_symbols")
+
+    def __init__(self, records: Iterable[InstrumentRecord]):
+        self.by_id: Dict[int, InstrumentRecord] = {record.id: record for record in sorted(records, key=lambda r: r.id)}
+        self.by_foreign: Dict[str, InstrumentRecord] = {}
+        self.by_cedear: Dict[str, InstrumentRecord] = {}
+        for record in self.by_id.values():
+            if record.foreign_symbol:
+                self.by_foreign.setdefault(record.foreign_symbol, record)
+            if record.cedear_symbol:
+                self.by_cedear.setdefault(record.cedear_symbol, record)
+        self.foreign_symbols: Tuple[str, ...] = tuple(self.by_foreign)
+        # Se cotizan el subyacente y el CEDEAR en pesos (cedear_symbol + sufijo), que usa el arbitraje.
+        local_symbols = (record.cedear_symbol + CEDEAR_QUOTE_SUFFIX for record in self.by_foreign.values()
+                         if record.cedear_symbol)
+        self.quote_symbols: Tuple[str, ...] = tuple(dict.fromkeys((*self.foreign_symbols, *local_symbols)))
+
+
+class SymbolRegistry:
+    # Copia en memoria de instruments. Cada cambio arma un snapshot nuevo y lo reemplaza con una sola
+    # asignacion (copy-on-write), asi refresh y GETs nunca leen un estado a medio actualizar ni van a la base.
+    def __init__(self):
+        self._snapshot = _Snapshot(())
+        # Callbacks (foreign_symbols) despues de cada cambio, p.ej. el scheduler o el snapshot columnar.
+        self.listeners: List[Callable[[Tuple[str, ...]], None]] = []
+
+    def _swap(self, records: Iterable[InstrumentRecord]):
+        # Se avisa en todo cambio, no solo en altas y bajas: los ratios tambien se sirven desde snapshot.py.
+        self._snapshot = _Snapshot(records)
+        for listener in self.listeners:
+            listener(self._snapshot.foreign_symbols)
+
+    async def load(self, db: AsyncSession):
+        instruments = (await db.execute(select(Instruments))).scalars().all()
+        self._swap(InstrumentRecord.from_model(instrument) for instrument in instruments)
+
+    def upsert(self, instrument: Instruments):
+        records = dict(self._snapshot.by_id)
+        records[instrument.id] = InstrumentRecord.from_model(instrument)
+        self._swap(records.values())
+
+    def remove(self, id: int):
+        records = dict(self._snapshot.by_id)
+        if records.pop(id, None) is not None:
+            self._swap(records.values())
+
+    def foreign_symbols(self) -> Tuple[str, ...]:
+        return self._snapshot.foreign_symbols
+
+    def quote_symbols(self) -> Tuple[str, ...]:
+        return self._snapshot.quote_symbols
+
+    def records_by_foreign_symbol(self) -> Dict[str, InstrumentRecord]:
+        # El dict del snapshot vigente; no se modifica nunca, un cambio arma otro.
+        return self._snapshot.by_foreign
+
+    def get(self, id: int) -> Optional[InstrumentRecord]:
+        return self._snapshot.by_id.get(id)
+
+    def by_foreign_symbol(self, symbol: str) -> Optional[InstrumentRecord]:
+        return self._snapshot.by_foreign.get(symbol)
+
+    def by_cedear_symbol(self, symbol: str) -> Optional[InstrumentRecord]:
+        return self._snapshot.by_cedear.get(symbol)
+
+    def __len__(self) -> int:
+        return len(self._snapshot.by_id)
+
+
+registry = SymbolRegistry()
@@ -0,0 +1,58 @@
+from typing import Annotated, List, Optional
+
+from fastapi import APIRouter, Query
+from pydantic import BaseModel
+from starlette import status
+
+from arbitrage import compute, get_inputs, to_json_values
+
+router = APIRouter(
+    prefix="/arbitrage",
+    tags=["Arbitrage"]
+)
+
+
+class ArbitrageItem(BaseModel):
+    cedear_symbol: Optional[str]
+    foreign_symbol: Optional[str]
+    foreign_price: Optional[float]
+    local_price: Optional[float]
+    usd_equivalent: Optional[float]
+    implied_local_price: Optional[float]
+    implied_ccl: Optional[float]
+    premium: Optional[float]
+
+
+class ArbitrageResponse(BaseModel):
+    reference_ccl: Optional[float]
+    instruments: List[ArbitrageItem]
+
+
+@router.get("", response_model=ArbitrageResponse, status_code=status.HTTP_200_OK)
+async def get_arbitrage(ccl: Annotated[Optional[float], Query(gt=0)] = None) -> ArbitrageResponse:
+    inputs = get_inputs()
+    result = compute(inputs, ccl)
+
+    columns = zip(inputs.cedear_symbols,
+                  inputs.foreign_symbols,
+                  to_json_values(inputs.foreign_price),
+                  to_json_values(inputs.local_price),
+                  to_json_values(result["usd_equivalent"]),
+                  to_json_values(result["implied_local_price"]),
+                  to_json_values(result["implied_ccl"]),
+                  to_json_values(result["premium"]))
+    reference_ccl = float(result["reference_ccl"])
+
+    return ArbitrageResponse(
+        reference_ccl=reference_ccl if reference_ccl == reference_ccl else None,
+        instruments=[ArbitrageItem(cedear_symbol=cedear_symbol,
+                                   foreign_symbol=foreign_symbol,
+                                   foreign_price=foreign_price,
+                                   local_price=local_price,
+                                   usd_equivalent=usd_equivalent,
+                                   implied_local_price=implied_local_price,
+                                   implied_ccl=implied_ccl,
+                                   premium=premium)
+                     for (cedear_symbol, foreign_symbol, foreign_price, local_price, usd_equivalent,
+                          implied_local_price, implied_ccl, premium) in columns]
+    )
@@ -0,0 +1,27 @@
+from typing import Dict
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+from starlette import status
+
+from cache import caches
+
+router = APIRouter(
+    prefix="/cache",
+    tags=["Cache"]
+)
+
+
+class CacheStatsResponse(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+
+
+@router.get("", response_model=Dict[str, CacheStatsResponse], status_code=status.HTTP_200_OK)
+async def get_cache_stats() -> Dict[str, CacheStatsResponse]:
+    for cache in caches.values():
+        await cache.measure()
+    return {name: CacheStatsResponse(**cache.stats()) for name, cache in caches.items()}
@@ -1,12 +1,21 @@
-from typing import List, Union, Annotated
+from typing import List, Literal, Optional, Union, Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-
-from database import SessionLocal
-from fmp import get_company_rating
-from models import CompanyRating, Instruments
+from sqlalchemy import select
+from starlette import status
+
+from cache import ratings_cache
+from conditional import company_rating_version, not_modified, set_validators
+from coordination import RATINGS, RefreshInProgress, exclusive, shared
+from database import db_dependency
+from models import CompanyRating
+from pagination import MAX_PAGE_SIZE, paginate
+from refresh import RefreshResponse, refresh_ratings
+from registry import registry
+from serialization import ROWS, JSONBytesResponse, ndjson_rows, parse_fields, table_response
+from snapshot import snapshots
 
 router = APIRouter(
     prefix="/company_rating",
@@ -14,17 +23,6 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
-
-
 class CompanyRatingResponse(BaseModel):
     id: int
     symbol: str
@@ -33,115 +31,63 @@ class CompanyRatingResponse(BaseModel):
     rating_recommendation: str
 
 
-@router.get("", response_model=List[CompanyRatingResponse])
-async def get_all_ratings(db: db_dependency):
-    company_ratings = db.query(CompanyRating).all()
-
-    response = [
-        CompanyRatingResponse(
-            id=rating.id,
-            symbol=rating.symbol,
-            rating_score=rating.rating_score,
-            rating_rating=rating.rating_rating,
-            rating_recommendation=rating.rating_recommendation
-        )
-        for rating in company_ratings
-    ]
+RATING_FIELDS = tuple(CompanyRatingResponse.model_fields)
 
+
+@router.get("", response_model=List[CompanyRatingResponse])
+async def get_all_ratings(request: Request,
+                          limit: Annotated[Optional[int], Query(gt=0, le=MAX_PAGE_SIZE)] = None,
+                          cursor: Optional[str] = None,
+                          stream: bool = False,
+                          format: Literal["rows", "columnar"] = ROWS,
+                          fields: Optional[str] = None):
+    selected = parse_fields(fields, RATING_FIELDS)
+    if stream:
+        query = paginate(select(*(getattr(CompanyRating, field) for field in selected)), CompanyRating.id, limit, cursor)
+        return ndjson_rows(query, selected)
+
+    etag = company_rating_version.etag(request.url.query)
+    last_modified = company_rating_version.last_modified
+    unchanged = not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    response = await table_response(snapshots.current.ratings, ratings_cache, selected, format, limit, cursor)
+    set_validators(response, etag, last_modified)
     return response
 
 
 @router.get("/{symbol}", response_model=CompanyRatingResponse)
-async def get_by_symbol(symbol: str, db: db_dependency):
-    company_rating = db.query(CompanyRating).filter(CompanyRating.symbol == symbol).first()
-
-    if not company_rating:
+async def get_by_symbol(symbol: str):
+    ratings = snapshots.current.ratings
+    position = ratings.index.get(symbol)
+    if position is None:
         raise HTTPException(status_code=404,
                             detail=f'Rating no encontrado. El simbolo {symbol} no se encuentra en la base de datos.')
 
-    return CompanyRatingResponse(
-        id=company_rating.id,
-        symbol=company_rating.symbol,
-        rating_score=company_rating.rating_score,
-        rating_rating=company_rating.rating_rating,
-        rating_recommendation=company_rating.rating_recommendation
-    )
-
-
-@router.put("", response_model=str)
-async def update_all_rankings(db: db_dependency):
-    symbols = [instrument.foreign_symbol for instrument in db.query(Instruments).all()]
-
-    for symbol in symbols:
-        rating_data = get_company_rating(symbol)
-
-        if isinstance(rating_data, dict):
-            rating_score = rating_data.get("ratingScore", 0)
-            rating_rating = rating_data.get("rating", "")
-            rating_recommendation = rating_data.get("ratingRecommendation", "")
-        elif isinstance(rating_data, list) and rating_data:
-            # Adjust accordingly based on the actual structure of the list response
-            rating_score = rating_data[0].get("ratingScore", 0)
-            rating_rating = rating_data[0].get("rating", "")
-            rating_recommendation = rating_data[0].get("ratingRecommendation", "")
-        else:
-            rating_score = 0
-            rating_rating = ""
-            rating_recommendation = ""
+    return JSONBytesResponse(orjson.dumps(ratings.row(position, RATING_FIELDS)))
 
-        company_rating = db.query(CompanyRating).filter(CompanyRating.symbol == symbol).first()
-
-        if not company_rating:
-            company_rating = CompanyRating(
-                symbol=symbol,
-                rating_score=rating_score,
-                rating_rating=rating_rating,
-                rating_recommendation=rating_recommendation
-            )
-            db.add(company_rating)
-        else:
-            company_rating.rating_score = rating_score
-            company_rating.rating_rating = rating_rating
-            company_rating.rating_recommendation = rating_recommendation
-
-        db.commit()
-
-    return "Registros actualizados con exito"
-
-
-@router.put("/{symbol}", response_model=str)
-async def update_by_symbol(symbol: str, db: db_dependency):
-    rating_data_list = get_company_rating(symbol)
-
-    if not rating_data_list:
-        raise HTTPException(status_code=500, detail=f"No se pudo obtener el company rating para {symbol}.")
-
-    rating_data = rating_data_list[0] if isinstance(rating_data_list, list) and rating_data_list else rating_data_list
-
-    if not rating_data:
-        raise HTTPException(status_code=500, detail=f"No se pudo obtener el company rating para {symbol}.")
-
-    rating_score = rating_data.get("ratingScore", 0)
-    rating_rating = rating_data.get("rating", "")
-    rating_recommendation = rating_data.get("ratingRecommendation", "")
-
-    company_rating = db.query(CompanyRating).filter(CompanyRating.symbol == symbol).first()
-
-    if not company_rating:
-        company_rating = CompanyRating(
-            symbol=symbol,
-            rating_score=rating_score,
-            rating_rating=rating_rating,
-            rating_recommendation=rating_recommendation
-        )
-        db.add(company_rating)
-
-    else:
-        company_rating.rating_score = rating_score
-        company_rating.rating_rating = rating_rating
-        company_rating.rating_recommendation = rating_recommendation
 
+@router.put("", response_model=RefreshResponse)
+async def update_all_rankings(db: db_dependency, symbols: Optional[str] = None) -> RefreshResponse:
+    # ?symbols=A,B refresca solo esos, p.ej. los que figuran como failed en el reporte anterior.
+    # Entre todos los workers corre un solo refresh masivo por vez; el resto contesta 409 sin pedir nada a FMP.
+    targets = [symbol.strip() for symbol in symbols.split(",") if symbol.strip()] if symbols else None
+    try:
+        async with exclusive(RATINGS):
+            report = await refresh_ratings(db, targets or list(registry.foreign_symbols()))
+    except RefreshInProgress:
+        raise HTTPException(status_code=409, detail="Ya hay un refresh de ratings en curso.")
+    return report.response()
 
-    db.commit()
 
-    return f"Registro actualizado para el símbolo {symbol}"
+@router.put("/{symbol}", response_model=RefreshResponse)
+async def update_by_symbol(symbol: str, db: db_dependency, response: Response) -> RefreshResponse:
+    try:
+        async with shared(RATINGS):
+            report = await refresh_ratings(db, [symbol])
+    except RefreshInProgress:
+        raise HTTPException(status_code=409, detail="Ya hay un refresh de ratings en curso.")
+    if report.failed_symbols:
+        response.status_code = status.HTTP_502_BAD_GATEWAY
+    return report.response()
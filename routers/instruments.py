@@ -1,29 +1,25 @@
-from typing import Annotated, List
-from fastapi import APIRouter, Depends, Path, HTTPException
+from typing import Annotated, List, Literal, Optional
+from fastapi import APIRouter, Path, HTTPException, Query, Request, Response
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
 from starlette import status
 from starlette.responses import JSONResponse
+from bulk_import import CSV, INSTRUMENT_FIELDS, NDJSON, import_instruments
 import models
-from database import SessionLocal
+from conditional import instruments_version, not_modified, set_validators
+from coordination import INSTRUMENTS, notify
+from database import db_dependency
 from models import Instruments
+from pagination import MAX_PAGE_SIZE, ndjson_response, paginate, set_next_cursor
+from registry import registry
+from serialization import csv_rows, ndjson_rows
 
 router = APIRouter(
     prefix='/instruments',
     tags=['instruments'])
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
-
-
 class InstrumentsRequest(BaseModel):
     cedear_symbol: str = Field(min_length=1, max_length=255)
     foreign_market: str = Field(min_length=1, max_length=255)
@@ -41,49 +37,123 @@ class InstrumentsResponse(BaseModel):
     foreign_ratio: float
 
 
+def _to_response(inst: Instruments) -> InstrumentsResponse:
+    return InstrumentsResponse(id=inst.id,
+                               cedear_symbol=inst.cedear_symbol,
+                               foreign_market=inst.foreign_market or "",
+                               foreign_symbol=inst.foreign_symbol or "",
+                               cedear_ratio=inst.cedear_ratio or 0,
+                               foreign_ratio=inst.foreign_ratio or 0)
+
+
 @router.get("/", response_model=List[InstrumentsResponse], status_code=status.HTTP_200_OK)
-async def get_all(db: db_dependency) -> List[InstrumentsResponse]:
-    instrumentos = db.query(Instruments).all()
-    return [InstrumentsResponse(id=inst.id,
-                                cedear_symbol=inst.cedear_symbol,
-                                foreign_market=inst.foreign_market or "",
-                                foreign_symbol=inst.foreign_symbol or "",
-                                cedear_ratio=inst.cedear_ratio or 0,
-                                foreign_ratio=inst.foreign_ratio or 0)
-            for inst in instrumentos]
+async def get_all(db: db_dependency,
+                  request: Request,
+                  response: Response,
+                  limit: Annotated[Optional[int], Query(gt=0, le=MAX_PAGE_SIZE)] = None,
+                  cursor: Optional[str] = None,
+                  stream: bool = False) -> List[InstrumentsResponse]:
+    query = paginate(select(Instruments), Instruments.id, limit, cursor)
+    if stream:
+        return ndjson_response(query, lambda inst: _to_response(inst).model_dump_json())
+
+    etag = instruments_version.etag(request.url.query)
+    unchanged = not_modified(request, etag, instruments_version.last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    instrumentos = (await db.execute(query)).scalars().all()
+    set_validators(response, etag, instruments_version.last_modified)
+    set_next_cursor(response, instrumentos, limit)
+    return [_to_response(inst) for inst in instrumentos]
+
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+
+class BulkImportResponse(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: List[BulkImportError]
+
+
+# /export se declara antes de /{symbol} para que no lo tome como un simbolo.
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_instruments(format: Literal["csv", "ndjson"] = CSV):
+    # Mismo formato que acepta POST /instruments/bulk, asi el archivo exportado se puede volver a importar.
+    query = select(*[getattr(Instruments, field) for field in INSTRUMENT_FIELDS]).order_by(Instruments.id)
+    if format == CSV:
+        return csv_rows(query, INSTRUMENT_FIELDS)
+    return ndjson_rows(query, INSTRUMENT_FIELDS)
 
 
 @router.get("/{symbol}", response_model=InstrumentsResponse, status_code=status.HTTP_200_OK)
-async def get_by_symbol(db: db_dependency, symbol: str) -> InstrumentsResponse:
-    simbolo = db.query(Instruments).filter(Instruments.foreign_symbol == symbol).first()
+async def get_by_symbol(symbol: str) -> InstrumentsResponse:
+    # Se resuelve desde el registry en memoria: acepta tanto el foreign_symbol como el cedear_symbol.
+    simbolo = registry.by_foreign_symbol(symbol) or registry.by_cedear_symbol(symbol)
     if simbolo is not None:
-        return InstrumentsResponse(**simbolo.__dict__)
+        return _to_response(simbolo)
     raise HTTPException(status_code=404, detail='Instrument no encontrado.')
 
 
 @router.post("/create_instrument", status_code=status.HTTP_201_CREATED)
 async def create_instrument(db: db_dependency, inst_request: InstrumentsRequest):
-    inst_existe = db.query(Instruments).filter(
-        Instruments.foreign_symbol == inst_request.foreign_symbol).first()
-
-    if inst_existe:
+    if registry.by_foreign_symbol(inst_request.foreign_symbol) is not None:
         raise HTTPException(status_code=400, detail="Ya existe un instrument con el foreign_symbol que está intentando crear.")
 
     instrumento = models.Instruments(**inst_request.model_dump())
 
     db.add(instrumento)
-    db.commit()
+    await notify(db, INSTRUMENTS)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Otro worker lo dio de alta despues de que este leyo su registry: lo frena el indice unico.
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Ya existe un instrument con el foreign_symbol que está intentando crear.")
+    registry.upsert(instrumento)
+    instruments_version.bump()
 
     return JSONResponse(content="Instrument creado con exito.")
 
 
+@router.post("/bulk", response_model=BulkImportResponse, status_code=status.HTTP_200_OK)
+async def bulk_import_instruments(db: db_dependency,
+                                  request: Request,
+                                  format: Optional[Literal["csv", "ndjson"]] = None) -> BulkImportResponse:
+    # CSV con encabezado o NDJSON (una fila por linea); sin ?format= se decide por el Content-Type.
+    if format is None:
+        format = CSV if "csv" in request.headers.get("content-type", "") else NDJSON
+
+    result = await import_instruments(db, await request.body(), format, InstrumentsRequest)
+    if result.inserted or result.updated:
+        await notify(db, INSTRUMENTS)
+    await db.commit()
+    if result.inserted or result.updated:
+        await registry.load(db)
+        instruments_version.bump()
+
+    return BulkImportResponse(inserted=result.inserted,
+                              updated=result.updated,
+                              unchanged=result.unchanged,
+                              rejected=result.rejected,
+                              errors=[BulkImportError(**error) for error in result.errors])
+
+
 @router.put("/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_instrument(db: db_dependency,
                             inst_request: InstrumentsRequest,
                             id: int = Path(gt=0)):
-    instrumento = db.query(Instruments).filter(Instruments.id == id).first()
+    instrumento = await db.get(Instruments, id)
     if instrumento is None:
         raise HTTPException(status_code=404, detail='Instrument no encontrado.')
+    duplicado = registry.by_foreign_symbol(inst_request.foreign_symbol)
+    if duplicado is not None and duplicado.id != id:
+        raise HTTPException(status_code=400, detail="Ya existe un instrument con el foreign_symbol que está intentando asignar.")
 
     instrumento.cedear_symbol = inst_request.cedear_symbol
     instrumento.foreign_market = inst_request.foreign_market
@@ -91,18 +161,28 @@ async def update_instrument(db: db_dependency,
     instrumento.cedear_ratio = inst_request.cedear_ratio
     instrumento.foreign_ratio = inst_request.foreign_ratio
 
-    db.commit()
+    await notify(db, INSTRUMENTS)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Ya existe un instrument con el foreign_symbol que está intentando asignar.")
+    registry.upsert(instrumento)
+    instruments_version.bump()
 
     return JSONResponse(content=f"Instrument {id} modificado exitosamente")
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_instrument(db: db_dependency, id: int = Path(gt=0)):
-    instrumento = db.query(Instruments).filter(Instruments.id == id).first()
+    instrumento = await db.get(Instruments, id)
 
     if instrumento is None:
         raise HTTPException(status_code=404, detail='Instrument no encontrado.')
-    db.query(Instruments).filter(Instruments.id == id).delete()
-    db.commit()
+    await db.execute(delete(Instruments).filter(Instruments.id == id))
+    await notify(db, INSTRUMENTS)
+    await db.commit()
+    registry.remove(id)
+    instruments_version.bump()
 
     return JSONResponse(content=f"Instrument {id} eliminado exitosamente")
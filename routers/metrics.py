@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from starlette.responses import Response
+
+from metrics import CONTENT_TYPE_LATEST, render
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
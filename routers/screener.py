@@ -0,0 +1,87 @@
+from typing import Annotated, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from starlette import status
+
+from serialization import ROWS, JSONBytesResponse, encode_columns, parse_fields
+from snapshot import screen as screen_snapshot, snapshots
+
+router = APIRouter(
+    prefix="/screener",
+    tags=["Screener"]
+)
+
+MAX_SCREENER_LIMIT = 1000
+
+SORT_FIELDS = ("symbol", "price", "pe", "market_cap", "changes_percentage", "volume", "rating_score",
+               "rsi_14", "volatility_20")
+
+
+class ScreenerResponse(BaseModel):
+    symbol: str
+    name: Optional[str]
+    cedear_symbol: Optional[str]
+    price: Optional[float]
+    changes_percentage: Optional[float]
+    market_cap: Optional[float]
+    volume: Optional[int]
+    pe: Optional[float]
+    rating_score: Optional[float]
+    rating_rating: Optional[str]
+    rating_recommendation: Optional[str]
+    cedear_ratio: Optional[float]
+    foreign_ratio: Optional[float]
+    sma_20: Optional[float]
+    ema_20: Optional[float]
+    volatility_20: Optional[float]
+    rsi_14: Optional[float]
+
+
+SCREENER_FIELDS = tuple(ScreenerResponse.model_fields)
+
+
+def _order_by(sort: str) -> List[Tuple[str, bool]]:
+    order = []
+    for key in filter(None, (part.strip() for part in sort.split(","))):
+        field = key.lstrip("-+")
+        if field not in SORT_FIELDS:
+            raise HTTPException(status_code=400,
+                                detail=f"No se puede ordenar por '{key}'. Opciones: {', '.join(SORT_FIELDS)}.")
+        order.append((field, key.startswith("-")))
+    return order
+
+
+@router.get("", response_model=List[ScreenerResponse], status_code=status.HTTP_200_OK)
+async def screen(min_pe: Optional[float] = None,
+                 max_pe: Optional[float] = None,
+                 min_market_cap: Optional[float] = None,
+                 max_market_cap: Optional[float] = None,
+                 min_changes_percentage: Optional[float] = None,
+                 max_changes_percentage: Optional[float] = None,
+                 min_volume: Optional[int] = None,
+                 max_volume: Optional[int] = None,
+                 min_rating_score: Optional[float] = None,
+                 max_rating_score: Optional[float] = None,
+                 min_rsi: Optional[float] = None,
+                 max_rsi: Optional[float] = None,
+                 min_volatility: Optional[float] = None,
+                 max_volatility: Optional[float] = None,
+                 rating_recommendation: Annotated[Optional[List[str]], Query()] = None,
+                 sort: str = "-market_cap",
+                 limit: Annotated[int, Query(gt=0, le=MAX_SCREENER_LIMIT)] = 100,
+                 fields: Optional[str] = None) -> List[ScreenerResponse]:
+    selected = parse_fields(fields, SCREENER_FIELDS)
+    ranges = {
+        "pe": (min_pe, max_pe),
+        "market_cap": (min_market_cap, max_market_cap),
+        "changes_percentage": (min_changes_percentage, max_changes_percentage),
+        "volume": (min_volume, max_volume),
+        "rating_score": (min_rating_score, max_rating_score),
+        "rsi_14": (min_rsi, max_rsi),
+        "volatility_20": (min_volatility, max_volatility),
+    }
+
+    # Precios + instrumentos + ratings filtrados, ordenados y limitados sobre el snapshot columnar, sin ir a la base.
+    view, positions = screen_snapshot(snapshots.current, ranges, rating_recommendation, _order_by(sort), limit)
+    return JSONBytesResponse(encode_columns(selected, view.take(positions, selected), ROWS))
@@ -1,30 +1,35 @@
-from datetime import datetime
-from typing import Annotated, List, Optional
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+import numpy as np
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, Response, WebSocket
 from pydantic import BaseModel, validator
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from starlette import status
-
-from database import SessionLocal
-from fmp import get_stock_prices
-from models import Instruments, StockPrice
+from starlette.responses import StreamingResponse
+
+from cache import prices_cache
+from conditional import not_modified, set_validators, stock_prices_version, symbol_etag
+from coordination import QUOTES, RefreshInProgress, exclusive, shared
+from database import db_dependency
+from history import MAX_BUCKETS, get_ohlc, parse_interval
+from indicators import INDICATOR_FIELDS
+from models import StockPrice, TechnicalIndicators
+from pagination import MAX_PAGE_SIZE, paginate
+from price_stream import HEARTBEAT_INTERVAL, broker
+from refresh import RefreshResponse, refresh_quotes
+from registry import registry
+from serialization import ROWS, JSONBytesResponse, ndjson_rows, parse_fields, table_response
+from snapshot import snapshots
 
 router = APIRouter(
     prefix="/stock_prices",
     tags=["Stock Prices"]
 )
 
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+HISTORY_DEFAULT_RANGE = timedelta(days=30)
 
 
 class StockPriceResponse(BaseModel):
@@ -51,6 +56,11 @@ class StockPriceResponse(BaseModel):
     earnings_announcement: Optional[datetime]
     shares_outstanding: int
     timestamp: Optional[datetime]
+    # Indicadores por barra de INDICATOR_INTERVAL (ver indicators.py); nulos hasta tener historia suficiente.
+    sma_20: Optional[float] = None
+    ema_20: Optional[float] = None
+    volatility_20: Optional[float] = None
+    rsi_14: Optional[float] = None
 
     @validator("earnings_announcement", pre=True, always=True)
     def parse_earnings_announcement(cls, value):
@@ -70,172 +80,175 @@ class StockPriceResponse(BaseModel):
         return datetime.utcfromtimestamp(value)
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
+PRICE_FIELDS = tuple(StockPriceResponse.model_fields)
+# Lo mismo que hacen los validators / tipos del modelo, aplicado solo a las columnas que lo necesitan.
+PRICE_CONVERTERS = {"timestamp": datetime.utcfromtimestamp, "shares_outstanding": int}
+
+
+class PriceHistoryResponse(BaseModel):
+    timestamp: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    count: int
+
+
+def _from_epoch(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def _epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
 
 
 @router.get("", response_model=List[StockPriceResponse], status_code=status.HTTP_200_OK)
-async def get_all_prices(db: db_dependency) -> List[StockPriceResponse]:
-    stock_prices = db.query(StockPrice).all()
-    return [StockPriceResponse(**stock_price.__dict__) for stock_price in stock_prices]
+async def get_all_prices(request: Request,
+                         limit: Annotated[Optional[int], Query(gt=0, le=MAX_PAGE_SIZE)] = None,
+                         cursor: Optional[str] = None,
+                         stream: bool = False,
+                         format: Literal["rows", "columnar"] = ROWS,
+                         fields: Optional[str] = None) -> List[StockPriceResponse]:
+    selected = parse_fields(fields, PRICE_FIELDS)
+    if stream:
+        # El NDJSON sigue leyendo de la base con un cursor del servidor, sin armar la respuesta en memoria.
+        columns = [getattr(TechnicalIndicators if field in INDICATOR_FIELDS else StockPrice, field) for field in selected]
+        query = (select(*columns).select_from(StockPrice)
+                 .outerjoin(TechnicalIndicators, TechnicalIndicators.symbol == StockPrice.symbol))
+        query = paginate(query, StockPrice.id, limit, cursor)
+        return ndjson_rows(query, selected, PRICE_CONVERTERS)
+
+    etag = stock_prices_version.etag(request.url.query)
+    last_modified = stock_prices_version.last_modified
+    unchanged = not_modified(request, etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    response = await table_response(snapshots.current.prices, prices_cache, selected, format, limit, cursor,
+                                    PRICE_CONVERTERS)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def _parse_symbols(symbols: Optional[str]) -> Optional[List[str]]:
+    return [symbol.strip() for symbol in symbols.split(",") if symbol.strip()] if symbols else None
+
+
+# /stream se declara antes de /{symbol} para que no lo tome como un simbolo.
+@router.get("/stream", status_code=status.HTTP_200_OK)
+async def stream_prices(symbols: Optional[str] = None) -> StreamingResponse:
+    # Server-Sent Events: un evento "prices" con los deltas de cada refresh que cambio precio o timestamp.
+    # Sin cambios se manda un comentario cada HEARTBEAT_INTERVAL para mantener viva la conexion.
+    wanted = _parse_symbols(symbols)
+
+    async def events():
+        # Se suscribe recien cuando arranca el stream: si el cliente se va antes, no queda nada que limpiar.
+        subscriber = broker.subscribe(wanted)
+        try:
+            while True:
+                batch = await subscriber.next_batch(HEARTBEAT_INTERVAL)
+                yield (b"event: prices\ndata: " + orjson.dumps(batch) + b"\n\n") if batch else b": ping\n\n"
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/stream")
+async def stream_prices_ws(websocket: WebSocket, symbols: Optional[str] = None):
+    await websocket.accept()
+    subscriber = broker.subscribe(_parse_symbols(symbols))
+
+    async def send():
+        while True:
+            await websocket.send_text(orjson.dumps(await subscriber.next_batch()).decode())
+
+    sender = asyncio.create_task(send())
+    try:
+        # El cliente no manda nada; se lee solo para enterarse del cierre aunque no haya deltas.
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        broker.unsubscribe(subscriber)
 
 
 @router.get("/{symbol}", response_model=StockPriceResponse, status_code=status.HTTP_200_OK)
-async def get_by_symbol(db: db_dependency, symbol: str) -> StockPriceResponse:
-    stock_price = db.query(StockPrice).filter(StockPrice.symbol == symbol).first()
-    if stock_price is not None:
-        return StockPriceResponse(**stock_price.__dict__)
-    raise HTTPException(status_code=404,
-                        detail=f'Precio no encontrado. El simbolo {symbol} no se encuentra en la base de datos.')
-
-
-@router.put("", response_model=str)
-async def update_all_prices(db: db_dependency):
-    symbols = [instrument.foreign_symbol for instrument in db.query(Instruments).all()]
-    response = []
-
-    for symbol in symbols:
-        stock_data = get_stock_prices(symbol)
-        stock_price = db.query(StockPrice).filter(StockPrice.symbol == symbol).first()
-
-        if not stock_price:
-            stock_price = StockPrice(
-                symbol=stock_data["symbol"],
-                price=stock_data["price"],
-                name=stock_data["name"],
-                changes_percentage=stock_data["changesPercentage"],
-                change=stock_data["change"],
-                day_low=stock_data["dayLow"],
-                day_high=stock_data["dayHigh"],
-                year_high=stock_data["yearHigh"],
-                year_low=stock_data["yearLow"],
-                market_cap=stock_data["marketCap"],
-                price_avg50=stock_data["priceAvg50"],
-                price_avg200=stock_data["priceAvg200"],
-                exchange=stock_data["exchange"],
-                volume=stock_data["volume"],
-                avg_volume=stock_data["avgVolume"],
-                open=stock_data["open"],
-                previous_close=stock_data["previousClose"],
-                eps=stock_data["eps"],
-                pe=stock_data["pe"],
-                earnings_announcement=stock_data["earningsAnnouncement"],
-                shares_outstanding=stock_data["sharesOutstanding"],
-                timestamp=stock_data["timestamp"]
-            )
-            db.add(stock_price)
+async def get_by_symbol(request: Request, symbol: str) -> StockPriceResponse:
+    prices = snapshots.current.prices
+    position = prices.index.get(symbol)
+    if position is None:
+        raise HTTPException(status_code=404,
+                            detail=f'Precio no encontrado. El simbolo {symbol} no se encuentra en la base de datos.')
+
+    # ETag: la huella de la fila (precio, indicadores, todo lo que va en la respuesta). Last-Modified: el
+    # timestamp del quote guardado.
+    timestamp = prices.columns["timestamp"][position]
+    validators = None if np.isnan(timestamp) else (symbol_etag(symbol, prices.row_digest(position)),
+                                                   _from_epoch(int(timestamp)))
+    if validators is not None:
+        unchanged = not_modified(request, *validators)
+        if unchanged is not None:
+            return unchanged
+
+    response = JSONBytesResponse(orjson.dumps(prices.row(position, PRICE_FIELDS, PRICE_CONVERTERS)))
+    if validators is not None:
+        set_validators(response, *validators)
+    return response
+
+
+@router.get("/{symbol}/history", response_model=List[PriceHistoryResponse], status_code=status.HTTP_200_OK)
+async def get_price_history(db: db_dependency,
+                            symbol: str,
+                            from_: Annotated[Optional[datetime], Query(alias="from")] = None,
+                            to: Optional[datetime] = None,
+                            interval: str = "1d") -> List[PriceHistoryResponse]:
+    try:
+        step = parse_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    end = _epoch(to) if to else int(datetime.now(timezone.utc).timestamp())
+    start = _epoch(from_) if from_ else end - int(HISTORY_DEFAULT_RANGE.total_seconds())
+    if end <= start:
+        raise HTTPException(status_code=400, detail="El parametro 'from' debe ser anterior a 'to'.")
+    if (end - start) / step > MAX_BUCKETS:
+        raise HTTPException(status_code=400,
+                            detail=f"El rango pedido genera mas de {MAX_BUCKETS} intervalos. Use un interval mayor.")
+
+    rows = await get_ohlc(db, symbol, start, end, step)
+    return [PriceHistoryResponse(timestamp=datetime.utcfromtimestamp(row.bucket),
+                                 open=row.open,
+                                 high=row.high,
+                                 low=row.low,
+                                 close=row.close,
+                                 count=row.count)
+            for row in rows]
+
+
+@router.put("", response_model=RefreshResponse)
+async def update_all_prices(db: db_dependency, symbols: Optional[str] = None) -> RefreshResponse:
+    # ?symbols=A,B refresca solo esos, p.ej. los que figuran como failed en el reporte anterior.
+    # Entre todos los workers corre un solo refresh masivo por vez; el resto contesta 409 sin pedir nada a FMP.
+    try:
+        async with exclusive(QUOTES):
+            report = await refresh_quotes(db, _parse_symbols(symbols) or list(registry.quote_symbols()))
+    except RefreshInProgress:
+        raise HTTPException(status_code=409, detail="Ya hay un refresh de precios en curso.")
+    return report.response()
 
-        else:
-            stock_price.price = stock_data["price"]
-            stock_price.changes_percentage = stock_data["changesPercentage"]
-            stock_price.name = stock_data["name"]
-            stock_price.change = stock_data["change"]
-            stock_price.day_low = stock_data["dayLow"]
-            stock_price.day_high = stock_data["dayHigh"]
-            stock_price.year_high = stock_data["yearHigh"]
-            stock_price.year_low = stock_data["yearLow"]
-            stock_price.market_cap = stock_data["marketCap"]
-            stock_price.price_avg50 = stock_data["priceAvg50"]
-            stock_price.price_avg200 = stock_data["priceAvg200"]
-            stock_price.exchange = stock_data["exchange"]
-            stock_price.volume = stock_data["volume"]
-            stock_price.avg_volume = stock_data["avgVolume"]
-            stock_price.open = stock_data["open"]
-            stock_price.previous_close = stock_data["previousClose"]
-            stock_price.eps = stock_data["eps"]
-            stock_price.pe = stock_data["pe"]
-            stock_price.earnings_announcement = stock_data["earningsAnnouncement"]
-            stock_price.shares_outstanding = stock_data["sharesOutstanding"]
-            stock_price.timestamp = stock_data["timestamp"]
-
-        db.commit()
-
-        response.append(
-            StockPriceResponse(
-                id=stock_price.id,
-                symbol=stock_price.symbol,
-                name=stock_price.name,
-                price=stock_price.price,
-                changes_percentage=stock_price.changes_percentage,
-                change=stock_price.change,
-                day_low=stock_price.day_low,
-                day_high=stock_price.day_high,
-                year_high=stock_price.year_high,
-                year_low=stock_price.year_low,
-                market_cap=stock_price.market_cap,
-                price_avg50=stock_price.price_avg50,
-                price_avg200=stock_price.price_avg200,
-                exchange=stock_price.exchange,
-                volume=stock_price.volume,
-                avg_volume=stock_price.avg_volume,
-                open=stock_price.open,
-                previous_close=stock_price.previous_close,
-                eps=stock_price.eps,
-                pe=stock_price.pe,
-                earnings_announcement=stock_price.earnings_announcement,
-                shares_outstanding=stock_price.shares_outstanding,
-                timestamp=stock_price.timestamp,
-            )
-        )
-
-    return f"Registros actualizados con exito"
-
-
-@router.put("/{symbol}")
-async def update_price_by_symbol(symbol: str, db: db_dependency):
-    stock_data = get_stock_prices(symbol)
-    stock_price = db.query(StockPrice).filter(StockPrice.symbol == symbol).first()
-
-    if not stock_price:
-        stock_price = StockPrice(
-            symbol=stock_data["symbol"],
-            price=stock_data["price"],
-            name=stock_data["name"],
-            changes_percentage=stock_data["changesPercentage"],
-            change=stock_data["change"],
-            day_low=stock_data["dayLow"],
-            day_high=stock_data["dayHigh"],
-            year_high=stock_data["yearHigh"],
-            year_low=stock_data["yearLow"],
-            market_cap=stock_data["marketCap"],
-            price_avg50=stock_data["priceAvg50"],
-            price_avg200=stock_data["priceAvg200"],
-            exchange=stock_data["exchange"],
-            volume=stock_data["volume"],
-            avg_volume=stock_data["avgVolume"],
-            open=stock_data["open"],
-            previous_close=stock_data["previousClose"],
-            eps=stock_data["eps"],
-            pe=stock_data["pe"],
-            earnings_announcement=stock_data["earningsAnnouncement"],
-            shares_outstanding=stock_data["sharesOutstanding"],
-            timestamp=stock_data["timestamp"]
-        )
-        db.add(stock_price)
-        db.commit()
-
-    else:
-        stock_price.price = stock_data["price"]
-        stock_price.changes_percentage = stock_data["changesPercentage"]
-        stock_price.name = stock_data["name"]
-        stock_price.change = stock_data["change"]
-        stock_price.day_low = stock_data["dayLow"]
-        stock_price.day_high = stock_data["dayHigh"]
-        stock_price.year_high = stock_data["yearHigh"]
-        stock_price.year_low = stock_data["yearLow"]
-        stock_price.market_cap = stock_data["marketCap"]
-        stock_price.price_avg50 = stock_data["priceAvg50"]
-        stock_price.price_avg200 = stock_data["priceAvg200"]
-        stock_price.exchange = stock_data["exchange"]
-        stock_price.volume = stock_data["volume"]
-        stock_price.avg_volume = stock_data["avgVolume"]
-        stock_price.open = stock_data["open"]
-        stock_price.previous_close = stock_data["previousClose"]
-        stock_price.eps = stock_data["eps"]
-        stock_price.pe = stock_data["pe"]
-        stock_price.earnings_announcement = stock_data["earningsAnnouncement"]
-        stock_price.shares_outstanding = stock_data["sharesOutstanding"]
-        stock_price.timestamp = stock_data["timestamp"]
-
-        db.commit()
-
-    return f"Datos actualizados para el símbolo {symbol}"
+
+@router.put("/{symbol}", response_model=RefreshResponse)
+async def update_price_by_symbol(symbol: str, db: db_dependency, response: Response) -> RefreshResponse:
+    # Como un batch del scheduler: convive con otros refreshes puntuales, no con uno masivo.
+    try:
+        async with shared(QUOTES):
+            report = await refresh_quotes(db, [symbol])
+    except RefreshInProgress:
+        raise HTTPException(status_code=409, detail="Ya hay un refresh de precios en curso.")
+    if report.failed_symbols:
+        response.status_code = status.HTTP_502_BAD_GATEWAY
+    return report.response()
@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from coordination import Leadership, RefreshInProgress, change_listeners, shared
+from database import (AsyncSessionLocal, FMP_MAX_CONCURRENCY, FMP_QUOTE_BATCH_SIZE, SCHEDULER_QUOTE_INTERVAL,
+                      SCHEDULER_RATING_INTERVAL)
+from models import CompanyRating, StockPrice
+from refresh import QUOTES, RATINGS, refresh_listeners, refresh_quotes, refresh_ratings
+from registry import registry
+
+
+logger = logging.getLogger(__name__)
+
+# Un simbolo no se vuelve a pedir antes de esta fraccion de su cadencia, aunque sobre cuota.
+MIN_AGE_FRACTION = 0.25
+RETRY_DELAY = 30
+
+
+class RefreshScheduler:
+    # Cola de prioridad por vencimiento (ultimo refresh + cadencia). Los workers siempre toman lo mas vencido;
+    # el TokenBucket del cliente FMP es el que limita el ritmo, asi la cuota se usa completa sin generar 429.
+    def __init__(self,
+                 quote_interval: float = SCHEDULER_QUOTE_INTERVAL,
+                 rating_interval: float = SCHEDULER_RATING_INTERVAL,
+                 workers: int = FMP_MAX_CONCURRENCY,
+                 batch_size: int = FMP_QUOTE_BATCH_SIZE):
+        self.intervals = {QUOTES: quote_interval, RATINGS: rating_interval}
+        self.workers = workers
+        self.batch_size = batch_size
+        self._heap: List[Tuple[float, int, str, str]] = []
+        self._due: Dict[Tuple[str, str], Optional[float]] = {}
+        self._last: Dict[Tuple[str, str], float] = {}
+        # Por tipo: los quotes incluyen los CEDEAR en pesos, los ratings solo los subyacentes.
+        self._symbols: Dict[str, set] = {QUOTES: set(), RATINGS: set()}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        # Con varios workers solo el lider refresca; los demas se enteran por coordination.ChangeListener.
+        self.leadership = Leadership("scheduler")
+        self._leading: Optional[asyncio.Task] = None
+
+    def _schedule(self, kind: str, symbol: str, due: float):
+        self._due[(kind, symbol)] = due
+        heapq.heappush(self._heap, (due, next(self._counter), kind, symbol))
+        self._wakeup.set()
+
+    def mark_refreshed(self, kind: str, symbols: List[str]):
+        now = time.time()
+        for symbol in symbols:
+            self._last[(kind, symbol)] = now
+            if symbol in self._symbols[kind]:
+                self._schedule(kind, symbol, now + self.intervals[kind])
+
+    def _set_symbols(self, kind: str, symbols: Sequence[str], last_refresh: Dict[str, float]):
+        # Los que no tienen un refresh conocido entran vencidos.
+        now = time.time()
+        tracked = self._symbols[kind]
+        for symbol in set(symbols) - tracked:
+            tracked.add(symbol)
+            last = last_refresh.get(symbol)
+            self._schedule(kind, symbol, now if last is None else last + self.intervals[kind])
+        for symbol in tracked - set(symbols):
+            tracked.discard(symbol)
+            self._due.pop((kind, symbol), None)
+
+    async def reload_symbols(self):
+        async with AsyncSessionLocal() as db:
+            quote_timestamps = dict((await db.execute(select(StockPrice.symbol, StockPrice.timestamp))).all())
+            rating_updates = dict((await db.execute(select(CompanyRating.symbol, CompanyRating.updated_at))).all())
+        # El timestamp del quote guardado es la mejor estimacion de su antiguedad; el rating guarda cuando se
+        # refresco por ultima vez.
+        self._set_symbols(QUOTES, registry.quote_symbols(),
+                          {symbol: timestamp for symbol, timestamp in quote_timestamps.items() if timestamp})
+        self._set_symbols(RATINGS, registry.foreign_symbols(),
+                          {symbol: updated_at for symbol, updated_at in rating_updates.items() if updated_at})
+
+    def on_symbols_changed(self, symbols: Sequence[str]):
+        # Alta/baja de instrumentos: los nuevos entran vencidos, los borrados salen.
+        self._set_symbols(QUOTES, registry.quote_symbols(), {})
+        self._set_symbols(RATINGS, symbols, {})
+
+    def _pop_valid(self) -> Optional[Tuple[float, str, str]]:
+        while self._heap:
+            due, _, kind, symbol = self._heap[0]
+            if self._due.get((kind, symbol)) == due:
+                return due, kind, symbol
+            heapq.heappop(self._heap)
+        return None
+
+    def _claim(self, kind: str, symbol: str):
+        heapq.heappop(self._heap)
+        self._due[(kind, symbol)] = None
+
+    def _eligible_at(self, kind: str, symbol: str) -> float:
+        return self._last.get((kind, symbol), 0) + self.intervals[kind] * MIN_AGE_FRACTION
+
+    async def _next(self) -> Tuple[str, List[str]]:
+        while True:
+            top = self._pop_valid()
+            delay = None if top is None else self._eligible_at(top[1], top[2]) - time.time()
+            if top is not None and delay <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+        _, kind, symbol = top
+        self._claim(kind, symbol)
+        symbols = [symbol]
+        if kind == QUOTES:
+            # Los quotes se piden en batch: se suman los siguientes quotes mas vencidos que ya sean elegibles.
+            skipped = []
+            now = time.time()
+            while len(symbols) < self.batch_size and (top := self._pop_valid()) is not None:
+                _, next_kind, next_symbol = top
+                if next_kind == QUOTES and self._eligible_at(next_kind, next_symbol) <= now:
+                    self._claim(next_kind, next_symbol)
+                    symbols.append(next_symbol)
+                elif len(skipped) < self.batch_size:
+                    skipped.append(heapq.heappop(self._heap))
+                else:
+                    break
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+        return kind, symbols
+
+    async def _worker(self):
+        while True:
+            kind, symbols = await self._next()
+            postponed = False
+            try:
+                async with shared(kind), AsyncSessionLocal() as db:
+                    if kind == QUOTES:
+                        await refresh_quotes(db, symbols)
+                    else:
+                        await refresh_ratings(db, symbols)
+            except asyncio.CancelledError:
+                raise
+            except RefreshInProgress:
+                logger.info("Refresh masivo de %s en curso, se posterga el batch de %s", kind, symbols)
+                postponed = True
+            except Exception:
+                logger.exception("Fallo el refresh programado de %s para %s", kind, symbols)
+            # Lo que no quedo marcado por mark_refreshed (error o simbolo ausente en FMP) se reintenta mas tarde.
+            retry_at = time.time() + RETRY_DELAY
+            for symbol in symbols:
+                if symbol in self._symbols[kind] and self._due.get((kind, symbol)) is None:
+                    self._schedule(kind, symbol, retry_at)
+            if postponed:
+                # Lo que trae el refresh masivo llega por mark_refreshed; hasta que termine este worker no pide nada.
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _elected(self):
+        # La cola se arma de nuevo desde la base: mientras no era lider refresco otro worker.
+        self._heap, self._due, self._symbols = [], {}, {QUOTES: set(), RATINGS: set()}
+        await self.reload_symbols()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _deposed(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def start(self):
+        refresh_listeners.append(self.mark_refreshed)
+        change_listeners.append(self.mark_refreshed)
+        registry.listeners.append(self.on_symbols_changed)
+        self._leading = asyncio.create_task(self.leadership.run(self._elected, self._deposed))
+
+    async def stop(self):
+        if self.mark_refreshed in refresh_listeners:
+            refresh_listeners.remove(self.mark_refreshed)
+        if self.mark_refreshed in change_listeners:
+            change_listeners.remove(self.mark_refreshed)
+        if self.on_symbols_changed in registry.listeners:
+            registry.listeners.remove(self.on_symbols_changed)
+        if self._leading is not None:
+            self._leading.cancel()
+            await asyncio.gather(self._leading, return_exceptions=True)
+            self._leading = None
+        await self._deposed()
+
+
+scheduler = RefreshScheduler()
@@ -0,0 +1,171 @@
+import csv
+import io
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import Select
+from starlette.responses import Response, StreamingResponse
+
+from cache import RedisCache, TTLCache
+from database import ReadSessionLocal
+from pagination import NDJSON_MEDIA_TYPE, NEXT_CURSOR_HEADER, STREAM_BATCH_SIZE, decode_cursor, encode_cursor
+from snapshot import ColumnTable
+
+
+ROWS = "rows"
+COLUMNAR = "columnar"
+FORMATS = (ROWS, COLUMNAR)
+JSON_MEDIA_TYPE = "application/json"
+CSV_MEDIA_TYPE = "text/csv"
+
+Converters = Dict[str, Callable]
+
+
+class JSONBytesResponse(Response):
+    # El contenido ya viene codificado (orjson o cache): se envia tal cual, sin pasar por jsonable_encoder.
+    media_type = JSON_MEDIA_TYPE
+
+
+def _apply(fields: Sequence[str], rows: Iterable[Sequence], converters: Optional[Converters]) -> List[list]:
+    positions = [(fields.index(field), convert) for field, convert in (converters or {}).items() if field in fields]
+    if not positions:
+        return [list(row) for row in rows]
+
+    converted = []
+    for row in rows:
+        row = list(row)
+        for position, convert in positions:
+            if row[position] is not None:
+                row[position] = convert(row[position])
+        converted.append(row)
+    return converted
+
+
+def encode_rows(fields: Sequence[str], rows: Iterable[Sequence], converters: Optional[Converters] = None) -> bytes:
+    # Un objeto por fila, con las mismas claves que el response_model del endpoint.
+    return orjson.dumps([dict(zip(fields, row)) for row in _apply(fields, rows, converters)])
+
+
+def encode_columnar(fields: Sequence[str], rows: Iterable[Sequence], converters: Optional[Converters] = None) -> bytes:
+    # Un array por campo: los nombres no se repiten en cada fila, para universos grandes pesa bastante menos.
+    rows = _apply(fields, rows, converters)
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return orjson.dumps({field: list(column) for field, column in zip(fields, columns)})
+
+
+def encode(fields: Sequence[str], rows: Iterable[Sequence], format: str,
+           converters: Optional[Converters] = None) -> bytes:
+    if format == COLUMNAR:
+        return encode_columnar(fields, rows, converters)
+    return encode_rows(fields, rows, converters)
+
+
+def encode_columns(fields: Sequence[str], columns: Sequence[list], format: str) -> bytes:
+    # Para datos que ya estan por columna (snapshot.py): el formato columnar no tiene que transponer nada.
+    if format == COLUMNAR:
+        return orjson.dumps(dict(zip(fields, columns)))
+    return orjson.dumps([dict(zip(fields, row)) for row in zip(*columns)])
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Tuple[str, ...]:
+    # ?fields=symbol,price: solo se materializan y codifican esas columnas, en el orden del response_model.
+    if not fields:
+        return tuple(allowed)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Campos desconocidos: {', '.join(sorted(unknown))}. Opciones: {', '.join(allowed)}.")
+    return tuple(field for field in allowed if field in requested)
+
+
+async def table_response(table: ColumnTable, cache: Union[TTLCache, RedisCache], fields: Tuple[str, ...], format: str,
+                         limit: Optional[int], cursor: Optional[str], converters: Optional[Converters] = None) -> Response:
+    # Lista completa (codificada una vez por snapshot, formato y campos) o una pagina keyset del snapshot.
+    converters = converters or {}
+    if limit is None and cursor is None:
+        # Un cache compartido entre workers no se vacia en cada cambio: la clave lleva la huella de la tabla.
+        key = (format, fields, table.digest) if cache.shared else (format, fields)
+        body = await cache.get(key)
+        if body is None:
+            body = encode_columns(fields, [table.values(field, converters.get(field)) for field in fields], format)
+            await cache.set(key, body)
+        return JSONBytesResponse(body)
+
+    positions = table.page(decode_cursor(cursor) if cursor else None, limit)
+    response = JSONBytesResponse(encode_columns(fields, table.take(positions, fields, converters), format))
+    if limit is not None and len(positions) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(int(table.columns["id"][positions[-1]]))
+    return response
+
+
+def ndjson_rows(query: Select, fields: Sequence[str], converters: Optional[Converters] = None) -> StreamingResponse:
+    # Igual que pagination.ndjson_response pero sobre tuplas de columnas: cada lote del cursor se codifica junto.
+    async def lines():
+        async with ReadSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for partition in result.partitions():
+                yield b"".join(orjson.dumps(dict(zip(fields, row)), option=orjson.OPT_APPEND_NEWLINE)
+                               for row in _apply(fields, partition, converters))
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def csv_rows(query: Select, fields: Sequence[str], converters: Optional[Converters] = None) -> StreamingResponse:
+    async def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(fields)
+        async with ReadSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for partition in result.partitions():
+                writer.writerows(_apply(fields, partition, converters))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(lines(), media_type=CSV_MEDIA_TYPE)
+
+
+if __name__ == '__main__':
+    import json
+    import time
+    from datetime import datetime
+    from typing import List as ListType
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from models import StockPrice
+    from routers.stock_prices import PRICE_CONVERTERS, PRICE_FIELDS, StockPriceResponse
+
+    size = 10_000
+    values = {"name": "Inc", "price": 10.5, "changes_percentage": 1.2, "change": 0.1, "day_low": 9.0, "day_high": 11.0,
+              "year_high": 20.0, "year_low": 5.0, "market_cap": 1e9, "price_avg50": 10.0, "price_avg200": 9.0,
+              "exchange": "NASDAQ", "volume": 1000, "avg_volume": 900, "open": 9.5, "previous_close": 9.9,
+              "eps": 1.0, "pe": 10.0, "earnings_announcement": datetime(2024, 1, 25, 21, 30),
+              "shares_outstanding": 1_000_000.0, "timestamp": 1_700_000_000}
+    # Los indicadores vienen de technical_indicators, no de StockPrice: van aparte en las dos variantes.
+    indicators = {"sma_20": 10.2, "ema_20": 10.3, "volatility_20": 0.015, "rsi_14": 55.0}
+    entities = [StockPrice(id=i, symbol=f"S{i:05d}", **values) for i in range(size)]
+    tuples = [tuple({**entity.__dict__, **indicators}[field] for field in PRICE_FIELDS) for entity in entities]
+    adapter = TypeAdapter(ListType[StockPriceResponse])
+
+    def orm_path() -> bytes:
+        # Lo que hacia el endpoint: modelo por fila desde __dict__, validacion del response_model y json.dumps.
+        models = [StockPriceResponse(**entity.__dict__, **indicators) for entity in entities]
+        return json.dumps(jsonable_encoder(adapter.validate_python(models))).encode()
+
+    def measure(name: str, func: Callable[[], bytes], runs: int = 5):
+        started = time.perf_counter()
+        for _ in range(runs):
+            body = func()
+        elapsed = (time.perf_counter() - started) / runs
+        print(f"{name:<22} {size / elapsed:>12,.0f} filas/s  {len(body) / 1024:>8,.0f} KiB")
+
+    print(f"{size} filas de stock_prices (sin contar la query):")
+    measure("ORM + Pydantic", orm_path)
+    measure("tuplas + orjson", lambda: encode_rows(PRICE_FIELDS, tuples, PRICE_CONVERTERS))
+    measure("tuplas + columnar", lambda: encode_columnar(PRICE_FIELDS, tuples, PRICE_CONVERTERS))
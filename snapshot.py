@@ -0,0 +1,417 @@
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Float, Integer, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import prices_cache, ratings_cache
+from crud import STOCK_PRICE_TRACKED
+from indicators import INDICATOR_FIELDS
+from models import CompanyRating, StockPrice, TechnicalIndicators
+from registry import InstrumentRecord, registry
+
+
+FLOAT = "float"
+INT = "int"
+OBJECT = "object"
+
+SCREEN_PRICE_FIELDS = ("symbol", "name", "price", "changes_percentage", "market_cap", "volume", "pe") + INDICATOR_FIELDS
+SCREEN_RATING_FIELDS = ("rating_score", "rating_rating", "rating_recommendation")
+SCREEN_INSTRUMENT_FIELDS = ("cedear_symbol", "cedear_ratio", "foreign_ratio")
+
+
+def _kinds(model) -> Dict[str, str]:
+    # Numericos como float64 con NaN para NULL (los enteros de la base entran sin perdida); el resto como objetos.
+    kinds = {}
+    for column in model.__table__.columns:
+        if isinstance(column.type, Float):
+            kinds[column.name] = FLOAT
+        elif isinstance(column.type, Integer):
+            kinds[column.name] = INT
+        else:
+            kinds[column.name] = OBJECT
+    return kinds
+
+
+# Los indicadores de technical_indicators van como columnas mas de cada precio.
+PRICE_KINDS = {**_kinds(StockPrice), **dict.fromkeys(INDICATOR_FIELDS, FLOAT)}
+# updated_at cambia en cada refresh aunque el rating no: no es parte del contenido que se compara y se sirve.
+RATING_KINDS = {name: kind for name, kind in _kinds(CompanyRating).items() if name != "updated_at"}
+
+
+def _array(values: Sequence, kind: str) -> np.ndarray:
+    if kind == OBJECT:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+def _materialize(values: np.ndarray, kind: str, convert: Optional[Callable] = None) -> list:
+    # De array a valores que orjson sabe codificar: NaN -> None y los enteros de vuelta a int.
+    if kind == OBJECT:
+        result = values.tolist()
+    else:
+        missing = np.isnan(values)
+        if kind == INT:
+            values = np.where(missing, 0, values).astype(np.int64)
+        result = values.tolist()
+        if missing.any():
+            result = [None if missed else value for value, missed in zip(result, missing.tolist())]
+    if convert is not None:
+        result = [None if value is None else convert(value) for value in result]
+    return result
+
+
+class ColumnTable:
+    # Una columna numpy por campo y el indice simbolo -> fila. No se modifica: un refresh arma otra tabla.
+    __slots__ = ("kinds", "columns", "index", "size", "_lists", "_digest")
+
+    def __init__(self, kinds: Dict[str, str], columns: Dict[str, np.ndarray], index: Optional[Dict[str, int]] = None):
+        self.kinds = kinds
+        self.columns = columns
+        self.size = len(columns["symbol"])
+        self.index = index if index is not None else {
+            symbol: position for position, symbol in enumerate(columns["symbol"].tolist()) if symbol is not None}
+        # Listas ya convertidas para JSON, solo de las columnas que algun request pidio.
+        self._lists: Dict[Tuple[str, Optional[Callable]], list] = {}
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_rows(cls, kinds: Dict[str, str], rows: Sequence[Sequence]) -> "ColumnTable":
+        columns = list(zip(*rows)) if rows else [()] * len(kinds)
+        return cls(kinds, {name: _array(values, kind) for (name, kind), values in zip(kinds.items(), columns)})
+
+    def values(self, field: str, convert: Optional[Callable] = None) -> list:
+        key = (field, convert)
+        values = self._lists.get(key)
+        if values is None:
+            values = self._lists[key] = _materialize(self.columns[field], self.kinds[field], convert)
+        return values
+
+    @property
+    def digest(self) -> str:
+        # Huella del contenido: dos workers con los mismos datos comparten claves en un cache externo.
+        if self._digest is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for name, kind in self.kinds.items():
+                column = self.columns[name]
+                digest.update("\x1f".join(map(str, column.tolist())).encode() if kind == OBJECT else column.tobytes())
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def row_digest(self, position: int) -> str:
+        # Como digest, pero de una sola fila: cambia con cualquier columna, no solo con el timestamp.
+        digest = hashlib.blake2b(digest_size=8)
+        for name in self.kinds:
+            digest.update(repr(self.columns[name][position]).encode() + b"\x1f")
+        return digest.hexdigest()
+
+    def take(self, positions: np.ndarray, fields: Sequence[str],
+             converters: Optional[Dict[str, Callable]] = None) -> List[list]:
+        converters = converters or {}
+        return [_materialize(self.columns[field][positions], self.kinds[field], converters.get(field))
+                for field in fields]
+
+    def lookup(self, field: str, symbols: Sequence[Optional[str]]) -> np.ndarray:
+        # La columna `field` de cada simbolo, NULL para los que no estan.
+        positions = np.array([self.index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+        return _aligned(self.columns[field], self.kinds[field], positions)
+
+    def row(self, position: int, fields: Sequence[str], converters: Optional[Dict[str, Callable]] = None) -> dict:
+        # Una sola fila: escalar por escalar, sin armar arrays intermedios.
+        converters = converters or {}
+        row = {}
+        for field in fields:
+            value = self.columns[field][position]
+            kind = self.kinds[field]
+            if kind != OBJECT:
+                value = None if np.isnan(value) else (int(value) if kind == INT else float(value))
+            convert = converters.get(field)
+            row[field] = convert(value) if convert is not None and value is not None else value
+        return row
+
+    def page(self, after_id: Optional[int], limit: Optional[int]) -> np.ndarray:
+        # Las filas estan ordenadas por id: el keyset de pagination se resuelve con una busqueda binaria.
+        start = 0 if after_id is None else int(np.searchsorted(self.columns["id"], after_id, side="right"))
+        return np.arange(start, self.size if limit is None else min(start + limit, self.size))
+
+    def unchanged(self, rows: List[dict]) -> List[bool]:
+        # True para las filas cuyas columnas son todas iguales a las guardadas (NULL == NULL); un simbolo
+        # que no esta en la tabla nunca es igual. Se compara columna por columna, vectorizado.
+        positions = np.array([self.index.get(row["symbol"], -1) for row in rows], dtype=np.int64)
+        known = positions >= 0
+        same = known.copy()
+        if not known.any():
+            return same.tolist()
+        for name in {name for row in rows for name in row if name in self.kinds and name != "id"}:
+            incoming = _array([row.get(name) for row in rows], self.kinds[name])
+            stored = self.columns[name][np.where(known, positions, 0)]
+            if self.kinds[name] == OBJECT:
+                same &= np.array([a == b for a, b in zip(stored.tolist(), incoming.tolist())], dtype=bool)
+            else:
+                same &= (stored == incoming) | (np.isnan(stored) & np.isnan(incoming))
+        return (same & known).tolist()
+
+    def patched(self, rows: List[dict]) -> Optional["ColumnTable"]:
+        # Copia las columnas y pisa solo las filas refrescadas. None si aparece un simbolo nuevo:
+        # hace falta su id, asi que la tabla se vuelve a leer entera.
+        positions = [self.index.get(row["symbol"]) for row in rows]
+        if None in positions:
+            return None
+        columns = dict(self.columns)
+        for name in {name for row in rows for name in row if name in self.kinds and name != "id"}:
+            column = columns[name] = self.columns[name].copy()
+            column[positions] = _array([row.get(name) for row in rows], self.kinds[name])
+        return ColumnTable(self.kinds, columns, self.index)
+
+
+def _aligned(column: np.ndarray, kind: str, positions: np.ndarray) -> np.ndarray:
+    # Como un LEFT JOIN: la posicion -1 (sin fila del otro lado) queda en NULL.
+    missing = positions < 0
+    result = column[np.where(missing, 0, positions)] if len(column) else _array([None] * len(positions), kind)
+    if missing.any():
+        result = result.copy()
+        result[missing] = None if kind == OBJECT else np.nan
+    return result
+
+
+class Snapshot:
+    __slots__ = ("prices", "ratings", "instruments", "_screen")
+
+    def __init__(self, prices: ColumnTable, ratings: ColumnTable, instruments: Dict[str, InstrumentRecord]):
+        self.prices = prices
+        self.ratings = ratings
+        self.instruments = instruments
+        self._screen: Optional[Tuple[ColumnTable, np.ndarray]] = None
+
+    def replace(self, prices: Optional[ColumnTable] = None, ratings: Optional[ColumnTable] = None,
+                instruments: Optional[Dict[str, InstrumentRecord]] = None) -> "Snapshot":
+        return Snapshot(prices or self.prices, ratings or self.ratings,
+                        self.instruments if instruments is None else instruments)
+
+    def screen_view(self) -> Tuple[ColumnTable, np.ndarray]:
+        # precios JOIN instruments LEFT JOIN ratings, armado la primera vez que se usa el screener
+        # despues de cada swap. Devuelve tambien el rango de cada simbolo, para desempatar al ordenar.
+        if self._screen is None:
+            symbols = self.prices.columns["symbol"].tolist()
+            listed = np.array([position for position, symbol in enumerate(symbols) if symbol in self.instruments],
+                              dtype=np.int64)
+            records = [self.instruments[symbols[position]] for position in listed]
+            rating_positions = np.array([self.ratings.index.get(symbols[position], -1) for position in listed],
+                                        dtype=np.int64)
+
+            kinds, columns = {}, {}
+            for field in SCREEN_PRICE_FIELDS:
+                kinds[field] = self.prices.kinds[field]
+                columns[field] = self.prices.columns[field][listed]
+            for field in SCREEN_RATING_FIELDS:
+                kinds[field] = self.ratings.kinds[field]
+                columns[field] = _aligned(self.ratings.columns[field], kinds[field], rating_positions)
+            for field, kind in zip(SCREEN_INSTRUMENT_FIELDS, (OBJECT, FLOAT, FLOAT)):
+                kinds[field] = kind
+                columns[field] = _array([getattr(record, field) for record in records], kind)
+
+            view = ColumnTable(kinds, columns)
+            rank = np.empty(view.size, dtype=np.int64)
+            rank[np.argsort(columns["symbol"])] = np.arange(view.size)
+            self._screen = (view, rank)
+        return self._screen
+
+
+def screen(snapshot: Snapshot, ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+           recommendations: Optional[Iterable[str]], order: List[Tuple[str, bool]], limit: int) -> Tuple[ColumnTable, np.ndarray]:
+    # El WHERE / ORDER BY / LIMIT del screener sobre las columnas: NULL no cumple ningun rango y va
+    # ultimo al ordenar, igual que NULLS LAST; el simbolo desempata.
+    view, rank = snapshot.screen_view()
+    mask = np.ones(view.size, dtype=bool)
+    for field, (minimum, maximum) in ranges.items():
+        column = view.columns[field]
+        if minimum is not None:
+            mask &= column >= minimum
+        if maximum is not None:
+            mask &= column <= maximum
+    if recommendations:
+        wanted = set(recommendations)
+        mask &= np.fromiter((value in wanted for value in view.columns["rating_recommendation"].tolist()),
+                            dtype=bool, count=view.size)
+
+    positions = np.flatnonzero(mask)
+    keys = [rank[positions]]
+    for field, descending in reversed(order):
+        if field == "symbol":
+            keys.append(-rank[positions] if descending else rank[positions])
+            continue
+        column = view.columns[field][positions]
+        missing = np.isnan(column)
+        column = np.where(missing, 0, column)
+        keys.extend([-column if descending else column, missing])
+    return view, positions[np.lexsort(keys)][:limit]
+
+
+def _ratings_query():
+    return select(*(getattr(CompanyRating, name) for name in RATING_KINDS)).order_by(CompanyRating.id)
+
+
+def _prices_query():
+    columns = [getattr(TechnicalIndicators if name in INDICATOR_FIELDS else StockPrice, name) for name in PRICE_KINDS]
+    return (select(*columns)
+            .outerjoin(TechnicalIndicators, TechnicalIndicators.symbol == StockPrice.symbol)
+            .order_by(StockPrice.id))
+
+
+async def _load_prices(db: AsyncSession) -> ColumnTable:
+    return ColumnTable.from_rows(PRICE_KINDS, (await db.execute(_prices_query())).all())
+
+
+async def _load_ratings(db: AsyncSession) -> ColumnTable:
+    return ColumnTable.from_rows(RATING_KINDS, (await db.execute(_ratings_query())).all())
+
+
+async def _rows(db: AsyncSession, query, column, symbols: Sequence[str]) -> List[dict]:
+    return [row._asdict() for row in (await db.execute(query.where(column.in_(symbols)))).all()]
+
+
+class SnapshotStore:
+    # Vista columnar de precios, ratings e instrumentos para todos los GET. Cada commit de un refresh
+    # arma un Snapshot nuevo y lo publica con una sola asignacion; los lectores nunca ven uno a medias.
+    def __init__(self):
+        self.current = Snapshot(ColumnTable.from_rows(PRICE_KINDS, []),
+                                ColumnTable.from_rows(RATING_KINDS, []), {})
+        self._generation = 0
+        registry.listeners.append(self.on_instruments_changed)
+
+    def _swap(self, snapshot: Snapshot):
+        self._generation += 1
+        self.current = snapshot
+        # Las respuestas codificadas salen del snapshot anterior.
+        prices_cache.clear()
+        ratings_cache.clear()
+
+    async def load(self, db: AsyncSession):
+        # Si mientras se leia la base otro refresh publico un parche, se vuelve a leer para no pisarlo.
+        while True:
+            generation = self._generation
+            prices = await _load_prices(db)
+            ratings = await _load_ratings(db)
+            if generation == self._generation:
+                break
+        self._swap(Snapshot(prices, ratings, registry.records_by_foreign_symbol()))
+
+    async def apply_prices(self, db: AsyncSession, rows: List[dict]):
+        prices = self.current.prices.patched(rows)
+        if prices is None:
+            await self.load(db)
+        else:
+            self._swap(self.current.replace(prices=prices))
+
+    async def apply_ratings(self, db: AsyncSession, rows: List[dict]):
+        ratings = self.current.ratings.patched(rows)
+        if ratings is None:
+            await self.load(db)
+        else:
+            self._swap(self.current.replace(ratings=ratings))
+
+    async def reload_prices(self, db: AsyncSession, symbols: Optional[Sequence[str]]) -> Optional[List[dict]]:
+        # Lo que escribio otro worker (ver coordination.py): se releen solo esos simbolos. Devuelve las filas
+        # que cambiaron de precio o timestamp, para el stream de este worker, o None si la base ya coincide
+        # con el snapshot (el otro worker no escribio nada) y no hubo swap. Sin simbolos se relee todo.
+        if symbols is None:
+            await self.load(db)
+            return []
+        rows = await _rows(db, _prices_query(), StockPrice.symbol, symbols)
+        rows = [row for row, same in zip(rows, self.current.prices.unchanged(rows)) if not same]
+        if not rows:
+            return None
+        tracked = [{field: row[field] for field in ("symbol",) + STOCK_PRICE_TRACKED} for row in rows]
+        changed = [row for row, same in zip(rows, self.current.prices.unchanged(tracked)) if not same]
+        await self.apply_prices(db, rows)
+        return changed
+
+    async def reload_ratings(self, db: AsyncSession, symbols: Optional[Sequence[str]]) -> bool:
+        # False si no habia nada distinto que aplicar.
+        if symbols is None:
+            await self.load(db)
+            return True
+        rows = await _rows(db, _ratings_query(), CompanyRating.symbol, symbols)
+        rows = [row for row, same in zip(rows, self.current.ratings.unchanged(rows)) if not same]
+        if not rows:
+            return False
+        await self.apply_ratings(db, rows)
+        return True
+
+    def on_instruments_changed(self, symbols: Sequence[str]):
+        self._swap(self.current.replace(instruments=registry.records_by_foreign_symbol()))
+
+
+snapshots = SnapshotStore()
+
+
+if __name__ == '__main__':
+    import asyncio
+    import time
+    import tracemalloc
+    from datetime import datetime
+
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from models import Base
+
+    size = 10_000
+    lookups = 2_000
+    values = {"name": "Inc", "price": 10.5, "changes_percentage": 1.2, "change": 0.1, "day_low": 9.0, "day_high": 11.0,
+              "year_high": 20.0, "year_low": 5.0, "market_cap": 1e9, "price_avg50": 10.0, "price_avg200": 9.0,
+              "exchange": "NASDAQ", "volume": 1000, "avg_volume": 900, "open": 9.5, "previous_close": 9.9,
+              "eps": 1.0, "pe": 10.0, "earnings_announcement": datetime(2024, 1, 25, 21, 30),
+              "shares_outstanding": 1_000_000.0, "timestamp": 1_700_000_000}
+    symbols = [f"S{i:05d}" for i in range(size)]
+    fields = tuple(PRICE_KINDS)
+
+    def peak(label: str, started: float):
+        current, highest = tracemalloc.get_traced_memory()
+        print(f"{label:<28} {highest / 2 ** 20:>8.1f} MiB pico  {time.perf_counter() - started:>8.3f} s")
+
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(StockPrice.__table__.insert(), [dict(values, symbol=symbol) for symbol in symbols])
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+        print(f"{size} filas de stock_prices en SQLite en memoria:")
+        async with sessions() as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            entities = (await db.execute(select(StockPrice))).scalars().all()
+            peak("carga ORM (entidades)", started)
+            tracemalloc.stop()
+            del entities
+
+        async with sessions() as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            table = await _load_prices(db)
+            peak("carga columnar", started)
+            tracemalloc.stop()
+
+        wanted = symbols[::size // lookups]
+        async with sessions() as db:
+            started = time.perf_counter()
+            for symbol in wanted:
+                (await db.execute(select(StockPrice).filter(StockPrice.symbol == symbol))).scalars().first()
+            orm = (time.perf_counter() - started) / len(wanted)
+
+        started = time.perf_counter()
+        for symbol in wanted:
+            table.row(table.index[symbol], fields)
+        columnar = (time.perf_counter() - started) / len(wanted)
+        print(f"{'lookup por simbolo ORM':<28} {orm * 1e6:>8.1f} us")
+        print(f"{'lookup por simbolo columnar':<28} {columnar * 1e6:>8.1f} us")
+
+        started = time.perf_counter()
+        table.patched([dict(values, symbol=symbol, price=11.0) for symbol in symbols[:50]])
+        print(f"{'parche de 50 simbolos':<28} {(time.perf_counter() - started) * 1e3:>8.2f} ms")
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -1,29 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
-api_url = "https://screener-sw78.onrender.com"
+api_url = os.getenv("SCREENER_API_URL", "https://screener-sw78.onrender.com")
 stock_prices_endpoint = "/stock_prices"
 company_rating_endpoint = "/company_rating"
+# Igual que en el servidor: el CEDEAR en pesos se cotiza como cedear_symbol + sufijo.
+cedear_quote_suffix = os.getenv("CEDEAR_QUOTE_SUFFIX", ".BA")
+
+RESOURCES = {
+    "stock_prices": stock_prices_endpoint,
+    "company_rating": company_rating_endpoint,
+}
+
+
+class Checkpoint:
+    # Guarda, por recurso y simbolo, el epoch del ultimo refresh exitoso. Permite retomar una corrida cortada.
+    def __init__(self, path: Optional[str], flush_every: int = 20):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.data: Dict[str, Dict[str, float]] = {resource: {} for resource in RESOURCES}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for resource, symbols in json.load(f).items():
+                    self.data.setdefault(resource, {}).update(symbols)
+
+    def is_fresh(self, resource: str, symbol: str, freshness: float, now: float) -> bool:
+        return now - self.data[resource].get(symbol, 0) < freshness
+
+    def mark(self, resource: str, symbols: List[str]):
+        now = time.time()
+        with self._lock:
+            for symbol in symbols:
+                self.data[resource][symbol] = now
+            self._pending += len(symbols)
+            if self._pending >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._pending = 0
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+class ResourceSummary:
+    def __init__(self, resource: str):
+        self.resource = resource
+        self.ok = 0
+        self.skipped = 0
+        self.failed: Dict[str, str] = {}
+        self.bulk = False
+        self.elapsed = 0.0
+
+    def line(self) -> str:
+        rate = self.ok / self.elapsed if self.elapsed else 0
+        mode = "bulk" if self.bulk else "por simbolo"
+        return (f"{self.resource}: {self.ok} ok, {len(self.failed)} con error, {self.skipped} frescos ({mode}) "
+                f"en {self.elapsed:.1f}s - {rate:.1f} simbolos/s")
+
+
+class PutSafeRetry(Retry):
+    # Un PUT dispara un refresh contra FMP y un 5xx puede llegar con el refresh ya guardado: solo se reintenta
+    # cuando el servidor no lo atendio (429, 503). Los demas errores, y los timeouts, quedan en el reporte y
+    # fuera del checkpoint, asi la proxima corrida los vuelve a pedir.
+    PUT_STATUS_FORCELIST = {429, 503}
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "PUT":
+            return status_code in self.PUT_STATUS_FORCELIST
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_session(workers: int, retries: int) -> requests.Session:
+    session = requests.Session()
+    retry = PutSafeRetry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                         allowed_methods=["GET"], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_symbols(session: requests.Session, base_url: str, timeout: float) -> Dict[str, List[str]]:
+    # Por recurso: los precios incluyen los CEDEAR en pesos (para el arbitraje), los ratings solo los subyacentes.
+    response = session.get(f"{base_url}/instruments/", timeout=timeout)
+    response.raise_for_status()
+    instrumentos = [instrumento for instrumento in response.json() if instrumento.get("foreign_symbol")]
+    foreign = list(dict.fromkeys(instrumento["foreign_symbol"] for instrumento in instrumentos))
+    local = [instrumento["cedear_symbol"] + cedear_quote_suffix for instrumento in instrumentos
+             if instrumento.get("cedear_symbol")]
+    return {"stock_prices": list(dict.fromkeys(foreign + local)), "company_rating": foreign}
+
+
+def put(session: requests.Session, url: str, timeout: float) -> Tuple[Optional[dict], Optional[str]]:
+    # Devuelve el reporte del refresh (ver refresh.RefreshResponse) o el error.
+    try:
+        response = session.put(url, timeout=timeout)
+    except requests.RequestException as e:
+        return None, str(e)
+    if not response.ok:
+        return None, f"HTTP {response.status_code}: {response.text[:200]}"
+    return response.json(), None
+
+
+def sync_resource(session: requests.Session,
+                  executor: ThreadPoolExecutor,
+                  checkpoint: Checkpoint,
+                  base_url: str,
+                  resource: str,
+                  symbols: List[str],
+                  freshness: float,
+                  bulk_threshold: float,
+                  timeout: float,
+                  bulk_timeout: float) -> ResourceSummary:
+    summary = ResourceSummary(resource)
+    endpoint = f"{base_url}{RESOURCES[resource]}"
+    now = time.time()
+    stale = [symbol for symbol in symbols if not checkpoint.is_fresh(resource, symbol, freshness, now)]
+    summary.skipped = len(symbols) - len(stale)
+    started = time.perf_counter()
+
+    # Si casi todo esta vencido conviene el refresh masivo del servidor: una sola request.
+    if stale and len(stale) >= bulk_threshold * len(symbols):
+        summary.bulk = True
+        report, error = put(session, endpoint, bulk_timeout)
+        if error is None:
+            done = {result["symbol"] for result in report["symbols"] if result["status"] != "failed"}
+            checkpoint.mark(resource, [symbol for symbol in stale if symbol in done])
+            summary.ok = sum(1 for symbol in stale if symbol in done)
+            stale = [symbol for symbol in stale if symbol not in done]
+            if not stale:
+                summary.elapsed = time.perf_counter() - started
+                return summary
+            # El servidor ya guardo el resto: solo los que fallaron se reintentan, de a uno.
+            print(f"Refresh masivo de {resource}: {len(stale)} simbolos con error, se reintentan por simbolo.")
+        elif error.startswith("HTTP 409"):
+            # Otro worker del servidor ya esta refrescando todo: repetirlo por simbolo duplicaria los pedidos a FMP.
+            print(f"Ya hay un refresh masivo de {resource} en curso en el servidor, no se reintenta por simbolo.")
+            summary.skipped += len(stale)
+            summary.elapsed = time.perf_counter() - started
+            return summary
+        else:
+            print(f"Refresh masivo de {resource} fallo ({error}), se reintenta por simbolo.")
+            summary.bulk = False
+
+    futures = {executor.submit(put, session, f"{endpoint}/{symbol}", timeout): symbol for symbol in stale}
+    for future in as_completed(futures):
+        symbol = futures[future]
+        _, error = future.result()
+        if error is None:
+            checkpoint.mark(resource, [symbol])
+            summary.ok += 1
+        else:
+            summary.failed[symbol] = error
+
+    summary.elapsed = time.perf_counter() - started
+    return summary
+
+
+def run(base_url: str = api_url,
+        workers: int = 8,
+        freshness: float = 900,
+        bulk_threshold: float = 0.9,
+        checkpoint_path: Optional[str] = ".sync_checkpoint.json",
+        timeout: float = 30,
+        bulk_timeout: float = 600,
+        retries: int = 3) -> List[ResourceSummary]:
+    session = build_session(workers, retries)
+    checkpoint = Checkpoint(checkpoint_path)
+    symbols = fetch_symbols(session, base_url, timeout)
+
+    summaries = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for resource in RESOURCES:
+                summaries.append(sync_resource(session, executor, checkpoint, base_url, resource, symbols[resource],
+                                               freshness, bulk_threshold, timeout, bulk_timeout))
+    finally:
+        checkpoint.flush()
+        session.close()
 
+    return summaries
 
-response = requests.get(f"{api_url}/instruments")
-instrumentos = response.json()
 
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sincroniza precios y ratings de todos los instrumentos.")
+    parser.add_argument("--api-url", default=api_url)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--freshness", type=float, default=900,
+                        help="segundos durante los cuales un simbolo sincronizado no se vuelve a pedir")
+    parser.add_argument("--bulk-threshold", type=float, default=0.9,
+                        help="fraccion de simbolos vencidos a partir de la cual se usa el PUT masivo (>1 lo desactiva)")
+    parser.add_argument("--checkpoint", default=".sync_checkpoint.json")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--bulk-timeout", type=float, default=600)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args(argv)
 
-for instrumento in instrumentos:
-    symbol = instrumento.get("foreign_symbol")
+    started = time.perf_counter()
+    summaries = run(args.api_url.rstrip("/"), args.workers, args.freshness, args.bulk_threshold,
+                    args.checkpoint or None, args.timeout, args.bulk_timeout, args.retries)
+    elapsed = time.perf_counter() - started
 
-    if symbol:
+    for summary in summaries:
+        print(summary.line())
+        for symbol, error in sorted(summary.failed.items()):
+            print(f"  Error en {symbol}: {error}")
+    total = sum(summary.ok for summary in summaries)
+    print(f"Total: {total} refrescos en {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s)")
 
-        #Update stock prices
-        stock_data = {"symbol": symbol}
-        requests.put(f"{api_url}{stock_prices_endpoint}/{symbol}", json=stock_data)
-        print(f"Stock price actualizado para el símbolo {symbol}")
+    return 1 if any(summary.failed for summary in summaries) else 0
 
-        # Update company rating
-        company_rating_data = {"symbol": symbol}  # Puedes agregar más datos según sea necesario
-        requests.put(f"{api_url}{company_rating_endpoint}/{symbol}", json=company_rating_data)
-        print(f"Company rating actualizado para el símbolo {symbol}")
-    else:
-        print("Error: No se pudo obtener el instrumento.")
 
+if __name__ == '__main__':
+    sys.exit(main())
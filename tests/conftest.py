@@ -0,0 +1,88 @@
+import os
+import sys
+from typing import Dict, List, Optional
+
+import httpx
+import pytest
+
+# Los modulos viven en la raiz del repo y database.py arma el engine al importarse. Siempre una base SQLite
+# en memoria propia: los tests nunca tocan la base (ni el Redis) del entorno.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite://"
+for name in ("ASYNC_DATABASE_URL", "DATABASE_REPLICA_URL", "CACHE_URL"):
+    os.environ.pop(name, None)
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["FMP_RATE_LIMIT_PER_MINUTE"] = "0"
+os.environ["FMP_RETRY_BACKOFF"] = "0"
+os.environ.setdefault("API_KEY", "test")
+
+
+def make_quote(symbol: str, price: float = 10.0, timestamp: int = 1_700_000_000, **fields) -> dict:
+    quote = {"symbol": symbol, "name": f"{symbol} Inc", "price": price, "changesPercentage": 1.0, "change": 0.1,
+             "dayLow": price - 1, "dayHigh": price + 1, "yearHigh": price * 2, "yearLow": price / 2,
+             "marketCap": 1e9, "priceAvg50": price, "priceAvg200": price, "exchange": "NASDAQ", "volume": 1000,
+             "avgVolume": 900, "open": price, "previousClose": price, "eps": 1.0, "pe": 10.0,
+             "earningsAnnouncement": "2024-01-25T21:30:00.000+0000", "sharesOutstanding": 1_000_000,
+             "timestamp": timestamp}
+    quote.update(fields)
+    return quote
+
+
+class FakeFMP:
+    # Lo minimo de /quote/ y /rating/ sobre httpx.MockTransport: quotes y ratings por simbolo, y codigos de
+    # error forzados por simbolo.
+    def __init__(self):
+        self.quotes: Dict[str, dict] = {}
+        self.ratings: Dict[str, dict] = {}
+        self.errors: Dict[str, int] = {}
+        self.calls: List[str] = []
+
+    def quote(self, symbol: str, price: float = 10.0, timestamp: int = 1_700_000_000, **fields):
+        self.quotes[symbol] = make_quote(symbol, price, timestamp, **fields)
+
+    def rating(self, symbol: str, score: int = 3, rating: str = "B", recommendation: str = "Neutral"):
+        self.ratings[symbol] = {"symbol": symbol, "ratingScore": score, "rating": rating,
+                                "ratingRecommendation": recommendation}
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.path)
+        endpoint, _, symbols = request.url.path.split("/api/v3/")[1].partition("/")
+        symbols = symbols.split(",")
+        failing = [self.errors[symbol] for symbol in symbols if symbol in self.errors]
+        if failing:
+            return httpx.Response(failing[0], json={"error": "forzado"})
+        if endpoint == "quote":
+            return httpx.Response(200, json=[self.quotes[symbol] for symbol in symbols if symbol in self.quotes])
+        rating = self.ratings.get(symbols[0])
+        return httpx.Response(200, json=[rating] if rating else [])
+
+
+@pytest.fixture
+def fmp() -> FakeFMP:
+    return FakeFMP()
+
+
+@pytest.fixture
+def api(fmp: FakeFMP):
+    # La app completa (lifespan incluido) contra la base en memoria, que arranca vacia en cada test, y FMP falso.
+    from fastapi.testclient import TestClient
+
+    import main
+    from fmp_client import client
+
+    with TestClient(main.app) as test_client:
+        client._client = httpx.AsyncClient(base_url="http://fmp", transport=httpx.MockTransport(fmp.handle))
+        if client.breaker is not None:
+            client.breaker.success()
+        yield test_client
+
+
+@pytest.fixture
+def add_instrument(api):
+    def add(foreign_symbol: str, cedear_symbol: Optional[str] = None, cedear_ratio: float = 10.0):
+        response = api.post("/instruments/create_instrument",
+                            json={"cedear_symbol": cedear_symbol or foreign_symbol, "foreign_market": "NASDAQ",
+                                  "foreign_symbol": foreign_symbol, "cedear_ratio": cedear_ratio, "foreign_ratio": 1})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return add
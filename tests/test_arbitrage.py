@@ -0,0 +1,40 @@
+import numpy as np
+
+import arbitrage
+from registry import InstrumentRecord
+from snapshot import PRICE_KINDS, RATING_KINDS, ColumnTable, Snapshot, snapshots
+
+
+def price_table(prices):
+    rows = [tuple({"id": id, "symbol": symbol, "price": price}.get(name) for name in PRICE_KINDS)
+            for id, (symbol, price) in enumerate(prices.items(), start=1)]
+    return ColumnTable.from_rows(PRICE_KINDS, rows)
+
+
+def make_snapshot(prices):
+    instruments = {
+        "AAPL": InstrumentRecord(1, "AAPL", "NASDAQ", "AAPL", 20.0, 1.0),
+        "KO": InstrumentRecord(2, "KO", "NYSE", "KO", 5.0, 1.0),
+    }
+    return Snapshot(price_table(prices), ColumnTable.from_rows(RATING_KINDS, []), instruments)
+
+
+def test_inputs_use_foreign_and_local_quotes():
+    inputs = arbitrage.build_inputs(make_snapshot({"AAPL": 200.0, "AAPL.BA": 10_000.0, "KO": 60.0}))
+    assert inputs.cedear_symbols == ["AAPL", "KO"]
+    assert inputs.foreign_price.tolist() == [200.0, 60.0]
+    assert inputs.local_price[0] == 10_000.0 and np.isnan(inputs.local_price[1])
+
+    result = arbitrage.compute(inputs)
+    # 200 USD / 20 CEDEARs = 10 USD por CEDEAR, que cotiza 10000 ARS.
+    assert result["implied_ccl"][0] == 1000.0
+    assert np.isnan(result["implied_ccl"][1])
+
+
+def test_inputs_follow_the_current_snapshot(monkeypatch):
+    first = make_snapshot({"AAPL": 200.0, "AAPL.BA": 10_000.0})
+    monkeypatch.setattr(snapshots, "current", first)
+    assert arbitrage.get_inputs() is arbitrage.get_inputs()
+
+    monkeypatch.setattr(snapshots, "current", first.replace(prices=price_table({"AAPL": 250.0, "AAPL.BA": 10_000.0})))
+    assert arbitrage.get_inputs().foreign_price[0] == 250.0
@@ -0,0 +1,59 @@
+import orjson
+
+from bulk_import import parse_csv, parse_ndjson, validate
+from routers.instruments import InstrumentsRequest
+
+
+HEADER = "cedear_symbol,foreign_market,foreign_symbol,cedear_ratio,foreign_ratio\n"
+
+
+def test_csv_rejects_invalid_rows_by_line_and_keeps_the_rest():
+    body = (HEADER + "AAPL,NASDAQ,AAPL,20,1\n"
+                     "KO,NYSE,KO,no-es-numero,1\n"
+                     "MSFT,NASDAQ,MSFT,30,1\n").encode()
+    rows, errors = validate(parse_csv(body)[0], InstrumentsRequest)
+    assert [row["foreign_symbol"] for row in rows] == ["AAPL", "MSFT"]
+    assert len(errors) == 1 and errors[0]["line"] == 3 and errors[0]["error"].startswith("cedear_ratio")
+
+
+def test_ndjson_reports_bad_json_lines_and_skips_blank_ones():
+    body = b'{"cedear_symbol": "AAPL", "foreign_market": "NASDAQ", "foreign_symbol": "AAPL", ' \
+           b'"cedear_ratio": 20, "foreign_ratio": 1}\n\n{roto\n'
+    records, errors = parse_ndjson(body)
+    assert [line for line, _ in records] == [1]
+    assert errors == [{"line": 3, "error": "JSON invalido"}]
+
+
+def test_repeated_foreign_symbol_keeps_the_last_line():
+    body = (HEADER + "AAPL,NASDAQ,AAPL,20,1\nAAPL.X,NASDAQ,AAPL,10,1\n").encode()
+    rows, errors = validate(parse_csv(body)[0], InstrumentsRequest)
+    assert [row["cedear_symbol"] for row in rows] == ["AAPL.X"]
+    assert errors[0]["line"] == 2 and "ver linea 3" in errors[0]["error"]
+
+
+def test_bulk_endpoint_counts_inserted_updated_unchanged_and_rejected(api, add_instrument):
+    add_instrument("AAPL", cedear_ratio=20)
+    add_instrument("KO", cedear_ratio=5)
+    body = (HEADER + "AAPL,NASDAQ,AAPL,20,1\n"       # igual a lo guardado
+                     "KO,NYSE,KO,10,1\n"             # cambia el ratio
+                     "MSFT,NASDAQ,MSFT,30,1\n"       # nuevo
+                     "MELI,NASDAQ,MELI,200,1\n")     # fuera de rango
+    response = api.post("/instruments/bulk", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["inserted"], result["updated"], result["unchanged"], result["rejected"]) == (1, 1, 1, 1)
+    assert result["errors"][0]["line"] == 5
+
+    # El registry en memoria ya ve el alta y la modificacion.
+    assert api.get("/instruments/MSFT").json()["cedear_ratio"] == 30
+    assert api.get("/instruments/KO").json()["cedear_ratio"] == 10
+
+
+def test_export_can_be_imported_back(api, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    exported = api.get("/instruments/export", params={"format": "ndjson"}).content
+    assert [orjson.loads(line)["foreign_symbol"] for line in exported.splitlines()] == ["AAPL", "KO"]
+
+    result = api.post("/instruments/bulk", params={"format": "ndjson"}, content=exported).json()
+    assert (result["inserted"], result["updated"], result["unchanged"], result["rejected"]) == (0, 0, 2, 0)
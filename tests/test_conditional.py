@@ -0,0 +1,75 @@
+import pytest
+
+
+@pytest.fixture
+def quoted(api, fmp, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    fmp.quote("AAPL", 200.0)
+    fmp.quote("KO", 60.0)
+    assert api.put("/stock_prices", params={"symbols": "AAPL,KO"}).status_code == 200
+    return api
+
+
+def test_list_answers_304_until_the_table_is_written(quoted, fmp):
+    first = quoted.get("/stock_prices")
+    etag = first.headers["ETag"]
+    cached = quoted.get("/stock_prices", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["ETag"] == etag
+
+    fmp.quote("KO", 61.0, timestamp=1_700_000_060)
+    quoted.put("/stock_prices", params={"symbols": "KO"})
+    fresh = quoted.get("/stock_prices", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.headers["ETag"] != etag
+
+
+def test_unchanged_refresh_keeps_the_etag(quoted):
+    etag = quoted.get("/stock_prices").headers["ETag"]
+    # FMP devuelve lo mismo: no se escribe nada y el validador sigue valiendo.
+    quoted.put("/stock_prices", params={"symbols": "AAPL,KO"})
+    assert quoted.get("/stock_prices", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_each_query_string_has_its_own_etag(quoted):
+    rows = quoted.get("/stock_prices").headers["ETag"]
+    page = quoted.get("/stock_prices", params={"limit": 1})
+    assert page.headers["ETag"] != rows
+    assert quoted.get("/stock_prices", params={"limit": 1},
+                      headers={"If-None-Match": f'W/{rows}, {page.headers["ETag"]}'}).status_code == 304
+
+
+def test_if_modified_since_is_only_used_without_if_none_match(quoted):
+    last_modified = quoted.get("/stock_prices").headers["Last-Modified"]
+    assert quoted.get("/stock_prices", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert quoted.get("/stock_prices", headers={"If-Modified-Since": last_modified,
+                                                "If-None-Match": '"otro"'}).status_code == 200
+    assert quoted.get("/stock_prices", headers={"If-Modified-Since": "no es una fecha"}).status_code == 200
+
+
+def test_symbol_answers_304_until_its_quote_changes(quoted, fmp):
+    etag = quoted.get("/stock_prices/AAPL").headers["ETag"]
+    assert quoted.get("/stock_prices/AAPL", headers={"If-None-Match": etag}).status_code == 304
+
+    fmp.quote("AAPL", 201.0, timestamp=1_700_000_060)
+    quoted.put("/stock_prices/AAPL")
+    fresh = quoted.get("/stock_prices/AAPL", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.json()["price"] == 201.0
+
+
+def test_instruments_etag_changes_on_create(api, add_instrument):
+    add_instrument("AAPL")
+    etag = api.get("/instruments/").headers["ETag"]
+    assert api.get("/instruments/", headers={"If-None-Match": etag}).status_code == 304
+    add_instrument("KO")
+    assert api.get("/instruments/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_symbol_etag_changes_with_the_body_even_if_the_timestamp_does_not(quoted, fmp):
+    etag = quoted.get("/stock_prices/AAPL").headers["ETag"]
+    # Misma marca de tiempo, otro volumen: el quote se reescribe y la respuesta es otra.
+    fmp.quote("AAPL", 200.0, volume=5000)
+    assert quoted.put("/stock_prices/AAPL").json()["updated"] == 1
+    fresh = quoted.get("/stock_prices/AAPL", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.json()["volume"] == 5000
+    assert quoted.get("/stock_prices/AAPL", headers={"If-None-Match": fresh.headers["ETag"]}).status_code == 304
@@ -0,0 +1,45 @@
+import asyncio
+
+import orjson
+
+import coordination
+from coordination import QUOTES, RATINGS, _payloads, apply_change, change_listeners
+
+
+class NoDatabase:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError("un aviso sin escrituras no tiene que releer la base")
+
+
+def test_payloads_carry_the_written_flag_in_every_chunk(monkeypatch):
+    monkeypatch.setattr(coordination, "MAX_SYMBOLS_BYTES", 20)
+    messages = [orjson.loads(payload) for payload in _payloads(QUOTES, ["AAPL", "MSFT", "KO", "MELI"], False)]
+    assert len(messages) > 1
+    assert [symbol for message in messages for symbol in message["symbols"]] == ["AAPL", "MSFT", "KO", "MELI"]
+    assert all(message["written"] is False and message["kind"] == QUOTES for message in messages)
+    assert orjson.loads(next(_payloads(RATINGS, None, True)))["written"] is True
+
+
+def test_skipped_batches_only_reach_the_listeners(monkeypatch):
+    received = []
+    monkeypatch.setattr(coordination, "change_listeners", change_listeners + [lambda *args: received.append(args)])
+    for kind in (QUOTES, RATINGS):
+        asyncio.run(apply_change(NoDatabase(), kind, ["AAPL"], written=False))
+    assert received == [(QUOTES, ["AAPL"]), (RATINGS, ["AAPL"])]
+
+
+def test_single_symbol_refreshes_get_409_during_a_bulk_refresh(api, fmp, monkeypatch):
+    fmp.quote("AAPL")
+    fmp.rating("AAPL")
+    # Un refresh masivo de cada tipo en curso (en SQLite el lock es local al proceso).
+    monkeypatch.setitem(coordination._local_holders, QUOTES, -1)
+    monkeypatch.setitem(coordination._local_holders, RATINGS, -1)
+    assert api.put("/stock_prices/AAPL").status_code == 409
+    assert api.put("/company_rating/AAPL").status_code == 409
+    assert fmp.calls == []
+
+    monkeypatch.setitem(coordination._local_holders, QUOTES, 0)
+    monkeypatch.setitem(coordination._local_holders, RATINGS, 0)
+    assert api.put("/stock_prices/AAPL").status_code == 200
+    assert api.put("/company_rating/AAPL").status_code == 200
+    assert coordination._local_holders == {QUOTES: 0, RATINGS: 0}
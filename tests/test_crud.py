@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from conftest import make_quote
+from crud import (STOCK_PRICE_TRACKED, bulk_upsert, company_rating_from_data, stock_price_from_quote,
+                  upsert_company_ratings, upsert_stock_prices)
+from models import Base, CompanyRating, StockPrice
+
+
+def run(test):
+    # Cada test corre contra su propia base en memoria.
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as db:
+                return await test(db)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+async def stored_prices(db):
+    return dict((await db.execute(select(StockPrice.symbol, StockPrice.price))).all())
+
+
+def test_stock_price_from_quote_maps_fmp_fields():
+    values = stock_price_from_quote(make_quote("AAPL", 200.0, changesPercentage=1.5, avgVolume=42))
+    assert values["symbol"] == "AAPL" and values["price"] == 200.0
+    assert values["changes_percentage"] == 1.5 and values["avg_volume"] == 42
+    # El offset se pasa a UTC sin tzinfo, como lo guarda la columna.
+    assert values["earnings_announcement"] == datetime(2024, 1, 25, 21, 30)
+
+
+def test_company_rating_from_data_accepts_lists_and_empty_answers():
+    rating = {"ratingScore": 4, "rating": "A", "ratingRecommendation": "Buy"}
+    assert company_rating_from_data("AAPL", [rating]) == {
+        "symbol": "AAPL", "rating_score": 4, "rating_rating": "A", "rating_recommendation": "Buy"}
+    assert company_rating_from_data("KO", []) == {
+        "symbol": "KO", "rating_score": 0, "rating_rating": "", "rating_recommendation": ""}
+
+
+def test_bulk_upsert_counts_inserted_updated_and_unchanged():
+    async def test(db):
+        first = await upsert_stock_prices(db, [make_quote("AAPL", 200.0), make_quote("MSFT", 300.0)])
+        assert (first.inserted, first.updated, first.unchanged) == (2, 0, 0)
+
+        second = await upsert_stock_prices(db, [make_quote("AAPL", 201.0), make_quote("MSFT", 300.0),
+                                                make_quote("KO", 60.0)])
+        assert (second.inserted, second.updated, second.unchanged) == (1, 1, 1)
+        assert second.written == 2
+        await db.commit()
+        assert await stored_prices(db) == {"AAPL": 201.0, "MSFT": 300.0, "KO": 60.0}
+    run(test)
+
+
+def test_bulk_upsert_counts_across_chunks_and_keeps_the_last_duplicate():
+    async def test(db):
+        rows = [stock_price_from_quote(make_quote(f"S{i}", float(i))) for i in range(7)]
+        rows.append(stock_price_from_quote(make_quote("S0", 99.0)))
+        result = await bulk_upsert(db, StockPrice, rows, chunk_size=3)
+        assert (result.inserted, result.updated, result.unchanged) == (7, 0, 0)
+        assert (await stored_prices(db))["S0"] == 99.0
+    run(test)
+
+
+def test_bulk_upsert_reports_changed_tracked_columns_only():
+    async def test(db):
+        await upsert_stock_prices(db, [make_quote("AAPL", 200.0), make_quote("MSFT", 300.0)])
+        # AAPL cambia el precio, MSFT solo el volumen: se escriben las dos pero solo AAPL se publica.
+        result = await upsert_stock_prices(db, [make_quote("AAPL", 201.0), make_quote("MSFT", 300.0, volume=5)])
+        assert result.updated == 2
+        assert [row["symbol"] for row in result.changed] == ["AAPL"]
+        assert set(STOCK_PRICE_TRACKED) <= set(result.changed[0])
+    run(test)
+
+
+def test_upsert_company_ratings_updates_in_place():
+    async def test(db):
+        await upsert_company_ratings(db, {"AAPL": [{"ratingScore": 3, "rating": "B"}]})
+        result = await upsert_company_ratings(db, {"AAPL": [{"ratingScore": 5, "rating": "A"}]})
+        assert (result.inserted, result.updated) == (0, 1)
+        rows = (await db.execute(select(CompanyRating.symbol, CompanyRating.rating_score))).all()
+        assert rows == [("AAPL", 5)]
+    run(test)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from indicators import BAR_SECONDS, INDICATOR_FIELDS, IndicatorEngine, IndicatorState, recompute
+from models import TechnicalIndicators
+
+
+PER_BAR = 3
+
+
+def series(quotes: int = 150, seed: int = 3):
+    rng = np.random.default_rng(seed)
+    timestamps = 1_700_000_000 + np.arange(quotes) * (BAR_SECONDS // PER_BAR)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, quotes)))
+    return timestamps.tolist(), prices.tolist()
+
+
+def assert_same(incremental, full):
+    for field in INDICATOR_FIELDS:
+        if full[field] is None:
+            assert incremental[field] is None, field
+        else:
+            assert incremental[field] == pytest.approx(full[field], rel=1e-9), field
+
+
+def test_incremental_matches_a_full_recompute_on_every_quote():
+    state = IndicatorState()
+    closes, last_bucket = [], None
+    for timestamp, price in zip(*series()):
+        assert state.update(timestamp, price)
+        bucket = timestamp - timestamp % BAR_SECONDS
+        if bucket != last_bucket:
+            closes.append(price)
+            last_bucket = bucket
+        else:
+            closes[-1] = price
+        assert_same(state.values(), recompute(np.array(closes)))
+    assert state.bars == len(closes) - 1
+
+
+def test_indicators_start_once_there_are_enough_bars():
+    state = IndicatorState()
+    for timestamp, price in list(zip(*series()))[:10 * PER_BAR]:
+        state.update(timestamp, price)
+    assert state.values() == {"sma_20": None, "ema_20": None, "volatility_20": None, "rsi_14": None}
+    assert IndicatorState().values() == dict.fromkeys(INDICATOR_FIELDS)
+
+
+def test_old_or_incomplete_quotes_are_ignored():
+    state = IndicatorState()
+    assert state.update(1_700_000_000, 10.0)
+    assert not state.update(1_700_000_000, 11.0)
+    assert not state.update(1_699_999_000, 11.0)
+    assert not state.update(None, 11.0) and not state.update(1_700_000_100, None)
+    assert state.close == 10.0
+
+
+def test_backfill_and_stored_state_continue_like_the_incremental_one():
+    timestamps, prices = series()
+    state = IndicatorState()
+    for timestamp, price in zip(timestamps, prices):
+        state.update(timestamp, price)
+
+    buckets = np.array(timestamps) - np.array(timestamps) % BAR_SECONDS
+    ends = np.r_[np.flatnonzero(np.diff(buckets)), len(buckets) - 1]
+    backfilled = IndicatorState.from_bars(buckets[ends], np.array(prices)[ends], timestamps[-1])
+    assert_same(backfilled.values(), state.values())
+
+    stored = IndicatorState.from_model(TechnicalIndicators(**state.to_row("AAPL")))
+    following = timestamps[-1] + BAR_SECONDS
+    for copy in (backfilled, stored, state):
+        copy.update(following, prices[-1] * 1.05)
+    assert_same(backfilled.values(), state.values())
+    assert_same(stored.values(), state.values())
+
+
+def test_engine_only_keeps_advanced_states_after_apply():
+    engine = IndicatorEngine()
+    advanced = engine.advance([{"symbol": "AAPL", "timestamp": 1_700_000_000, "price": 10.0},
+                               {"symbol": "AAPL", "timestamp": 1_700_000_060, "price": 11.0},
+                               {"symbol": "KO", "timestamp": None, "price": 60.0}])
+    assert list(advanced) == ["AAPL"] and advanced["AAPL"].close == 11.0
+    # Sin commit (apply) el estado en memoria no se adelanta.
+    assert engine.get("AAPL") is None
+    engine.apply(advanced)
+    assert engine.get("AAPL").close == 11.0
@@ -0,0 +1,33 @@
+from registry import registry
+
+
+def request(foreign_symbol: str, cedear_symbol: str) -> dict:
+    return {"cedear_symbol": cedear_symbol, "foreign_market": "NASDAQ", "foreign_symbol": foreign_symbol,
+            "cedear_ratio": 10, "foreign_ratio": 1}
+
+
+def forget(api, symbol: str) -> int:
+    # Como si el alta la hubiera hecho otro worker y este todavia no recibio el aviso.
+    id = api.get(f"/instruments/{symbol}").json()["id"]
+    registry.remove(id)
+    return id
+
+
+def test_duplicate_create_missed_by_the_registry_is_a_400(api, add_instrument):
+    add_instrument("AAPL")
+    forget(api, "AAPL")
+    response = api.post("/instruments/create_instrument", json=request("AAPL", "AAPLD"))
+    assert response.status_code == 400
+    # La sesion quedo utilizable: el siguiente alta anda.
+    add_instrument("KO")
+    assert api.get("/instruments/KO").status_code == 200
+
+
+def test_duplicate_update_missed_by_the_registry_is_a_400(api, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    id = api.get("/instruments/AAPL").json()["id"]
+    forget(api, "KO")
+    assert api.put(f"/instruments/{id}", json=request("KO", "AAPL")).status_code == 400
+    assert api.get("/instruments/AAPL").json()["foreign_symbol"] == "AAPL"
+    assert api.put(f"/instruments/{id}", json=request("AAPL", "AAPLD")).status_code == 200
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from migrations import MigrationError, migrate
+from models import Base
+
+
+def legacy_database(test):
+    # Tablas como las dejaba una version anterior: el indice por simbolo existe pero no es unico.
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        try:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+                for table, column in [("stock_prices", "symbol"), ("company_rating", "symbol"),
+                                      ("instruments", "foreign_symbol")]:
+                    await connection.execute(text(f"DROP INDEX ix_{table}_{column}"))
+                    await connection.execute(text(f"CREATE INDEX ix_{table}_{column} ON {table} ({column})"))
+            async with engine.begin() as connection:
+                return await test(connection)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+def test_duplicate_quotes_keep_the_newest_and_log_the_removed_ids(caplog):
+    async def test(connection):
+        await connection.execute(text(
+            "INSERT INTO stock_prices (id, symbol, price, timestamp) VALUES "
+            "(1, 'AAPL', 190, 100), (2, 'AAPL', 200, 300), (3, 'AAPL', 195, 200), (4, 'KO', 60, NULL)"))
+        await connection.execute(text(
+            "INSERT INTO company_rating (id, symbol, rating_score) VALUES (1, 'AAPL', 3), (2, 'AAPL', 4)"))
+        with caplog.at_level(logging.WARNING, logger="migrations"):
+            await migrate(connection)
+        prices = (await connection.execute(text("SELECT symbol, price FROM stock_prices ORDER BY id"))).all()
+        ratings = (await connection.execute(text("SELECT id FROM company_rating"))).scalars().all()
+        await migrate(connection)
+        return prices, ratings
+    prices, ratings = legacy_database(test)
+    assert prices == [("AAPL", 200.0), ("KO", 60.0)]
+    assert ratings == [2]
+    assert "stock_prices" in caplog.text and "[1, 3]" in caplog.text
+    assert "company_rating" in caplog.text and "[1]" in caplog.text
+
+
+def test_duplicate_instruments_stop_the_startup_without_deleting():
+    async def test(connection):
+        await connection.execute(text(
+            "INSERT INTO instruments (id, cedear_symbol, foreign_symbol) VALUES "
+            "(1, 'AAPL', 'AAPL'), (2, 'AAPLD', 'AAPL'), (3, 'KO', 'KO')"))
+        with pytest.raises(MigrationError) as error:
+            await migrate(connection)
+        ids = (await connection.execute(text("SELECT id FROM instruments"))).scalars().all()
+        return error.value, ids
+    error, ids = legacy_database(test)
+    assert "AAPL (id 1), AAPL (id 2)" in str(error) and "KO" not in str(error)
+    assert sorted(ids) == [1, 2, 3]
+
+
+def test_migrate_creates_the_unique_indexes():
+    async def test(connection):
+        await connection.execute(text(
+            "INSERT INTO instruments (id, cedear_symbol, foreign_symbol) VALUES (1, 'KO', 'KO'), (2, 'KOD', NULL)"))
+        await migrate(connection)
+        return (await connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE 'CREATE UNIQUE%'"))).scalars().all()
+    assert set(legacy_database(test)) >= {"ix_stock_prices_symbol", "ix_company_rating_symbol",
+                                          "ix_instruments_foreign_symbol"}
+
+
+def test_migrate_adds_the_rating_refresh_column():
+    async def test(connection):
+        await connection.execute(text("ALTER TABLE company_rating DROP COLUMN updated_at"))
+        await connection.execute(text("INSERT INTO company_rating (id, symbol) VALUES (1, 'AAPL')"))
+        await migrate(connection)
+        await migrate(connection)
+        return (await connection.execute(text("SELECT symbol, updated_at FROM company_rating"))).all()
+    assert legacy_database(test) == [("AAPL", None)]
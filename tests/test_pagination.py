@@ -0,0 +1,49 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import NDJSON_MEDIA_TYPE, NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64", encode_cursor(1)[:-4], "e30="])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_keyset_pages_walk_every_instrument_once(api, add_instrument):
+    for symbol in ["AAPL", "MSFT", "KO", "TSLA", "MELI"]:
+        add_instrument(symbol)
+
+    seen, cursor = [], None
+    while True:
+        response = api.get("/instruments/", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        seen.extend(row["foreign_symbol"] for row in response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+
+    assert seen == ["AAPL", "MSFT", "KO", "TSLA", "MELI"]
+    # La ultima pagina vino corta: no hay cursor siguiente.
+    assert len(response.json()) == 1
+
+
+def test_instruments_stream_as_ndjson_after_the_cursor(api, add_instrument):
+    for symbol in ["AAPL", "MSFT", "KO"]:
+        add_instrument(symbol)
+    first = api.get("/instruments/", params={"limit": 1})
+
+    response = api.get("/instruments/", params={"stream": True, "cursor": first.headers[NEXT_CURSOR_HEADER]})
+    assert response.headers["content-type"].startswith(NDJSON_MEDIA_TYPE)
+    assert [json.loads(line)["foreign_symbol"] for line in response.text.splitlines()] == ["MSFT", "KO"]
+
+
+def test_invalid_cursor_is_rejected_by_the_api(api):
+    assert api.get("/instruments/", params={"cursor": "basura"}).status_code == 400
@@ -0,0 +1,52 @@
+# El screener, el arbitraje y los GET leen del snapshot en memoria; a la base solo van las relecturas por
+# simbolo despues de un refresh y el SELECT previo de los upserts. Esas tienen que usar indices, no SCAN.
+from typing import List
+
+import pytest
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.dialects import sqlite
+
+from models import Base, CompanyRating, StockPrice
+from snapshot import _prices_query, _ratings_query
+
+
+@pytest.fixture(scope="module")
+def connection():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        yield connection
+    engine.dispose()
+
+
+def query_plan(connection, query) -> List[str]:
+    sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def test_snapshot_reload_prices_searches_by_symbol(connection):
+    plan = query_plan(connection, _prices_query().where(StockPrice.symbol.in_(["AAPL", "MSFT"])))
+    assert any(step.startswith("SEARCH stock_prices USING INDEX") for step in plan), plan
+    assert not any(step.startswith("SCAN stock_prices") for step in plan), plan
+    assert not any(step.startswith("SCAN technical_indicators") for step in plan), plan
+
+
+def test_snapshot_reload_ratings_searches_by_symbol(connection):
+    plan = query_plan(connection, _ratings_query().where(CompanyRating.symbol.in_(["AAPL", "MSFT"])))
+    assert any(step.startswith("SEARCH company_rating USING INDEX") for step in plan), plan
+    assert not any(step.startswith("SCAN company_rating") for step in plan), plan
+
+
+def test_upsert_change_detection_searches_by_symbol(connection):
+    table = StockPrice.__table__
+    plan = query_plan(connection, select(table.c.symbol, table.c.price).where(table.c.symbol.in_(["AAPL", "MSFT"])))
+    assert any(step.startswith("SEARCH stock_prices USING") for step in plan), plan
+    assert not any(step.startswith("SCAN stock_prices") for step in plan), plan
+
+
+
+def test_rating_refresh_stamp_searches_by_symbol(connection):
+    plan = query_plan(connection, update(CompanyRating).where(CompanyRating.symbol.in_(["AAPL", "MSFT"]))
+                      .values(updated_at=1_700_000_000))
+    assert any(step.startswith("SEARCH company_rating USING INDEX") for step in plan), plan
+    assert not any(step.startswith("SCAN company_rating") for step in plan), plan
@@ -0,0 +1,136 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from crud import UpsertResult
+from fmp import FetchResult
+from fmp_client import CircuitBreaker
+from refresh import QUOTES, _refresh
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.open and breaker.allow()
+    breaker.failure()
+    assert breaker.open and not breaker.allow()
+
+
+def test_breaker_lets_a_single_probe_through_after_the_cooldown():
+    with mock.patch("fmp_client.time.monotonic", return_value=100.0):
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+        breaker.failure()
+    with mock.patch("fmp_client.time.monotonic", return_value=129.0):
+        assert not breaker.allow()
+    with mock.patch("fmp_client.time.monotonic", return_value=131.0):
+        assert breaker.allow()
+        assert not breaker.allow()
+        # La prueba fallo: vuelve a abrir por otro cooldown entero.
+        breaker.failure()
+        assert not breaker.allow()
+    with mock.patch("fmp_client.time.monotonic", return_value=162.0):
+        assert breaker.allow()
+        breaker.success()
+        assert not breaker.open and breaker.allow() and breaker.allow()
+
+
+def test_cancelled_probe_frees_the_slot():
+    with mock.patch("fmp_client.time.monotonic", return_value=100.0):
+        breaker = CircuitBreaker(threshold=1, cooldown=0)
+        breaker.failure()
+        assert breaker.allow()
+        breaker.release()
+        assert breaker.allow()
+
+
+def statuses(report):
+    return {symbol["symbol"]: symbol["status"] for symbol in report["symbols"]}
+
+
+def test_a_rejected_symbol_does_not_fail_its_quote_batch(api, fmp, add_instrument):
+    for symbol in ["AAPL", "MSFT", "KO", "MELI"]:
+        add_instrument(symbol)
+        fmp.quote(symbol)
+    fmp.errors["KO"] = 404
+    report = api.put("/stock_prices", params={"symbols": "AAPL,MSFT,KO,MELI"}).json()
+    assert statuses(report) == {"AAPL": "ok", "MSFT": "ok", "KO": "failed", "MELI": "ok"}
+    assert report["failed"] == 1 and report["inserted"] == 3
+    assert "HTTP 404" in next(symbol["error"] for symbol in report["symbols"] if symbol["symbol"] == "KO")
+
+
+def test_invalid_fmp_data_only_fails_that_symbol(api, fmp, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    fmp.quote("AAPL")
+    fmp.quote("KO", volume="mucho")
+    report = api.put("/stock_prices", params={"symbols": "AAPL,KO"}).json()
+    assert statuses(report) == {"AAPL": "ok", "KO": "failed"}
+    assert api.get("/stock_prices/AAPL").status_code == 200
+    assert api.get("/stock_prices/KO").status_code == 404
+
+
+def test_failed_ratings_are_reported_per_symbol(api, fmp, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    fmp.rating("AAPL")
+    fmp.errors["KO"] = 500
+    report = api.put("/company_rating").json()
+    assert statuses(report) == {"AAPL": "ok", "KO": "failed"}
+    # Reintentar solo los que fallaron, como indica el reporte.
+    del fmp.errors["KO"]
+    fmp.rating("KO")
+    report = api.put("/company_rating", params={"symbols": "KO"}).json()
+    assert statuses(report) == {"KO": "ok"}
+
+
+def test_single_symbol_refresh_answers_502_when_it_fails(api, fmp):
+    fmp.errors["AAPL"] = 503
+    response = api.put("/stock_prices/AAPL")
+    assert response.status_code == 502
+    assert response.json()["failed"] == 1
+
+
+class RollbackOnly:
+    async def rollback(self):
+        pass
+
+
+def store_failures(error: Exception, failing: str):
+    # Un store que falla con `error` en cada batch que contiene a `failing`; registra los batches que le llegan.
+    batches = []
+
+    async def store(db, batch):
+        batches.append(sorted(batch))
+        if failing in batch:
+            raise error
+        return UpsertResult(inserted=len(batch))
+    return store, batches
+
+
+def run_refresh(store, symbols):
+    async def fetched():
+        yield FetchResult(dict.fromkeys(symbols, {}), {}, dict.fromkeys(symbols, 0.0))
+    return asyncio.run(_refresh(RollbackOnly(), QUOTES, fetched(), lambda symbol, data: data, store))
+
+
+def test_rows_rejected_by_the_database_are_isolated_by_bisection():
+    store, batches = store_failures(IntegrityError("INSERT", {}, Exception("duplicado")), "C")
+    report = run_refresh(store, ["A", "B", "C", "D"])
+    assert report.failed_symbols == ["C"]
+    assert report.totals.inserted == 3
+    assert ["C"] in batches
+
+
+@pytest.mark.parametrize("error", [OperationalError("INSERT", {}, Exception("conexion cerrada")),
+                                   ConnectionResetError()])
+def test_other_database_errors_fail_the_batch_once(error):
+    store, batches = store_failures(error, "C")
+    report = run_refresh(store, ["A", "B", "C", "D"])
+    assert batches == [["A", "B", "C", "D"]]
+    assert sorted(report.failed_symbols) == ["A", "B", "C", "D"]
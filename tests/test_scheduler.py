@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from fmp_client import TokenBucket
+from refresh import QUOTES, RATINGS
+from scheduler import MIN_AGE_FRACTION, RefreshScheduler
+
+
+def test_token_bucket_never_exceeds_the_limit_in_a_minute():
+    bucket = TokenBucket(limit_per_minute=300, burst=10)
+    # Rafaga inicial + lo que se repone en 60s = el limite por minuto.
+    assert bucket.capacity + bucket.rate * 60 == 300
+    assert TokenBucket(limit_per_minute=5, burst=10).capacity == 4
+
+
+def test_token_bucket_spends_the_burst_then_waits_for_refill():
+    async def test():
+        bucket = TokenBucket(limit_per_minute=1201, burst=2)
+        started = time.monotonic()
+        for _ in range(2):
+            await bucket.acquire()
+        assert time.monotonic() - started < 0.02
+        assert bucket.available < 1
+
+        await bucket.acquire()
+        # 1199 tokens por minuto: el tercero espera ~50ms.
+        assert time.monotonic() - started >= 0.04
+    asyncio.run(test())
+
+
+def next_batch(scheduler):
+    return asyncio.run(asyncio.wait_for(scheduler._next(), timeout=1))
+
+
+@pytest.fixture
+def scheduler():
+    return RefreshScheduler(quote_interval=60, rating_interval=3600, workers=1, batch_size=3)
+
+
+def test_unknown_symbols_are_due_first_and_quotes_go_in_batches(scheduler):
+    now = time.time()
+    scheduler._set_symbols(QUOTES, ["AAPL", "MSFT", "KO", "MELI"], {"KO": now - 50, "MELI": now - 70})
+    scheduler._set_symbols(RATINGS, ["AAPL"], {"AAPL": now - 4000})
+
+    kind, symbols = next_batch(scheduler)
+    # El rating vencido hace 400s va antes que los quotes sin refresh conocido.
+    assert (kind, symbols) == (RATINGS, ["AAPL"])
+    kind, symbols = next_batch(scheduler)
+    # MELI vencio hace 10s y los nuevos vencen ahora; KO, que vence en 10s, no entra en el batch de 3.
+    assert kind == QUOTES and symbols[0] == "MELI" and sorted(symbols[1:]) == ["AAPL", "MSFT"]
+    assert next_batch(scheduler) == (QUOTES, ["KO"])
+
+
+def test_refreshed_symbols_are_rescheduled_one_interval_later(scheduler):
+    scheduler._set_symbols(QUOTES, ["AAPL"], {})
+    next_batch(scheduler)
+    before = time.time()
+    scheduler.mark_refreshed(QUOTES, ["AAPL"])
+    assert before + 60 <= scheduler._due[(QUOTES, "AAPL")] <= time.time() + 60
+
+
+def test_recently_refreshed_symbols_wait_for_the_minimum_age(scheduler):
+    scheduler._set_symbols(QUOTES, ["AAPL"], {})
+    scheduler.mark_refreshed(QUOTES, ["AAPL"])
+    # Aunque se lo fuerce a vencido, no se vuelve a pedir antes de MIN_AGE_FRACTION de la cadencia.
+    scheduler._schedule(QUOTES, "AAPL", time.time() - 1)
+    assert 60 * MIN_AGE_FRACTION > 1
+    with pytest.raises(asyncio.TimeoutError):
+        next_batch(scheduler)
+
+
+def test_removed_symbols_leave_the_queue(scheduler):
+    scheduler._set_symbols(QUOTES, ["AAPL", "KO"], {})
+    scheduler._set_symbols(QUOTES, ["KO"], {})
+    assert next_batch(scheduler) == (QUOTES, ["KO"])
+    assert scheduler._pop_valid() is None
+
+
+def test_reload_seeds_rating_due_times_from_the_last_refresh(api, fmp, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    fmp.rating("AAPL")
+    assert api.put("/company_rating/AAPL").status_code == 200
+    # Un refresh que no cambia el rating igual cuenta como refresco.
+    assert api.put("/company_rating/AAPL").json()["skipped"] == 1
+
+    scheduler = RefreshScheduler(quote_interval=60, rating_interval=3600)
+    api.portal.call(scheduler.reload_symbols)
+    now = time.time()
+    assert now + 3590 < scheduler._due[(RATINGS, "AAPL")] <= now + 3600
+    # Sin rating guardado, vencido ya.
+    assert scheduler._due[(RATINGS, "KO")] <= now
@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def market(api, fmp, add_instrument):
+    # Cuatro instrumentos listados y un quote (SPY) que no es de ningun instrumento.
+    for symbol in ["AAPL", "MSFT", "KO", "MELI"]:
+        add_instrument(symbol)
+    fmp.quote("AAPL", 200.0, pe=30.0, marketCap=3e12)
+    fmp.quote("MSFT", 400.0, pe=35.0, marketCap=3.1e12)
+    fmp.quote("KO", 60.0, pe=25.0, marketCap=2.6e11)
+    fmp.quote("MELI", 1500.0, pe=None, marketCap=7e10)
+    fmp.quote("SPY", 500.0, pe=20.0, marketCap=5e12)
+    fmp.rating("AAPL", 4, "A", "Buy")
+    fmp.rating("MSFT", 5, "A+", "Strong Buy")
+    fmp.rating("KO", 3, "B", "Neutral")
+    assert api.put("/stock_prices", params={"symbols": "AAPL,MSFT,KO,MELI,SPY"}).status_code == 200
+    assert api.put("/company_rating").status_code == 200
+    return api
+
+
+def symbols(response):
+    assert response.status_code == 200, response.text
+    return [row["symbol"] for row in response.json()]
+
+
+def test_screener_only_lists_instruments_sorted_by_market_cap(market):
+    assert symbols(market.get("/screener")) == ["MSFT", "AAPL", "KO", "MELI"]
+
+
+def test_screener_filters_by_ranges_and_recommendation(market):
+    assert symbols(market.get("/screener", params={"min_pe": 26, "max_pe": 40, "sort": "pe"})) == ["AAPL", "MSFT"]
+    assert symbols(market.get("/screener", params={"rating_recommendation": ["Buy", "Neutral"],
+                                                   "sort": "symbol"})) == ["AAPL", "KO"]
+    # Un PE nulo no cumple ningun rango.
+    assert "MELI" not in symbols(market.get("/screener", params={"max_pe": 1000}))
+
+
+def test_screener_sorts_nulls_last_and_applies_the_limit(market):
+    assert symbols(market.get("/screener", params={"sort": "-pe"})) == ["MSFT", "AAPL", "KO", "MELI"]
+    assert symbols(market.get("/screener", params={"sort": "pe"})) == ["KO", "AAPL", "MSFT", "MELI"]
+    assert symbols(market.get("/screener", params={"sort": "-rating_score", "limit": 2})) == ["MSFT", "AAPL"]
+
+
+def test_screener_joins_instrument_and_rating_columns(market):
+    row = market.get("/screener", params={"sort": "symbol", "limit": 1}).json()[0]
+    assert row["symbol"] == "AAPL" and row["cedear_symbol"] == "AAPL" and row["cedear_ratio"] == 10.0
+    assert row["rating_score"] == 4 and row["rating_recommendation"] == "Buy"
+    assert market.get("/screener", params={"sort": "symbol", "fields": "symbol,pe"}).json()[0] == {
+        "symbol": "AAPL", "pe": 30.0}
+
+
+def test_screener_rejects_unknown_sort_fields(market):
+    assert market.get("/screener", params={"sort": "name"}).status_code == 400
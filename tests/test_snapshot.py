@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from snapshot import FLOAT, INT, OBJECT, ColumnTable
+
+
+KINDS = {"id": INT, "symbol": OBJECT, "price": FLOAT, "volume": INT}
+
+
+@pytest.fixture
+def table():
+    return ColumnTable.from_rows(KINDS, [(1, "AAPL", 200.0, 1000), (4, "KO", None, 50), (9, "MSFT", 400.0, None)])
+
+
+def test_rows_keep_nulls_and_integers(table):
+    assert table.index == {"AAPL": 0, "KO": 1, "MSFT": 2}
+    assert table.row(1, ["symbol", "price", "volume"]) == {"symbol": "KO", "price": None, "volume": 50}
+    assert isinstance(table.row(0, ["volume"])["volume"], int)
+    assert table.values("volume") == [1000, 50, None]
+    assert table.take(np.array([2, 0]), ["symbol", "price"]) == [["MSFT", "AAPL"], [400.0, 200.0]]
+
+
+def test_empty_table():
+    table = ColumnTable.from_rows(KINDS, [])
+    assert table.size == 0 and table.index == {}
+    assert table.page(None, 10).tolist() == []
+
+
+def test_page_is_a_keyset_over_ids(table):
+    assert table.page(None, 2).tolist() == [0, 1]
+    # El cursor es el ultimo id visto, aunque ya no exista en la tabla.
+    assert table.page(4, 2).tolist() == [2]
+    assert table.page(5, None).tolist() == [2]
+    assert table.page(9, 2).tolist() == []
+
+
+def test_patched_copies_only_the_refreshed_columns(table):
+    patched = table.patched([{"symbol": "KO", "price": 61.0}])
+    assert patched.row(1, ["price", "volume"]) == {"price": 61.0, "volume": 50}
+    assert patched.columns["volume"] is table.columns["volume"]
+    # La tabla original no se toca: los lectores que la tienen siguen viendo lo de antes.
+    assert np.isnan(table.columns["price"][1])
+    assert patched.index is table.index
+
+
+def test_patched_gives_up_on_new_symbols(table):
+    assert table.patched([{"symbol": "MELI", "price": 1500.0}]) is None
+
+
+def test_lookup_aligns_like_a_left_join(table):
+    prices = table.lookup("price", ["MSFT", "MELI", "AAPL"])
+    assert prices[0] == 400.0 and np.isnan(prices[1]) and prices[2] == 200.0
+    assert table.lookup("symbol", ["KO", None]).tolist() == ["KO", None]
+
+
+def test_digest_follows_the_content(table):
+    same = ColumnTable.from_rows(KINDS, [(1, "AAPL", 200.0, 1000), (4, "KO", None, 50), (9, "MSFT", 400.0, None)])
+    assert table.digest == same.digest
+    assert table.patched([{"symbol": "KO", "price": 61.0}]).digest != table.digest
+
+
+def test_row_digest_follows_every_column_of_the_row(table):
+    assert table.row_digest(0) == ColumnTable.from_rows(KINDS, [(1, "AAPL", 200.0, 1000)]).row_digest(0)
+    patched = table.patched([{"symbol": "AAPL", "volume": 1001}])
+    assert patched.row_digest(0) != table.row_digest(0)
+    assert patched.row_digest(1) == table.row_digest(1)
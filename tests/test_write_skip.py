@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from database import engine
+from snapshot import FLOAT, INT, OBJECT, ColumnTable
+
+
+KINDS = {"id": INT, "symbol": OBJECT, "name": OBJECT, "price": FLOAT}
+
+
+def test_unchanged_compares_every_sent_column():
+    table = ColumnTable.from_rows(KINDS, [(1, "AAPL", "Apple", 200.0), (2, "KO", None, None)])
+    rows = [{"symbol": "AAPL", "name": "Apple", "price": 200.0},
+            {"symbol": "KO", "name": None, "price": None},
+            {"symbol": "AAPL", "name": "Apple", "price": 200.5},
+            {"symbol": "KO", "name": "Coca-Cola", "price": None},
+            {"symbol": "MELI", "name": None, "price": None}]
+    assert table.unchanged(rows) == [True, True, False, False, False]
+    # El id no viene de FMP y no cuenta.
+    assert table.unchanged([{"id": 99, "symbol": "AAPL", "price": 200.0}]) == [True]
+
+
+@contextmanager
+def statements():
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement.lstrip().split(None, 1)[0].upper())
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def quoted(api, fmp, add_instrument):
+    add_instrument("AAPL")
+    add_instrument("KO")
+    fmp.quote("AAPL", 200.0)
+    fmp.quote("KO", 60.0)
+    fmp.rating("AAPL")
+    fmp.rating("KO")
+    assert api.put("/stock_prices", params={"symbols": "AAPL,KO"}).json()["inserted"] == 2
+    assert api.put("/company_rating").json()["inserted"] == 2
+    return api
+
+
+def test_repeated_quotes_are_not_written(quoted):
+    with statements() as executed:
+        report = quoted.put("/stock_prices", params={"symbols": "AAPL,KO"}).json()
+    assert (report["written"], report["skipped"]) == (0, 2)
+    assert {symbol["status"] for symbol in report["symbols"]} == {"skipped"}
+    assert not {"INSERT", "UPDATE", "DELETE"} & set(executed), executed
+
+
+def test_only_changed_quotes_reach_the_database(quoted, fmp):
+    fmp.quote("KO", 61.0, timestamp=1_700_000_060)
+    report = quoted.put("/stock_prices", params={"symbols": "AAPL,KO"}).json()
+    assert (report["updated"], report["skipped"]) == (1, 1)
+    assert {symbol["symbol"]: symbol["status"] for symbol in report["symbols"]} == {"AAPL": "skipped", "KO": "ok"}
+    assert quoted.get("/stock_prices/KO").json()["price"] == 61.0
+
+
+def test_repeated_ratings_are_not_written(quoted, fmp):
+    fmp.rating("KO", 5, "A", "Buy")
+    with statements() as executed:
+        report = quoted.put("/company_rating").json()
+    assert (report["updated"], report["skipped"]) == (1, 1)
+    assert executed.count("INSERT") == 1
+    assert quoted.get("/company_rating/KO").json()["rating_recommendation"] == "Buy"